@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Compares CSV parser with the former csv.reader and strptime loop.
+
+Usage: bin/python-console benchmarks/csv_parser.py [--rows N] [--keep FILE]
+"""
+
+import argparse
+import csv
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from presence_analyzer.parsers import parse_csv
+from presence_analyzer.utils import seconds_since_midnight
+
+import datagen
+
+
+def legacy_parse_csv(csv_file):
+    """
+    Parsing loop used by get_data() before the dedicated parser.
+    """
+    presence_reader = csv.reader(csv_file, delimiter=',')
+    for row in presence_reader:
+        if len(row) != 4:
+            continue
+
+        try:
+            user_id = int(row[0])
+            date = datetime.strptime(row[1], '%Y-%m-%d').date()
+            start = datetime.strptime(row[2], '%H:%M:%S').time()
+            end = datetime.strptime(row[3], '%H:%M:%S').time()
+        except (ValueError, TypeError):
+            continue
+
+        yield (
+            user_id,
+            date.toordinal(),
+            seconds_since_midnight(start),
+            seconds_since_midnight(end),
+        )
+
+
+def measure(parser, file_name):
+    """
+    Returns parsing time in seconds and amount of parsed rows.
+    """
+    started = time.time()
+    with open(file_name, 'r') as csv_file:
+        count = sum(1 for _ in parser(csv_file))
+    return time.time() - started, count
+
+
+def main():
+    """
+    Runs the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10 ** 7)
+    parser.add_argument('--keep', help='reuse or keep generated file')
+    args = parser.parse_args()
+
+    file_name = args.keep or tempfile.mktemp(suffix='.csv')
+    if not os.path.exists(file_name):
+        print 'Generating {} rows in {}'.format(args.rows, file_name)
+        datagen.generate_csv(file_name, args.rows)
+
+    try:
+        results = {}
+        for name, func in (('legacy', legacy_parse_csv), ('fast', parse_csv)):
+            elapsed, count = measure(func, file_name)
+            results[name] = elapsed
+            print '{:>8}: {:8.2f}s {:12.0f} rows/s'.format(
+                name, elapsed, count / elapsed,
+            )
+        print ' speedup: {:8.2f}x'.format(results['legacy'] / results['fast'])
+    finally:
+        if not args.keep:
+            os.remove(file_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic presence data generator used by benchmarks.
+"""
+
+import random
+from datetime import date, timedelta
+
+CSV_LINE = '{},{},{:02}:{:02}:{:02},{:02}:{:02}:{:02}\n'
+
+# working days in a year
+YEAR = 260
+
+# about five years of working days
+DAYS_PER_USER = 5 * YEAR
+
+XML_HEADER = """<?xml version="1.0" encoding="UTF-8" ?>
+<intranet>
+    <server>
+        <host>intranet.stxnext.pl</host>
+        <port>443</port>
+        <protocol>https</protocol>
+    </server>
+    <users>
+"""
+
+XML_USER = """        <user id="{0}">
+            <avatar>/api/images/users/{0}</avatar>
+            <name>User {0}</name>
+        </user>
+"""
+
+XML_FOOTER = """    </users>
+</intranet>
+"""
+
+TEAMS_HEADER = """<?xml version="1.0" encoding="UTF-8" ?>
+<teams>
+"""
+
+TEAMS_FOOTER = """</teams>
+"""
+
+# users in every generated team
+TEAM_SIZE = 10
+
+
+def generate_csv(file_name, rows, days_per_user=DAYS_PER_USER, seed=0):
+    """
+    Writes CSV file with given amount of presence rows.
+
+    Rows are sorted by user and date like the intranet export.
+    """
+    rand = random.Random(seed)
+    first_day = date(2011, 1, 3)
+    with open(file_name, 'w') as csv_file:
+        user_id = 0
+        while rows > 0:
+            user_id += 1
+            day = first_day
+            for _ in xrange(min(days_per_user, rows)):
+                start = rand.randint(6 * 3600, 11 * 3600)
+                end = start + rand.randint(3600, 10 * 3600)
+                csv_file.write(CSV_LINE.format(
+                    user_id,
+                    day.isoformat(),
+                    start // 3600, start // 60 % 60, start % 60,
+                    end // 3600, end // 60 % 60, end % 60,
+                ))
+                day += timedelta(days=3 if day.weekday() == 4 else 1)
+            rows -= days_per_user
+    return file_name
+
+
+def generate_users_xml(file_name, users):
+    """
+    Writes users XML file with users numbered from 1, matching users
+    of generated CSV file.
+    """
+    with open(file_name, 'w') as xml_file:
+        xml_file.write(XML_HEADER)
+        for user_id in xrange(1, users + 1):
+            xml_file.write(XML_USER.format(user_id))
+        xml_file.write(XML_FOOTER)
+    return file_name
+
+
+def generate_teams_xml(file_name, users, team_size=TEAM_SIZE):
+    """
+    Writes teams XML file with users numbered from 1 split into teams
+    of given size.
+    """
+    with open(file_name, 'w') as xml_file:
+        xml_file.write(TEAMS_HEADER)
+        for first in xrange(1, users + 1, team_size):
+            xml_file.write('    <team id="{0}">\n'.format(first))
+            xml_file.write('        <name>Team {0}</name>\n'.format(first))
+            for user_id in xrange(first, min(first + team_size, users + 1)):
+                xml_file.write(
+                    '        <member id="{0}"/>\n'.format(user_id)
+                )
+            xml_file.write('    </team>\n')
+        xml_file.write(TEAMS_FOOTER)
+    return file_name
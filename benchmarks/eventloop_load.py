@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Compares event loop server with threaded server under load.
+
+Usage: bin/python-console benchmarks/eventloop_load.py [--users N]
+       [--idle I] [--clients C] [--requests R]
+
+Every server gets I idle connections, which never send a request,
+and then C clients send R keep-alive requests each.
+"""
+
+import argparse
+import httplib
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+from timeit import default_timer
+
+from werkzeug.serving import make_server
+
+from presence_analyzer import utils
+from presence_analyzer.eventloop import EventLoopServer
+from presence_analyzer.main import app
+
+import datagen
+from suite import percentile
+
+
+def start(server):
+    """
+    Runs given server in child process and returns its pid.
+    """
+    pid = os.fork()
+    if pid == 0:
+        try:
+            server.serve_forever()
+        finally:
+            os._exit(0)  # pylint: disable=protected-access
+    server.socket.close()
+    return pid
+
+
+def client(address, urls, latencies):
+    """
+    Requests given URLs on one connection and notes their latencies.
+    """
+    connection = httplib.HTTPConnection(*address)
+    for url in urls:
+        started = default_timer()
+        connection.request('GET', url)
+        connection.getresponse().read()
+        latencies.append(default_timer() - started)
+    connection.close()
+
+
+def load(address, args, user_ids):
+    """
+    Returns throughput and latencies of requests to server at address.
+    """
+    idle = []
+    for _ in xrange(args.idle):
+        idle.append(socket.create_connection(address))
+
+    latencies = []
+    threads = []
+    started = default_timer()
+    for i in xrange(args.clients):
+        urls = [
+            '/api/v1/mean_time_weekday/{}'.format(
+                user_ids[(i + j) % len(user_ids)]
+            )
+            for j in xrange(args.requests)
+        ]
+        thread = threading.Thread(
+            target=client, args=(address, urls, latencies)
+        )
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    elapsed = default_timer() - started
+    for sock in idle:
+        sock.close()
+
+    latencies.sort()
+    return len(latencies) / elapsed, latencies
+
+
+def main():
+    """
+    Runs the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--idle', type=int, default=500)
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=100)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        csv_name = os.path.join(directory, 'data.csv')
+        datagen.generate_csv(csv_name, args.users * datagen.YEAR)
+        app.config.update({'DATA_CSV': csv_name})
+        user_ids = utils.get_data().users
+
+        servers = (
+            ('threaded', make_server('127.0.0.1', 0, app, threaded=True)),
+            ('eventloop', EventLoopServer(app, '127.0.0.1', 0)),
+        )
+        for name, server in servers:
+            address = server.socket.getsockname()
+            pid = start(server)
+            try:
+                throughput, latencies = load(address, args, user_ids)
+            finally:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            print '{:>9}: {:8.0f} req/s p50 {:.4f}s p99 {:.4f}s'.format(
+                name, throughput, percentile(latencies, 50),
+                percentile(latencies, 99),
+            )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Compares integer-native helpers with the slicing ones they replaced.
+
+Usage: bin/python-console benchmarks/integer_paths.py [--users N]
+       [--years M] [--repeat R]
+
+Old helpers copied column slices of every user or built a set of all
+days on each call, new ones only read running sums and bisect sorted
+columns. Python 2 has no tracemalloc and these temporaries are freed
+before peak memory notices them, so time per call and the amount of
+values copied by old helpers are reported instead.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+from bisect import bisect_left
+from timeit import default_timer
+
+from presence_analyzer import utils
+from presence_analyzer.main import app
+
+import datagen
+from suite import uncached
+
+
+def sliced_quarters(data):
+    """
+    Quarters found from set of all days, like group_quarters() did.
+    """
+    return set(utils.quarter_of_day(day) for day in set(data.days))
+
+
+def sliced_overtime(data, quarter):
+    """
+    Overtime summed from column slices, like overtime_hours_in_quarter() did.
+    """
+    working_hours = 8 * utils.working_days_in_quarter(
+        quarter['year'], quarter['numeral']
+    )
+    begin, end = utils.quarter_days(quarter['year'], quarter['numeral'])
+    overtime = {}
+    for user, (first, last) in data.offsets.iteritems():
+        first = bisect_left(data.days, begin, first, last)
+        last = bisect_left(data.days, end, first, last)
+        seconds = sum(data.ends[first:last]) - sum(data.starts[first:last])
+        overtime[user] = seconds // 3600 - working_hours
+    return overtime
+
+
+def copied_values(data, quarter):
+    """
+    Returns amount of values copied into temporaries by old helpers.
+    """
+    begin, end = utils.quarter_days(quarter['year'], quarter['numeral'])
+    sliced = sum(
+        bisect_left(data.days, end, first, last) -
+        bisect_left(data.days, begin, first, last)
+        for first, last in data.offsets.itervalues()
+    )
+    return {
+        'group_quarters': len(data.days),
+        'overtime_hours_in_quarter': 2 * sliced,
+    }
+
+
+def measure(func, repeat):
+    """
+    Returns mean time of func call.
+    """
+    started = default_timer()
+    for _ in xrange(repeat):
+        func()
+    return (default_timer() - started) / repeat
+
+
+def main():
+    """
+    Runs the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        csv_name = os.path.join(directory, 'data.csv')
+        datagen.generate_csv(
+            csv_name, args.users * args.years * datagen.YEAR,
+            days_per_user=args.years * datagen.YEAR,
+        )
+        app.config.update({'DATA_CSV': csv_name})
+        data = utils.get_data()
+        quarter = utils.group_quarters(data)[0]
+        data.interval_sums()
+    finally:
+        shutil.rmtree(directory)
+
+    helpers = (
+        (
+            'group_quarters',
+            lambda: sliced_quarters(data),
+            lambda: uncached(utils.group_quarters)(data),
+        ),
+        (
+            'overtime_hours_in_quarter',
+            lambda: sliced_overtime(data, quarter),
+            lambda: utils.overtime_hours_in_quarter(data, quarter),
+        ),
+    )
+    copied = copied_values(data, quarter)
+    print '{} entries of {} users'.format(len(data.days), len(data))
+    for name, before, after in helpers:
+        old_time = measure(before, args.repeat)
+        new_time = measure(after, args.repeat)
+        print '{:>26}: {:9.6f}s -> {:9.6f}s per call, {} -> 0 copied'.format(
+            name, old_time, new_time, copied[name]
+        )
+
+
+if __name__ == '__main__':
+    main()
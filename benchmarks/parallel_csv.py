@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Measures scaling of CSV loading across worker processes.
+
+Usage: bin/python-console benchmarks/parallel_csv.py [--rows N]
+       [--workers W] [--keep FILE]
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from presence_analyzer import utils
+
+import datagen
+
+
+def measure(file_name, workers):
+    """
+    Returns time of loading the file from scratch and amount of entries.
+    """
+    started = time.time()
+    data = utils.PresenceLoader().load(file_name, workers=workers)
+    return time.time() - started, len(data.user_ids)
+
+
+def main():
+    """
+    Runs the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10 ** 7)
+    parser.add_argument(
+        '--workers', type=int, default=multiprocessing.cpu_count()
+    )
+    parser.add_argument('--keep', help='reuse or keep generated file')
+    args = parser.parse_args()
+
+    file_name = args.keep or tempfile.mktemp(suffix='.csv')
+    if not os.path.exists(file_name):
+        print 'Generating {} rows in {}'.format(args.rows, file_name)
+        datagen.generate_csv(file_name, args.rows)
+
+    try:
+        baseline = None
+        for workers in xrange(1, args.workers + 1):
+            elapsed, count = measure(file_name, workers)
+            baseline = baseline or elapsed
+            print '{:>3} workers: {:8.2f}s {:12.0f} rows/s {:6.2f}x'.format(
+                workers, elapsed, count / elapsed, baseline / elapsed,
+            )
+    finally:
+        if not args.keep:
+            os.remove(file_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of data loaders, aggregators and API endpoints on synthetic data.
+
+Usage: bin/python-console benchmarks/suite.py [--users N] [--years M]
+       [--repeat R] [--output FILE]
+
+Prints JSON report with throughput, latency percentiles and peak memory
+of every benchmark, so that runs can be compared.
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+from timeit import default_timer
+
+from presence_analyzer import utils
+from presence_analyzer.main import app
+
+import datagen
+
+
+def percentile(values, percent):
+    """
+    Returns given percentile of sorted values.
+    """
+    index = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def peak_memory():
+    """
+    Returns peak resident memory of the process in kilobytes.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(func, repeat, setup=None):
+    """
+    Calls func repeat times and returns summary of its latencies.
+    """
+    latencies = []
+    errors = 0
+    for _ in xrange(repeat):
+        if setup is not None:
+            setup()
+        started = default_timer()
+        if func() is False:
+            errors += 1
+        latencies.append(default_timer() - started)
+
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        'runs': repeat,
+        'errors': errors,
+        'total_s': total,
+        'throughput_per_s': repeat / total if total else None,
+        'latency_s': {
+            'min': latencies[0],
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1],
+        },
+        'peak_memory_kb': peak_memory(),
+    }
+
+
+def cold_data():
+    """
+    Drops loaded data, so the next get_data() call parses it again.
+    """
+    utils.get_data.cache_clear()
+    utils.presence_loader = utils.PresenceLoader()
+
+
+def cold_data_xml():
+    """
+    Drops loaded users, so the next get_data_xml() call parses them again.
+    """
+    utils.get_data_xml.cache_clear()
+    utils.users_loader = utils.XMLLoader(
+        utils.parse_users_xml, 'xml'
+    )
+
+
+def cold_teams():
+    """
+    Drops loaded teams, so the next get_teams() call parses them again.
+    """
+    utils.get_teams.cache_clear()
+    utils.teams_loader = utils.XMLLoader(
+        utils.parse_teams_xml, 'teams'
+    )
+
+
+def cold_responses():
+    """
+    Drops JSON bodies cached by json_response(), so the next requests
+    compute and encode them again.
+    """
+    for name, func in utils.CACHES.items():
+        if name.startswith('presence_analyzer.views.'):
+            func.cache_clear()
+
+
+def uncached(func):
+    """
+    Returns function which computes result without cached one.
+    """
+    def inner(*args):
+        """
+        Clears cache of func and calls it.
+        """
+        func.cache_clear()
+        return func(*args)
+    return inner
+
+
+def get(client, url):
+    """
+    Returns function requesting given URL, which is False on error.
+    """
+    def inner():
+        """
+        Requests the URL.
+        """
+        response = client.get(url)
+        # streamed responses are generated only while they are read
+        return len(response.data) > 0 and response.status_code == 200
+    return inner
+
+
+def run(args, directory):
+    """
+    Runs all benchmarks and returns the report.
+    """
+    csv_name = os.path.join(directory, 'data.csv')
+    xml_name = os.path.join(directory, 'users.xml')
+    teams_name = os.path.join(directory, 'teams.xml')
+    started = default_timer()
+    datagen.generate_csv(
+        csv_name, args.users * args.years * datagen.YEAR,
+        days_per_user=args.years * datagen.YEAR,
+    )
+    datagen.generate_users_xml(xml_name, args.users)
+    datagen.generate_teams_xml(teams_name, args.users)
+    generated = default_timer() - started
+
+    app.config.update({
+        'DATA_CSV': csv_name,
+        'DATA_XML': xml_name,
+        'DATA_TEAMS': teams_name,
+    })
+    cold_data()
+    cold_data_xml()
+    cold_teams()
+
+    results = {}
+    results['get_data'] = measure(
+        utils.get_data, args.repeat, setup=cold_data
+    )
+    results['get_data_xml'] = measure(
+        utils.get_data_xml, args.repeat, setup=cold_data_xml
+    )
+
+    data = utils.get_data()
+    user = data[data.users[0]]
+    quarters = utils.group_quarters(data)
+    results['group_by_weekday'] = measure(
+        lambda: uncached(utils.group_by_weekday)(user), args.repeat
+    )
+    results['group_quarters'] = measure(
+        lambda: uncached(utils.group_quarters)(data), args.repeat
+    )
+    results['overtime_hours_in_quarter'] = measure(
+        lambda: utils.overtime_hours_in_quarter(data, quarters[0]),
+        args.repeat
+    )
+
+    client = app.test_client()
+    user_id = data.users[0]
+    for url in (
+            '/api/v1/users',
+            '/api/v1/mean_time_weekday/{}'.format(user_id),
+            '/api/v1/presence_weekday/{}'.format(user_id),
+            '/api/v1/presence_start_end/{}'.format(user_id),
+            '/api/v1/weekdays?users=all',
+            '/api/v1/presence/export',
+            '/api/v1/quarters',
+            '/api/v1/overtime_in_quarter/0',
+            '/api/v1/teams',
+            '/api/v1/teams/mean_time_weekday',
+            '/api/v1/teams/overtime_in_quarter/0',
+    ):
+        results[url] = measure(get(client, url), args.repeat)
+        # without response cached by json_response()
+        results['cold ' + url] = measure(
+            get(client, url), args.repeat, setup=cold_responses
+        )
+
+    return {
+        'parameters': {
+            'users': args.users,
+            'years': args.years,
+            'rows': len(data.user_ids),
+            'repeat': args.repeat,
+            'python': sys.version.split()[0],
+            'generation_s': generated,
+        },
+        'results': results,
+    }
+
+
+def main():
+    """
+    Parses arguments and prints the report.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help='write report to file')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        report = run(args, directory)
+    finally:
+        shutil.rmtree(directory)
+
+    output = json.dumps(report, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    print output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Compares streaming users XML parser with the former ElementTree.parse one.
+
+Usage: bin/python-console benchmarks/users_xml.py [--users N]
+
+Every parser runs in a separate process, so that peak memory is measured
+independently.
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+from timeit import default_timer
+from xml.etree import ElementTree
+
+from presence_analyzer.parsers import parse_users_xml
+
+import datagen
+
+
+def legacy_parse_users_xml(file_name):
+    """
+    Parsing used by get_data_xml() before the streaming parser.
+    """
+    data = ElementTree.parse(file_name)
+    server = data.find('server')
+    link = '{}://{}:{}'.format(
+        server.find('protocol').text,
+        server.find('host').text,
+        server.find('port').text,
+    )
+    users = {}
+    for user in data.find('users'):
+        users[int(user.get('id'))] = {
+            'name': user.find('name').text,
+            'avatar': '{}{}'.format(link, user.find('avatar').text),
+        }
+    return users
+
+
+def measure(parser, file_name, results):
+    """
+    Puts parsing time and peak memory increase into results queue.
+    """
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = default_timer()
+    users = parser(file_name)
+    elapsed = default_timer() - started
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((elapsed, after - before, len(users)))
+
+
+def main():
+    """
+    Runs the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=100000)
+    args = parser.parse_args()
+
+    file_name = tempfile.mktemp(suffix='.xml')
+    datagen.generate_users_xml(file_name, args.users)
+    try:
+        for name, func in (('legacy', legacy_parse_users_xml),
+                           ('streaming', parse_users_xml)):
+            results = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=measure, args=(func, file_name, results),
+            )
+            process.start()
+            elapsed, memory, count = results.get()
+            process.join()
+            print '{:>10}: {:8.2f}s {:10} kB peak {:8} users'.format(
+                name, elapsed, memory, count,
+            )
+    finally:
+        os.remove(file_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -32,6 +32,7 @@ setup(
     [console_scripts]
     flask-ctl = presence_analyzer.script:run
     fetch-xml = presence_analyzer.script:retrieve_users
+    compile-data = presence_analyzer.script:compile_data
 
     [paste.app_factory]
     main = presence_analyzer.script:make_app
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+"""
+Presence entries kept in SQLite database instead of process memory.
+"""
+
+import os
+import sqlite3
+import threading
+from collections import Mapping
+from datetime import date
+
+from presence_analyzer.metrics import LOAD_LATENCY
+from presence_analyzer.parsers import parse_csv
+from presence_analyzer.store import AGGREGATES, Snapshot, seconds_to_time
+
+import logging
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS presence (
+    user_id INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    start_time INTEGER NOT NULL,
+    end_time INTEGER NOT NULL,
+    PRIMARY KEY (user_id, day)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS presence_day
+    ON presence (day, user_id, start_time, end_time);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# rows inserted at once while importing CSV file
+BATCH_SIZE = 10000
+
+# seconds to wait for lock held by other connection, like the one importing
+# the whole CSV file, before failing with "database is locked"
+BUSY_TIMEOUT = 600
+
+# entries fetched at once by SQLiteUserPresence.entries()
+ENTRIES_BATCH = 1000
+
+# bounds of date ordinals used when range is not limited
+FIRST_DAY = date.min.toordinal()
+LAST_DAY = date.max.toordinal()
+
+_local = threading.local()  # pylint: disable=invalid-name
+
+
+def connect(file_name):
+    """
+    Returns connection to given database, one for every thread.
+
+    Connections are not inherited by forked processes, they open their own.
+    """
+    connections = getattr(_local, 'connections', None)
+    if connections is None or _local.pid != os.getpid():
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+    connection = connections.get(file_name)
+    if connection is None:
+        connection = connections[file_name] = sqlite3.connect(
+            file_name, timeout=BUSY_TIMEOUT
+        )
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.executescript(SCHEMA)
+    return connection
+
+
+def import_csv(connection, file_name):
+    """
+    Imports lines of CSV file appended since the last import, or all of
+    them when the file was replaced or truncated.
+
+    Progress is read after taking the write lock and lines are imported
+    in the same transaction, together with removal of old entries, so
+    readers never see the table half-imported and other processes
+    importing the same file wait and then find the lines imported.
+
+    Returns (inode, offset) of CSV file the database is imported up to.
+    """
+    isolation_level = connection.isolation_level
+    # transaction is begun and ended explicitly
+    connection.isolation_level = None
+    try:
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            with open(file_name, 'rb') as csvfile:
+                progress = _import_lines(connection, file_name, csvfile)
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+    finally:
+        connection.isolation_level = isolation_level
+    return progress
+
+
+def _import_lines(connection, file_name, csvfile):
+    """
+    Imports new lines of opened CSV file within current transaction.
+    """
+    stat = os.fstat(csvfile.fileno())
+    meta = dict(connection.execute('SELECT key, value FROM meta'))
+    offset = meta.get('offset', 0)
+    lines = meta.get('lines', 0)
+    if meta.get('inode') != stat.st_ino or offset > stat.st_size:
+        log.debug('Importing %s from the beginning', file_name)
+        offset = lines = 0
+        connection.execute('DELETE FROM presence')
+    elif offset == stat.st_size:
+        return stat.st_ino, offset
+
+    progress = {'offset': offset, 'lines': lines}
+
+    def read_lines():
+        """
+        Yields lines and counts complete ones.
+        """
+        for line in csvfile:
+            yield line
+            if line.endswith('\n'):
+                progress['offset'] += len(line)
+                progress['lines'] += 1
+
+    with LOAD_LATENCY.time(('sqlite',)):
+        csvfile.seek(offset)
+        rows = parse_csv(read_lines(), lines)
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                connection.executemany(
+                    'INSERT OR REPLACE INTO presence VALUES (?, ?, ?, ?)',
+                    batch,
+                )
+                del batch[:]
+        connection.executemany(
+            'INSERT OR REPLACE INTO presence VALUES (?, ?, ?, ?)', batch
+        )
+        connection.executemany(
+            'INSERT OR REPLACE INTO meta VALUES (?, ?)',
+            [
+                ('inode', stat.st_ino),
+                ('offset', progress['offset']),
+                ('lines', progress['lines']),
+            ],
+        )
+    return stat.st_ino, progress['offset']
+
+
+class SQLiteLoader(object):
+    """
+    Imports presence data from CSV file into SQLite database.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stat = None
+        self.progress = None
+        self.data = None
+
+    def load(self, file_name, database_name):
+        """
+        Returns store of presence data imported from given CSV file.
+        New store is created only when the database changed, also when
+        lines were imported by other process.
+        """
+        with self.lock:
+            stat = os.stat(file_name)
+            key = (database_name, stat.st_ino, stat.st_size, stat.st_mtime)
+            if self.data is not None and key == self.stat:
+                return self.data
+            progress = (database_name,) + import_csv(
+                connect(database_name), file_name
+            )
+            if self.data is None or progress != self.progress:
+                self.data = SQLiteStore(database_name)
+            self.stat = key
+            self.progress = progress
+            return self.data
+
+
+class SQLiteStore(Snapshot, Mapping):
+    """
+    Read-only view on presence entries in SQLite database.
+
+    It behaves like PresenceStore, but entries are read by queries
+    using the primary key and indexes, so they are not kept in memory.
+    """
+
+    def __init__(self, file_name):
+        super(SQLiteStore, self).__init__()
+        self.file_name = file_name
+        self.users = [
+            user_id for user_id, in self.query(
+                'SELECT DISTINCT user_id FROM presence ORDER BY user_id'
+            )
+        ]
+        self.user_set = frozenset(self.users)
+
+    def query(self, sql, *args):
+        """
+        Returns cursor with results of given query.
+        """
+        return connect(self.file_name).execute(sql, args)
+
+    def days(self):
+        """
+        Returns set of dates ordinals with any entries.
+        """
+        return set(
+            day for day, in self.query('SELECT DISTINCT day FROM presence')
+        )
+
+    def total_seconds(self, first, last):
+        """
+        Returns total presence time of every user between given date
+        ordinals, last one excluded.
+        """
+        result = dict.fromkeys(self.users, 0)
+        result.update(self.query(
+            'SELECT user_id, SUM(end_time - start_time) FROM presence '
+            'WHERE day >= ? AND day < ? GROUP BY user_id',
+            first, last,
+        ))
+        return result
+
+    def __getitem__(self, user_id):
+        if user_id not in self.user_set:
+            raise KeyError(user_id)
+        return SQLiteUserPresence(self, user_id)
+
+    def __contains__(self, user_id):
+        return user_id in self.user_set
+
+    def __iter__(self):
+        return iter(self.users)
+
+    def __len__(self):
+        return len(self.users)
+
+
+class SQLiteUserPresence(Mapping):
+    """
+    Read-only view on presence entries of a single user in database.
+    """
+
+    def __init__(self, store, user_id, first=None, last=None):
+        self.store = store
+        self.user_id = user_id
+        self.first = first
+        self.last = last
+
+    def query(self, sql, *args):
+        """
+        Returns cursor with results of given query, where {} is replaced
+        by condition limiting entries to this view.
+        """
+        return self.store.query(
+            sql.format('user_id = ? AND day BETWEEN ? AND ?'),
+            self.user_id,
+            FIRST_DAY if self.first is None else self.first,
+            LAST_DAY if self.last is None else self.last,
+            *args
+        )
+
+    def between(self, first=None, last=None):
+        """
+        Returns view on entries from first to last date ordinal inclusive,
+        None means no limit.
+        """
+        if first is not None and self.first is not None:
+            first = max(first, self.first)
+        if last is not None and self.last is not None:
+            last = min(last, self.last)
+        return SQLiteUserPresence(
+            self.store, self.user_id,
+            self.first if first is None else first,
+            self.last if last is None else last,
+        )
+
+    def weekdays(self):
+        """
+        Returns (count, total interval, sum of starts, sum of ends) tuple
+        for every weekday.
+        """
+        result = [(0,) * AGGREGATES for _ in range(7)]
+        for row in self.query(
+                'SELECT (day - 1) % 7, COUNT(*), SUM(end_time - start_time), '
+                'SUM(start_time), SUM(end_time) FROM presence WHERE {} '
+                'GROUP BY 1'):
+            result[row[0]] = tuple(row[1:])
+        return result
+
+    def entries(self, skip=0, count=None):
+        """
+        Returns iterator of (day, start, end) tuples sorted by date,
+        skipping given amount of entries and stopping after count of them.
+
+        Entries are fetched in batches of ENTRIES_BATCH by separate queries
+        run to completion, continuing after the last fetched date, so no
+        cursor is left open between them and the iterator can be advanced
+        from any thread.
+        """
+        view = self
+        remaining = -1 if count is None else count
+        while remaining:
+            limit = ENTRIES_BATCH if remaining < 0 else \
+                min(remaining, ENTRIES_BATCH)
+            rows = view.query(
+                'SELECT day, start_time, end_time FROM presence WHERE {} '
+                'ORDER BY day LIMIT ? OFFSET ?',
+                limit, skip,
+            ).fetchall()
+            for row in rows:
+                yield row
+            if len(rows) < limit:
+                return
+            if remaining > 0:
+                remaining -= len(rows)
+            skip = 0
+            view = view.between(rows[-1][0] + 1)
+
+    def __getitem__(self, day):
+        ordinal = day.toordinal()
+        if self.first is not None and ordinal < self.first or \
+           self.last is not None and ordinal > self.last:
+            raise KeyError(day)
+        row = self.store.query(
+            'SELECT start_time, end_time FROM presence '
+            'WHERE user_id = ? AND day = ?',
+            self.user_id, ordinal,
+        ).fetchone()
+        if row is None:
+            raise KeyError(day)
+        return {
+            'start': seconds_to_time(row[0]),
+            'end': seconds_to_time(row[1]),
+        }
+
+    def __iter__(self):
+        for day, _, _ in self.entries():
+            yield date.fromordinal(day)
+
+    def __len__(self):
+        return self.query(
+            'SELECT COUNT(*) FROM presence WHERE {}'
+        ).fetchone()[0]
+
+    def __eq__(self, other):
+        if isinstance(other, SQLiteUserPresence):
+            return (self.store, self.user_id, self.first, self.last) == \
+                (other.store, other.user_id, other.first, other.last)
+        return super(SQLiteUserPresence, self).__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.store, self.user_id, self.first, self.last))
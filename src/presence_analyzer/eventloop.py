@@ -0,0 +1,596 @@
+# -*- coding: utf-8 -*-
+"""
+Event-driven HTTP server for the WSGI application.
+
+All connections are kept by one thread running asyncore loop, so idle
+keep-alive connections cost only a socket. Complete requests are handed
+to a small thread pool running the application, and the same concurrent
+GET requests are coalesced into a single call of the application.
+
+Responses are pulled from the application in batches, the next one only
+after connections sent most of the previous ones, so clients which read
+slowly don't make whole responses buffered in memory.
+"""
+
+import asynchat
+import asyncore
+import os
+import socket
+import sys
+import threading
+import time
+from collections import deque
+from cStringIO import StringIO
+from Queue import Queue
+from urllib import unquote
+from wsgiref.handlers import format_date_time
+
+import logging
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# largest accepted request head and body in bytes
+MAX_HEAD_SIZE = 64 * 1024
+MAX_BODY_SIZE = 1024 * 1024
+
+# amount of response bytes sent from worker thread to the loop at once
+BATCH_SIZE = 64 * 1024
+
+# next batch of response is pulled once every connection waiting for it
+# has less than this amount of bytes left to send
+HIGH_WATER_MARK = 256 * 1024
+
+# request headers which response depends on, besides method and URL
+VARY = ('HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE', 'HTTP_RANGE')
+
+
+class Group(object):
+    """
+    Connections waiting for response of the same application call.
+    """
+
+    def __init__(self, channel, key, path):
+        self.channels = [channel]
+        self.key = key
+        self.path = path
+        self.started = False
+        self.result = None
+        self.iterator = None
+        self.waiting = False
+
+
+class Waker(asyncore.file_dispatcher):
+    """
+    Read end of a pipe, which wakes the loop up when worker threads
+    post events.
+    """
+
+    def __init__(self, server, map=None):  # pylint: disable=redefined-builtin
+        self.server = server
+        self.lock = threading.Lock()
+        read_end, self.write_end = os.pipe()
+        asyncore.file_dispatcher.__init__(self, read_end, map)
+        os.close(read_end)
+
+    def wake(self):
+        """
+        Makes the loop call handle_read().
+        """
+        with self.lock:
+            # descriptor of closed pipe could be reused by other file
+            if self.write_end is not None:
+                os.write(self.write_end, '\0')
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        self.recv(4096)
+        self.server.dispatch_events()
+
+    def close(self):
+        with self.lock:
+            if self.write_end is not None:
+                os.close(self.write_end)
+                self.write_end = None
+        asyncore.file_dispatcher.close(self)
+
+
+class HTTPChannel(asynchat.async_chat):
+    """
+    Connection of one client, which may send many requests one by one.
+    """
+    ac_out_buffer_size = 64 * 1024
+
+    def __init__(self, server, sock, address, map=None):
+        # pylint: disable=redefined-builtin
+        asynchat.async_chat.__init__(self, sock, map)
+        # head and body are sent separately, don't wait for acks between
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server = server
+        self.address = address
+        self.data = []
+        self.size = 0
+        self.environ = None
+        self.requests = deque()
+        self.busy = False
+        self.protocol = None
+        self.keep_alive = False
+        self.chunked = False
+        self.head = False
+        self.started = False
+        self.rejected = False
+        self.group = None
+        self.pending = 0  # bytes pushed but not sent yet
+        self.active = time.time()
+        self.set_terminator('\r\n\r\n')
+
+    def collect_incoming_data(self, data):
+        self.active = time.time()
+        if self.rejected:
+            return
+        self.size += len(data)
+        if self.environ is None and self.size > MAX_HEAD_SIZE:
+            log.warning('Too large request from %s', self.address[0])
+            self.close()
+            return
+        self.data.append(data)
+
+    def found_terminator(self):
+        data = ''.join(self.data)
+        self.data = []
+        self.size = 0
+        if self.environ is None:
+            try:
+                self.environ = self.parse(data)
+            except ValueError:
+                log.debug('Malformed request from %s', self.address[0])
+                self.close()
+                return
+            length = int(self.environ.get('CONTENT_LENGTH') or 0)
+            if length > MAX_BODY_SIZE:
+                log.warning('Too large request from %s', self.address[0])
+                # answered after requests sent before, nothing more is read
+                self.requests.append(None)
+                self.environ = None
+                self.rejected = True
+                self.set_terminator(None)
+                if not self.busy:
+                    self.next_request()
+                return
+            if length > 0:
+                self.set_terminator(length)
+                return
+            data = ''
+
+        self.environ['wsgi.input'] = StringIO(data)
+        self.requests.append(self.environ)
+        self.environ = None
+        self.set_terminator('\r\n\r\n')
+        if not self.busy:
+            self.next_request()
+
+    def parse(self, data):
+        """
+        Returns WSGI environ of request with given head.
+        """
+        lines = data.lstrip('\r\n').split('\r\n')
+        method, target, version = lines[0].split(' ')
+        if not version.startswith('HTTP/'):
+            raise ValueError(version)
+        path, _, query = target.partition('?')
+        environ = {
+            'REQUEST_METHOD': method.upper(),
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote(path),
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.server.address[0],
+            'SERVER_PORT': str(self.server.address[1]),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': self.address[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            name = name.strip().upper().replace('-', '_')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = 'HTTP_' + name
+            environ[name] = value.strip()
+        return environ
+
+    def next_request(self):
+        """
+        Passes the oldest waiting request to the server.
+        """
+        if not self.requests:
+            return
+        environ = self.requests.popleft()
+        if environ is None:
+            self.push(
+                'HTTP/1.1 413 REQUEST ENTITY TOO LARGE\r\n'
+                'Content-Length: 0\r\nConnection: close\r\n\r\n'
+            )
+            self.requests.clear()
+            self.close_when_done()
+            return
+        connection = environ.get('HTTP_CONNECTION', '').lower()
+        self.protocol = environ['SERVER_PROTOCOL']
+        if self.protocol == 'HTTP/1.1':
+            self.keep_alive = connection != 'close'
+        else:
+            self.keep_alive = connection == 'keep-alive'
+        self.head = environ['REQUEST_METHOD'] == 'HEAD'
+        self.busy = True
+        self.started = False
+        self.server.submit(self, environ)
+
+    def readable(self):
+        return not self.busy and not self.rejected and \
+            asynchat.async_chat.readable(self)
+
+    def push(self, data):
+        self.pending += len(data)
+        asynchat.async_chat.push(self, data)
+
+    def send(self, data):
+        sent = asynchat.async_chat.send(self, data)
+        if sent:
+            self.pending -= sent
+            self.active = time.time()
+            if self.group is not None and self.pending < HIGH_WATER_MARK:
+                self.server.resume(self.group)
+        return sent
+
+    def idle(self, now, timeout):
+        """
+        Tells whether the connection waits for the next request, or for
+        the client reading response, longer than given timeout.
+        """
+        return now - self.active > timeout and \
+            (not self.busy or self.pending > 0)
+
+    def close(self):
+        asynchat.async_chat.close(self)
+        if self.group is not None:
+            self.server.resume(self.group)
+
+    def start_response(self, status, headers):
+        """
+        Sends status line and headers.
+        """
+        names = set(name.lower() for name, _ in headers)
+        self.chunked = False
+        if 'content-length' not in names and not self.head and \
+           status[:3] not in ('204', '304'):
+            if self.keep_alive and self.protocol == 'HTTP/1.1':
+                self.chunked = True
+                headers = headers + [('Transfer-Encoding', 'chunked')]
+            else:
+                self.keep_alive = False
+        headers = headers + [
+            ('Date', format_date_time(time.time())),
+            ('Connection', 'keep-alive' if self.keep_alive else 'close'),
+        ]
+        self.started = True
+        self.push('HTTP/1.1 {}\r\n{}\r\n\r\n'.format(
+            status,
+            '\r\n'.join('{}: {}'.format(name, value)
+                        for name, value in headers),
+        ))
+
+    def write(self, data):
+        """
+        Sends part of response body.
+        """
+        if self.head:
+            return
+        if self.chunked:
+            self.push('{:x}\r\n{}\r\n'.format(len(data), data))
+        else:
+            self.push(data)
+
+    def finish(self):
+        """
+        Ends response and waits for the next request.
+        """
+        if self.chunked:
+            self.push('0\r\n\r\n')
+        self.busy = False
+        self.group = None
+        self.active = time.time()
+        if self.keep_alive:
+            self.next_request()
+        else:
+            self.requests.clear()
+            self.close_when_done()
+
+    def fail(self):
+        """
+        Ends response after the application failed.
+        """
+        if not self.started:
+            self.push(
+                'HTTP/1.1 500 INTERNAL SERVER ERROR\r\n'
+                'Content-Length: 0\r\nConnection: close\r\n\r\n'
+            )
+        self.group = None
+        self.requests.clear()
+        self.close_when_done()
+
+    def handle_error(self):
+        log.exception('Connection with %s failed', self.address[0])
+        self.close()
+
+
+class EventLoopServer(asyncore.dispatcher):
+    """
+    Serves WSGI application from one event loop and a thread pool.
+
+    Responses of concurrent GET and HEAD requests with the same URL and
+    conditional headers are computed once and sent to every client which
+    asked before the application started responding.
+
+    Given refresh functions, like get_data, are called in the pool every
+    refresh_interval seconds, so data is reloaded before requests need it.
+
+    Connections idle for idle_timeout seconds, between requests or while
+    the client doesn't read the response, are closed.
+    """
+
+    def __init__(self, app, host, port, threads=8, refresh=(),
+                 refresh_interval=10, idle_timeout=75, backlog=1024):
+        self.map = {}
+        asyncore.dispatcher.__init__(self, map=self.map)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((host, port))
+        self.listen(backlog)
+        self.address = self.socket.getsockname()
+
+        self.app = app
+        self.threads = threads
+        self.tasks = Queue()
+        self.waker = Waker(self, self.map)
+        self.events = deque()
+        self.coalescing = {}
+        self.refresh = refresh
+        self.refresh_interval = refresh_interval
+        self.refreshing = threading.Event()
+        self.refreshed = 0
+        self.idle_timeout = idle_timeout
+        self.checked = time.time()
+        self.running = False
+
+    def handle_accept(self):
+        # accept all waiting connections, so the backlog doesn't overflow
+        while True:
+            pair = self.accept()
+            if pair is None:
+                return
+            HTTPChannel(self, pair[0], pair[1], self.map)
+
+    def submit(self, channel, environ):
+        """
+        Runs application for given request or joins the same one
+        which is waiting for response.
+        """
+        key = None
+        if environ['REQUEST_METHOD'] in ('GET', 'HEAD'):
+            key = (environ['REQUEST_METHOD'], environ['PATH_INFO'],
+                   environ['QUERY_STRING']) + tuple(
+                       environ.get(name) for name in VARY
+                   )
+            group = self.coalescing.get(key)
+            if group is not None:
+                group.channels.append(channel)
+                channel.group = group
+                return
+        group = Group(channel, key, environ['PATH_INFO'])
+        channel.group = group
+        if key is not None:
+            self.coalescing[key] = group
+        self.tasks.put((self.call, (group, environ)))
+
+    def post(self, group, actions, done):
+        """
+        Queues actions for the loop thread, called from worker threads.
+        """
+        self.events.append((group, actions, done))
+        self.waker.wake()
+
+    def call(self, group, environ):
+        """
+        Calls the application in worker thread and posts the first batch
+        of its response.
+        """
+        actions = []
+
+        def write(data):
+            """
+            Collects part of response body written by the application.
+            """
+            actions.append(('write', data))
+
+        def start_response(status, headers, exc_info=None):
+            """
+            Collects status and headers of the response.
+            """
+            # pylint: disable=unused-argument
+            actions.append(('start_response', status, list(headers)))
+            return write
+
+        try:
+            group.result = self.app(environ, start_response)
+            group.iterator = iter(group.result)
+        except Exception:  # pylint: disable=broad-except
+            log.exception('Request %s failed', group.path)
+            self.release(group)
+            self.post(group, actions + [('fail',)], True)
+            return
+        self.pull(group, actions)
+
+    def pull(self, group, actions=()):
+        """
+        Posts next batch of about BATCH_SIZE bytes of response, called in
+        worker thread when the loop asks for it, see resume().
+        """
+        actions = list(actions)
+        size = 0
+        try:
+            while size < BATCH_SIZE:
+                data = next(group.iterator, None)
+                if data is None:
+                    break
+                if data:
+                    actions.append(('write', data))
+                    size += len(data)
+            else:
+                self.post(group, actions, False)
+                return
+        except Exception:  # pylint: disable=broad-except
+            log.exception('Request %s failed', group.path)
+            self.release(group)
+            actions.append(('fail',))
+        else:
+            actions.append(('finish',) if self.release(group) else ('fail',))
+        self.post(group, actions, True)
+
+    def release(self, group):
+        """
+        Closes response of given group, returns False when it failed.
+        """
+        close = getattr(group.result, 'close', None)
+        group.result = group.iterator = None
+        if close is not None:
+            try:
+                close()
+            except Exception:  # pylint: disable=broad-except
+                log.exception('Closing response of %s failed', group.path)
+                return False
+        return True
+
+    def resume(self, group):
+        """
+        Asks for next batch of response once every connection of the group
+        has sent most of the previous ones, or closes the response when
+        all of them are gone. Called in the loop thread.
+        """
+        if not group.waiting:
+            return
+        channels = [
+            channel for channel in group.channels
+            if channel.connected and channel.group is group
+        ]
+        if any(channel.pending >= HIGH_WATER_MARK for channel in channels):
+            return
+        group.waiting = False
+        if channels:
+            self.tasks.put((self.pull, (group,)))
+        else:
+            self.tasks.put((self.release, (group,)))
+
+    def dispatch_events(self):
+        """
+        Passes actions posted by worker threads to waiting connections.
+        """
+        while self.events:
+            group, actions, done = self.events.popleft()
+            if not group.started:
+                group.started = True
+                if self.coalescing.get(group.key) is group:
+                    del self.coalescing[group.key]
+            for channel in group.channels:
+                try:
+                    for action in actions:
+                        if not channel.connected:
+                            break
+                        getattr(channel, action[0])(*action[1:])
+                except Exception:  # pylint: disable=broad-except
+                    channel.handle_error()
+            if not done:
+                group.waiting = True
+                self.resume(group)
+
+    def close_idle(self):
+        """
+        Closes idle connections, checked once a second.
+        """
+        now = time.time()
+        if now - self.checked < 1:
+            return
+        self.checked = now
+        for channel in self.map.values():
+            if isinstance(channel, HTTPChannel) and \
+               channel.idle(now, self.idle_timeout):
+                log.debug('Closing idle connection of %s',
+                          channel.address[0])
+                channel.close()
+
+    def schedule_refresh(self):
+        """
+        Starts refresh in the pool when it's time.
+        """
+        if not self.refresh or self.refreshing.is_set() or \
+           time.time() - self.refreshed < self.refresh_interval:
+            return
+        self.refreshing.set()
+        self.tasks.put((self.run_refresh, ()))
+
+    def run_refresh(self):
+        """
+        Calls refresh functions in worker thread.
+        """
+        try:
+            for func in self.refresh:
+                try:
+                    func()
+                except Exception:  # pylint: disable=broad-except
+                    log.exception('Refreshing %s failed', func.__name__)
+        finally:
+            self.refreshed = time.time()
+            self.refreshing.clear()
+
+    def serve_forever(self, timeout=1):
+        """
+        Runs the loop until stop() is called.
+        """
+        # threads are started here, so the server can be forked before
+        threads = [
+            threading.Thread(target=self.work) for _ in xrange(self.threads)
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        self.running = True
+        log.info('Serving on %s:%s', self.address[0], self.address[1])
+        try:
+            while self.running:
+                self.schedule_refresh()
+                self.close_idle()
+                asyncore.loop(timeout, True, self.map, 1)
+        finally:
+            for thread in threads:
+                self.tasks.put(None)
+            asyncore.close_all(self.map)
+
+    def work(self):
+        """
+        Runs tasks in worker thread until None is received.
+        """
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            func, args = task
+            func(*args)
+
+    def stop(self):
+        """
+        Stops the loop, can be called from any thread.
+        """
+        self.running = False
+        self.waker.wake()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Conditional download of users XML file.
+"""
+
+import os
+import shutil
+import tempfile
+import urllib2
+from email.utils import formatdate, mktime_tz, parsedate_tz
+
+from presence_analyzer.parsers import parse_users_xml
+
+import logging
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# amount of bytes copied from response at once
+BLOCK_SIZE = 64 * 1024
+
+
+def etag_file(file_name):
+    """
+    Returns name of file keeping ETag of given downloaded file.
+    """
+    return '{}.etag'.format(file_name)
+
+
+def fetch_users_xml(url, file_name, timeout=60):
+    """
+    Downloads users XML file from url, if it changed since the last time.
+
+    Request carries If-None-Match with ETag of the last download and
+    If-Modified-Since with modification time of the file, which is set
+    from Last-Modified header. Response is written next to the target,
+    parsed and only then renamed over it, so readers never see partial
+    or malformed file.
+
+    Returns True when the file was replaced.
+    """
+    request = urllib2.Request(url)
+    if os.path.exists(file_name):
+        request.add_header(
+            'If-Modified-Since',
+            formatdate(os.stat(file_name).st_mtime, usegmt=True),
+        )
+        try:
+            with open(etag_file(file_name)) as etag:
+                request.add_header('If-None-Match', etag.read().strip())
+        except IOError:
+            pass
+
+    try:
+        response = urllib2.urlopen(request, timeout=timeout)
+    except urllib2.HTTPError as error:
+        if error.code == 304:
+            log.info('%s not modified', url)
+            return False
+        raise
+
+    directory = os.path.dirname(os.path.abspath(file_name))
+    handle, temp_name = tempfile.mkstemp(dir=directory, suffix='.xml')
+    try:
+        with os.fdopen(handle, 'wb') as temp:
+            shutil.copyfileobj(response, temp, BLOCK_SIZE)
+        response.close()
+        users = parse_users_xml(temp_name)
+
+        last_modified = response.info().getheader('Last-Modified')
+        if last_modified and parsedate_tz(last_modified):
+            modified = mktime_tz(parsedate_tz(last_modified))
+            os.utime(temp_name, (modified, modified))
+        os.chmod(temp_name, 0644)
+        os.rename(temp_name, file_name)
+    except Exception:
+        os.remove(temp_name)
+        raise
+
+    etag = response.info().getheader('ETag')
+    if etag:
+        with open(etag_file(file_name), 'w') as etag_output:
+            etag_output.write(etag)
+    elif os.path.exists(etag_file(file_name)):
+        os.remove(etag_file(file_name))
+    log.info('Downloaded %s users from %s', len(users), url)
+    return True
+
+
+def notify_reload(url, timeout=10):
+    """
+    Asks running application at given reload URL to load data again.
+    """
+    try:
+        urllib2.urlopen(urllib2.Request(url, data=''), timeout=timeout)
+    except (urllib2.URLError, IOError):
+        log.warning('Reloading application at %s failed', url, exc_info=True)
+        return False
+    return True
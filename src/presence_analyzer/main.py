@@ -5,6 +5,9 @@ Flask app initialization.
 from flask import Flask
 from flask_mako import MakoTemplates
 
+from presence_analyzer.metrics import instrument
+
 
 app = Flask(__name__)  # pylint: disable=invalid-name
 mako = MakoTemplates(app)
+instrument(app)
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight metrics exposed in Prometheus text format.
+"""
+
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from timeit import default_timer
+
+from flask import g, request
+
+# upper bounds of histogram buckets in seconds
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+
+REGISTRY = []
+
+
+def format_labels(names, values, extra=()):
+    """
+    Returns labels formatted like {name="value",other="value"}.
+    """
+    pairs = zip(names, values) + list(extra)
+    if not pairs:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(
+            name,
+            unicode(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'),
+        )
+        for name, value in pairs
+    ))
+
+
+def format_value(value):
+    """
+    Returns number formatted for exposition.
+    """
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Metric(object):
+    """
+    Base of metrics, which keep values for every combination of labels.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=(), register=True):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+        if register:
+            REGISTRY.append(self)
+
+    def samples(self):
+        """
+        Yields (suffix, labels, value) tuples.
+        """
+        with self.lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            yield '', format_labels(self.labels, labels), value
+
+    def render(self):
+        """
+        Returns lines of metric in Prometheus text format.
+        """
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} {}'.format(self.name, self.kind),
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append('{}{}{} {}'.format(
+                self.name, suffix, labels, format_value(value)
+            ))
+        return lines
+
+    def clear(self):
+        """
+        Removes all values.
+        """
+        with self.lock:
+            self.values.clear()
+
+
+class Counter(Metric):
+    """
+    Value which only goes up.
+    """
+    kind = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        """
+        Increases value for given labels.
+        """
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Histogram(Metric):
+    """
+    Counts observed values in buckets.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=DEFAULT_BUCKETS, register=True):
+        super(Histogram, self).__init__(name, documentation, labels, register)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        """
+        Adds value observed for given labels.
+        """
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                # one count for every bucket, overflow, then sum
+                counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+            counts[i] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, labels=()):
+        """
+        Observes time spent in with block.
+        """
+        started = default_timer()
+        try:
+            yield
+        finally:
+            self.observe(default_timer() - started, labels)
+
+    def samples(self):
+        with self.lock:
+            values = sorted(
+                (labels, list(counts))
+                for labels, counts in self.values.items()
+            )
+        bounds = [repr(float(bound)) for bound in self.buckets] + ['+Inf']
+        for labels, counts in values:
+            total = 0
+            for bound, count in zip(bounds, counts):
+                total += count
+                yield '_bucket', format_labels(
+                    self.labels, labels, [('le', bound)]
+                ), total
+            yield '_sum', format_labels(self.labels, labels), counts[-1]
+            yield '_count', format_labels(self.labels, labels), total
+
+
+class Collector(Metric):
+    """
+    Metric which values are read from given function when rendered.
+    The function returns list of (labels, value) tuples.
+    """
+
+    def __init__(self, name, documentation, kind, labels, collect,
+                 register=True):
+        super(Collector, self).__init__(name, documentation, labels, register)
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self):
+        for labels, value in sorted(self.collect()):
+            yield '', format_labels(self.labels, labels), value
+
+
+def render():
+    """
+    Returns all registered metrics in Prometheus text format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+REQUEST_LATENCY = Histogram(
+    'presence_request_latency_seconds',
+    'Time spent handling requests.',
+    labels=('endpoint',),
+)
+
+REQUESTS = Counter(
+    'presence_requests_total',
+    'Handled requests.',
+    labels=('endpoint', 'status'),
+)
+
+LOAD_LATENCY = Histogram(
+    'presence_load_seconds',
+    'Time spent loading data files.',
+    labels=('source',),
+)
+
+ROWS = Counter(
+    'presence_csv_rows_total',
+    'Parsed rows of CSV file.',
+    labels=('status',),
+)
+
+
+def instrument(app):
+    """
+    Measures time of every request handled by given app.
+    """
+    @app.before_request
+    def start_timer():  # pylint: disable=unused-variable
+        """
+        Remembers when request started.
+        """
+        g.request_started = default_timer()
+
+    @app.after_request
+    def stop_timer(response):  # pylint: disable=unused-variable
+        """
+        Observes time of finished request.
+        """
+        started = getattr(g, 'request_started', None)
+        if started is not None:
+            endpoint = request.endpoint or 'unknown'
+            REQUEST_LATENCY.observe(default_timer() - started, (endpoint,))
+            REQUESTS.inc(labels=(endpoint, response.status_code))
+        return response
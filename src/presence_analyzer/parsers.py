@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Parsers of presence data files.
+"""
+
+from datetime import date, datetime
+from xml.etree import cElementTree as ElementTree
+
+from presence_analyzer.metrics import ROWS
+from presence_analyzer.store import PresenceStore, TeamStore, UserStore
+
+import logging
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def parse_day(value):
+    """
+    Converts 'YYYY-MM-DD' string to date ordinal.
+    """
+    if len(value) == 10 and value[4] == '-' and value[7] == '-':
+        return date(
+            int(value[:4]),
+            int(value[5:7]),
+            int(value[8:]),
+        ).toordinal()
+    return datetime.strptime(value, '%Y-%m-%d').toordinal()
+
+
+def parse_time(value):
+    """
+    Converts 'HH:MM:SS' string to amount of seconds since midnight.
+    """
+    if len(value) == 8 and value[2] == ':' and value[5] == ':':
+        hour, minute, second = int(value[:2]), int(value[3:5]), int(value[6:])
+        if 0 <= hour < 24 and 0 <= minute < 60 and 0 <= second < 60:
+            return hour * 3600 + minute * 60 + second
+    time = datetime.strptime(value, '%H:%M:%S')
+    return time.hour * 3600 + time.minute * 60 + time.second
+
+
+def parse_csv(lines, first_line=0, errors=None):
+    """
+    Yields (user_id, day, start, end) tuples from lines in format
+    'user_id,YYYY-MM-DD,HH:MM:SS,HH:MM:SS', where day is date ordinal
+    and start, end are seconds since midnight.
+
+    Lines with different amount of fields are skipped silently, other
+    malformed lines are logged with their number counted from first_line.
+    When errors list is given, they are appended to it as (line number,
+    message) tuples instead and nothing is logged nor counted, so worker
+    processes don't touch locks inherited from the parent.
+    Values of fixed width are sliced, anything else falls back to
+    datetime.strptime, so both accept the same input.
+    """
+    # every day and time repeats many times in the export
+    days = {}
+    times = {}
+    parsed = rejected = 0
+    try:
+        for i, line in enumerate(lines, first_line):
+            row = line.rstrip('\r\n').split(',')
+            if len(row) != 4:
+                # ignore header and footer lines
+                continue
+
+            try:
+                user_id = int(row[0])
+                day = days.get(row[1])
+                if day is None:
+                    day = days[row[1]] = parse_day(row[1])
+                start = times.get(row[2])
+                if start is None:
+                    start = times[row[2]] = parse_time(row[2])
+                end = times.get(row[3])
+                if end is None:
+                    end = times[row[3]] = parse_time(row[3])
+            except (ValueError, TypeError) as error:
+                if errors is not None:
+                    errors.append((i, str(error)))
+                    continue
+                log.debug('Problem with line %d: ', i, exc_info=True)
+                rejected += 1
+                continue
+
+            parsed += 1
+            yield user_id, day, start, end
+    finally:
+        if errors is None:
+            ROWS.inc(parsed, ('parsed',))
+            ROWS.inc(rejected, ('rejected',))
+
+
+def split_csv(csvfile, begin, end, chunks):
+    """
+    Returns list of (begin, end) positions which divide given part of file
+    into about equal chunks of whole lines.
+    """
+    bounds = [begin]
+    for i in xrange(1, chunks):
+        position = begin + (end - begin) * i // chunks
+        if position <= bounds[-1]:
+            continue
+        # chunk ends after the line which contains its last byte
+        csvfile.seek(position - 1)
+        csvfile.readline()
+        position = csvfile.tell()
+        if bounds[-1] < position < end:
+            bounds.append(position)
+    bounds.append(end)
+    return zip(bounds, bounds[1:])
+
+
+def parse_csv_chunk(task):
+    """
+    Parses lines of CSV file between (file name, begin, end) positions.
+
+    Runs in worker process, so it returns picklable parts of PresenceStore
+    instead of the store:
+    (columns, offsets, aggregates, errors, parsed, size, lines)
+    where errors are malformed lines numbered from the chunk beginning,
+    size and lines are length and amount of complete lines in the chunk.
+    """
+    file_name, begin, end = task
+    progress = {'size': 0, 'lines': 0, 'parsed': 0}
+    errors = []
+
+    def read_lines(csvfile):
+        """
+        Yields lines of the chunk.
+        """
+        for line in csvfile:
+            yield line
+            if line.endswith('\n'):
+                progress['size'] += len(line)
+                progress['lines'] += 1
+                if begin + progress['size'] >= end:
+                    return
+
+    def count(rows):
+        """
+        Counts parsed rows.
+        """
+        for row in rows:
+            progress['parsed'] += 1
+            yield row
+
+    with open(file_name, 'rb') as csvfile:
+        csvfile.seek(begin)
+        store = PresenceStore.from_rows(
+            count(parse_csv(read_lines(csvfile), errors=errors))
+        )
+    return (
+        (store.user_ids, store.days, store.starts, store.ends),
+        store.offsets,
+        store.aggregates,
+        errors,
+        progress['parsed'],
+        progress['size'],
+        progress['lines'],
+    )
+
+
+def parse_users_xml(source):
+    """
+    Returns UserStore with users from XML file.
+
+    File is read element by element and every user element is dropped
+    once processed, so the whole document is never kept in memory.
+    """
+    link = None
+    users = {}
+    users_element = None
+    for event, element in ElementTree.iterparse(source, ('start', 'end')):
+        if event == 'start':
+            if element.tag == 'users':
+                users_element = element
+            continue
+
+        if element.tag == 'server':
+            link = '{}://{}:{}'.format(
+                element.findtext('protocol'),
+                element.findtext('host'),
+                element.findtext('port'),
+            )
+        elif element.tag == 'user':
+            users[int(element.get('id'))] = (
+                element.findtext('name'),
+                element.findtext('avatar'),
+            )
+            if users_element is not None:
+                users_element.clear()
+    return UserStore(link, users)
+
+
+def parse_teams_xml(source):
+    """
+    Returns TeamStore with teams and ids of their members from XML file:
+    <teams>
+        <team id="1">
+            <name>Backend</name>
+            <member id="10"/>
+        </team>
+    </teams>
+    """
+    teams = {}
+    for _, element in ElementTree.iterparse(source):
+        if element.tag == 'team':
+            teams[int(element.get('id'))] = (
+                element.findtext('name'),
+                tuple(
+                    int(member.get('id'))
+                    for member in element.iterfind('member')
+                ),
+            )
+            element.clear()
+    return TeamStore(teams)
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-fork server, which loads data once and shares it with worker processes.
+"""
+
+import errno
+import os
+import signal
+import socket
+import time
+
+from werkzeug.serving import BaseWSGIServer
+
+import logging
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class PreforkServer(object):
+    """
+    Serves WSGI application from worker processes forked from the master.
+
+    Master binds the socket and calls preload function before forking,
+    so data loaded there is shared by all workers copy-on-write. Every
+    worker calls initialize function before handling requests. Columns
+    of the store are arrays or memory-mapped snapshot, which workers only
+    read, so their pages stay shared.
+
+    Signals sent to the master:
+     - SIGHUP calls preload again, forks new workers and stops old ones
+       once the new ones are running,
+     - SIGTERM and SIGINT stop all workers and the master.
+
+    Master also reloads when changed function, called every interval
+    seconds, returns true, so workers don't have to reload data on their
+    own. Workers which die are replaced with new ones.
+    """
+
+    def __init__(self, app, host, port, workers, preload=None,
+                 initialize=None, changed=None, interval=10, backlog=128,
+                 timeout=1):
+        self.app = app
+        self.workers = workers
+        self.preload = preload
+        self.initialize = initialize
+        self.changed = changed
+        self.interval = interval
+        self.timeout = timeout
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((host, port))
+        self.socket.listen(backlog)
+        # idle workers don't block in accept() when other worker was faster
+        self.socket.setblocking(0)
+        self.address = self.socket.getsockname()
+
+        self.children = {}  # generation of every worker by pid
+        self.generation = 0
+        self.running = False
+        self.reloading = False
+
+    def serve_forever(self):
+        """
+        Runs the master loop until SIGTERM or SIGINT is received.
+        """
+        def stop(signum, frame):  # pylint: disable=unused-argument
+            """
+            Stops the master loop.
+            """
+            self.running = False
+
+        def reload(signum, frame):  # pylint: disable=unused-argument
+            """
+            Schedules reload in the master loop.
+            """
+            self.reloading = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGHUP, reload)
+
+        self.running = True
+        try:
+            if self.preload is not None:
+                self.preload()
+            self.spawn()
+            log.info(
+                'Serving on %s:%s with %s workers', self.address[0],
+                self.address[1], self.workers,
+            )
+            checked = time.time()
+            while self.running:
+                if self.changed is not None and \
+                   time.time() - checked >= self.interval:
+                    checked = time.time()
+                    self.reloading = self.reloading or self.check()
+                if self.reloading:
+                    self.reloading = False
+                    self.reload()
+                self.reap()
+                self.spawn()
+                time.sleep(self.timeout)
+        finally:
+            self.kill(list(self.children))
+            while self.children:
+                self.reap(block=True)
+            self.socket.close()
+
+    def check(self):
+        """
+        Calls changed function, failure is taken as no change.
+        """
+        try:
+            return self.changed()
+        except Exception:  # pylint: disable=broad-except
+            log.exception('Checking for changes failed')
+            return False
+
+    def reload(self):
+        """
+        Loads data again and replaces all workers with new ones.
+        """
+        log.info('Reloading')
+        if self.preload is not None:
+            try:
+                self.preload()
+            except Exception:  # pylint: disable=broad-except
+                log.exception('Reloading failed, keeping old workers')
+                return
+        old = list(self.children)
+        self.generation += 1
+        self.spawn()
+        self.kill(old)
+
+    def spawn(self):
+        """
+        Forks workers missing in the current generation.
+        """
+        current = sum(
+            1 for generation in self.children.itervalues()
+            if generation == self.generation
+        )
+        for _ in xrange(self.workers - current):
+            pid = os.fork()
+            if pid == 0:
+                code = 0
+                try:
+                    self.work()
+                except Exception:  # pylint: disable=broad-except
+                    log.exception('Worker failed')
+                    code = 1
+                finally:
+                    os._exit(code)  # pylint: disable=protected-access
+            self.children[pid] = self.generation
+
+    def kill(self, pids):
+        """
+        Asks given workers to finish.
+        """
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def reap(self, block=False):
+        """
+        Forgets finished workers.
+        """
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+            except OSError as error:
+                if error.errno == errno.ECHILD:
+                    self.children.clear()
+                elif error.errno == errno.EINTR and block:
+                    continue
+                return
+            if pid == 0:
+                return
+            generation = self.children.pop(pid, None)
+            if generation == self.generation and self.running:
+                log.warning('Worker %s exited with %s', pid, status)
+            if block:
+                return
+
+    def work(self):
+        """
+        Handles requests in the worker until SIGTERM is received.
+        """
+        running = [True]
+
+        def stop(signum, frame):  # pylint: disable=unused-argument
+            """
+            Finishes the worker after current request.
+            """
+            running[0] = False
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        if self.initialize is not None:
+            self.initialize()
+        server = BaseWSGIServer(
+            self.address[0], self.address[1], self.app,
+            fd=self.socket.fileno(),
+        )
+        server.timeout = self.timeout
+        while running[0]:
+            server.handle_request()
@@ -4,7 +4,6 @@
 
 import os
 import sys
-import urllib
 from functools import partial
 
 from presence_analyzer import main
@@ -29,10 +28,16 @@ del _buildout_path
 
 
 # bin/paster serve parts/etc/deploy.ini
-def make_app(global_conf={}, config=DEPLOY_CFG, debug=False):
+def make_app(global_conf={}, config=DEPLOY_CFG, debug=False, warm=True):
     from presence_analyzer import app
+    from presence_analyzer.utils import READY, warm_up
     app.config.from_pyfile(abspath(config))
     app.debug = debug
+    # load data before serving, so /readyz tells when workers are warm
+    if not app.config.get('WARMUP', True):
+        READY.set()
+    elif warm:
+        warm_up()
     return app
 
 
@@ -81,22 +86,106 @@ def _serve(action, debug=False, dry_run=False):
     paste.script.command.run()
 
 
+def _preload():
+    """Loads data in the master of pre-forked server."""
+    from presence_analyzer.utils import warm_up
+    warm_up()
+
+
+def _initialize():
+    """Loads data in a worker, unless the master loaded it, and keeps it
+    until the master replaces the worker."""
+    from presence_analyzer.utils import READY, freeze_data, warm_up
+    if not READY.is_set():
+        warm_up()
+    freeze_data()
+
+
+def _serve_prefork(workers, preload, hostname, port):
+    """Serve the application from pre-forked worker processes."""
+    import logging
+    from presence_analyzer.prefork import PreforkServer
+    from presence_analyzer.utils import data_changed
+    from presence_analyzer.watcher import FileWatcher
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)s [%(name)s] %(message)s',
+    )
+    # data is loaded by the master with --preload, otherwise by every worker
+    app = make_app(warm=False)
+    # workers forward /api/v1/reload to the master as SIGHUP
+    app.config['PREFORK_MASTER'] = os.getpid()
+    # workers keep their data, the master replaces them when files change
+    watcher = FileWatcher()
+    data_changed(watcher)
+    server = PreforkServer(
+        app, hostname, port, workers,
+        preload=_preload if preload else None, initialize=_initialize,
+        changed=partial(data_changed, watcher),
+        interval=app.config.get('PREFORK_INTERVAL', 10),
+    )
+    server.serve_forever()
+
+
+def _serve_async(hostname, port, threads):
+    """Serve the application from event loop."""
+    import logging
+    from presence_analyzer.eventloop import EventLoopServer
+    from presence_analyzer.utils import get_data, get_data_xml
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)s [%(name)s] %(message)s',
+    )
+    app = make_app()
+    server = EventLoopServer(
+        app, hostname, port, threads, refresh=(get_data, get_data_xml),
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
 # bin/flask-ctl ...
 def run():
     action_shell = werkzeug.script.make_shell(make_shell, make_shell.__doc__)
 
     # bin/flask-ctl serve [fg|start|stop|restart|status]
-    def action_serve(action=('a', 'start'), dry_run=False):
+    # bin/flask-ctl serve --workers N [--preload]
+    def action_serve(action=('a', 'start'), dry_run=False, workers=0,
+                     preload=False, hostname='0.0.0.0', port=8337):
         """Serve the application.
 
         This command serves a web application that uses a paste.deploy
         configuration file for the server and application.
 
+        With '--workers' it serves the application in the foreground
+        from pre-forked worker processes instead, SIGHUP reloads them.
+
         Options:
          - 'action' is one of [fg|start|stop|restart|status]
          - '--dry-run' print the paster command and exit
+         - '--workers' number of worker processes
+         - '--preload' load data once before forking workers
+         - '--hostname', '--port' address of pre-forked server
+        """
+        if workers:
+            _serve_prefork(workers, preload, hostname, port)
+        else:
+            _serve(action, debug=False, dry_run=dry_run)
+
+    # bin/flask-ctl serve_async
+    def action_serve_async(hostname='0.0.0.0', port=8337, threads=8):
+        """Serve the application from event loop in the foreground.
+
+        Connections are kept by one thread and requests are handled by
+        a pool of threads, data is refreshed in the background.
+
+        Options:
+         - '--hostname', '--port' address of the server
+         - '--threads' number of threads handling requests
         """
-        _serve(action, debug=False, dry_run=dry_run)
+        _serve_async(hostname, port, threads)
 
     # bin/flask-ctl debug [fg|start|stop|restart|status]
     def action_debug(action=('a', 'start'), dry_run=False):
@@ -116,11 +205,34 @@ def run():
     werkzeug.script.run()
 
 
+def compile_data():
+    """Compiles CSV file with presence data into binary snapshot."""
+    from presence_analyzer.snapshot import csv_digest, write_snapshot
+    from presence_analyzer.utils import PresenceLoader
+    main.app.config.from_pyfile(abspath(DEPLOY_CFG))
+    loader = PresenceLoader()
+    data = loader.load(main.app.config['DATA_CSV'])
+    write_snapshot(
+        main.app.config['DATA_SNAPSHOT'],
+        data,
+        loader.inode,
+        loader.offset,
+        loader.lines,
+        loader.mtime,
+        csv_digest(main.app.config['DATA_CSV'], loader.offset),
+    )
+    print 'Compiled {} entries of {} users into {}'.format(
+        len(data.user_ids), len(data), main.app.config['DATA_SNAPSHOT'],
+    )
+
+
 def retrieve_users():
-    """Downloads XML file with users data."""
+    """Downloads XML file with users data, if it changed."""
+    import logging
+    from presence_analyzer.fetcher import fetch_users_xml, notify_reload
+    logging.basicConfig(level=logging.INFO)
     main.app.config.from_pyfile(abspath(DEPLOY_CFG))
     url = main.app.config['URL_XML']
-    file_name = os.path.join(
-        os.path.dirname(__file__), '..', '..', 'runtime', 'data', 'users.xml'
-    )
-    urllib.urlretrieve(url, file_name)
+    file_name = main.app.config['DATA_XML']
+    if fetch_users_xml(url, file_name) and main.app.config.get('RELOAD_URL'):
+        notify_reload(main.app.config['RELOAD_URL'])
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Binary snapshot of presence data, which is memory-mapped instead of parsed.
+
+Snapshot file consists of:
+ - header with magic bytes, format version, inode of CSV file, position
+   and line number in it which the snapshot was compiled up to,
+   modification time of the file and SHA-1 digest of its last block before
+   that position,
+ - users table with (user_id, begin, end) for every user,
+ - aggregates table with weekday sums for every user,
+ - user_ids, days, starts and ends columns of fixed-width integers.
+
+Values are stored in native byte order, so snapshot should be compiled on
+the machine which serves it.
+"""
+
+import ctypes
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+
+from presence_analyzer.store import AGGREGATES, PresenceStore
+
+import logging
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+MAGIC = 'PRES'
+VERSION = 3
+
+# magic, version, inode, offset, lines, amount of entries and users,
+# modification time and digest of CSV file
+HEADER = struct.Struct('=4sIQQQQQd20s')
+
+# size of the last block of CSV file covered by snapshot, read for digest
+DIGEST_BLOCK = 64 * 1024
+
+# types of values in tables and columns
+TABLE_TYPE = ctypes.c_int64
+COLUMN_TYPE = ctypes.c_int32
+
+
+def pack(values, value_type):
+    """
+    Returns given integers as bytes of given ctypes type.
+    """
+    if isinstance(values, array) and \
+       values.itemsize == ctypes.sizeof(value_type):
+        return values.tostring()
+    return buffer((value_type * len(values))(*values))
+
+
+def csv_digest(file_name, offset):
+    """
+    Returns SHA-1 digest of the last DIGEST_BLOCK bytes of given file before
+    given position.
+
+    Only the block is read, so checking snapshot of large file after lines
+    were appended to it takes constant time. The file rewritten in place
+    from scratch, like by export job, differs from the snapshot there too.
+    """
+    begin = max(0, offset - DIGEST_BLOCK)
+    with open(file_name, 'rb') as csv_file:
+        csv_file.seek(begin)
+        return hashlib.sha1(csv_file.read(offset - begin)).digest()
+
+
+def write_snapshot(file_name, store, inode, offset, lines, mtime, digest):
+    """
+    Writes snapshot of given store, compiled from CSV file with given inode
+    up to given position and line number. Modification time and digest of
+    the file, see csv_digest(), tell whether it was rewritten in place.
+
+    File is written next to the target and renamed, so readers never see
+    it half-written.
+    """
+    directory = os.path.dirname(os.path.abspath(file_name))
+    handle, temp_name = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(handle, 'wb') as snapshot:
+            snapshot.write(HEADER.pack(
+                MAGIC, VERSION, inode, offset, lines,
+                len(store.user_ids), len(store.users), mtime, digest,
+            ))
+
+            users = []
+            aggregates = []
+            for user_id in store.users:
+                users.append(user_id)
+                users.extend(store.offsets[user_id])
+                aggregates.extend(store.aggregates[user_id])
+            snapshot.write(pack(users, TABLE_TYPE))
+            snapshot.write(pack(aggregates, TABLE_TYPE))
+
+            for column in (store.user_ids, store.days, store.starts,
+                           store.ends):
+                snapshot.write(pack(column, COLUMN_TYPE))
+        os.rename(temp_name, file_name)
+    except Exception:
+        os.remove(temp_name)
+        raise
+
+
+def read_snapshot(file_name):
+    """
+    Maps snapshot file into memory.
+
+    Returns (store, inode, offset, lines, mtime, digest) tuple or None when
+    the file doesn't exist or has different format version. Columns and
+    tables of the store are not copied, so the pages are shared by all
+    processes reading the same snapshot.
+    """
+    try:
+        with open(file_name, 'rb') as snapshot:
+            header = snapshot.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return None
+            magic, version, inode, offset, lines, size, user_count, mtime, \
+                digest = HEADER.unpack(header)
+            if (magic, version) != (MAGIC, VERSION):
+                log.warning('Unsupported snapshot %s', file_name)
+                return None
+            # private mapping is writable for ctypes, but never written
+            mapped = mmap.mmap(
+                snapshot.fileno(), 0, access=mmap.ACCESS_COPY
+            )
+    except (IOError, OSError, ValueError):
+        log.debug('Snapshot %s not available', file_name, exc_info=True)
+        return None
+
+    position = [HEADER.size]
+
+    def table(value_type, length):
+        """
+        Returns next table of given type and length from mapped file.
+        """
+        result = (value_type * length).from_buffer(mapped, position[0])
+        position[0] += ctypes.sizeof(result)
+        return result
+
+    try:
+        users = table(TABLE_TYPE, 3 * user_count)
+        aggregates = table(TABLE_TYPE, 7 * AGGREGATES * user_count)
+        columns = [table(COLUMN_TYPE, size) for _ in range(4)]
+    except ValueError:
+        log.warning('Snapshot %s is truncated', file_name)
+        return None
+
+    offsets = {}
+    user_aggregates = {}
+    user_type = TABLE_TYPE * (7 * AGGREGATES)
+    for i in xrange(user_count):
+        user_id, begin, end = users[3 * i:3 * i + 3]
+        offsets[user_id] = (begin, end)
+        user_aggregates[user_id] = user_type.from_buffer(
+            aggregates, ctypes.sizeof(user_type) * i
+        )
+
+    store = PresenceStore(
+        *columns, aggregates=user_aggregates, offsets=offsets
+    )
+    return store, inode, offset, lines, mtime, digest
@@ -0,0 +1,696 @@
+# -*- coding: utf-8 -*-
+"""
+Compact storage of presence entries and users.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Mapping
+from datetime import date, time
+from itertools import count
+from time import time as now
+
+
+VERSIONS = count(1)
+
+# typecode of every column, 4 bytes per value
+TYPECODE = 'i'
+
+# typecode of aggregated sums, 8 bytes per value
+SUM_TYPECODE = 'l'
+
+# count, total interval, sum of starts and sum of ends for every weekday
+AGGREGATES = 4
+
+# appended entries are merged into base store, once there are more than
+# 1/COMPACT_RATIO of its entries
+COMPACT_RATIO = 4
+
+
+def weekday(day):
+    """
+    Returns weekday of given date ordinal, Monday is 0.
+    """
+    return (day - 1) % 7
+
+
+def aggregate_weekdays(days, starts, ends, begin, end):
+    """
+    Sums up entries between begin and end positions of given columns.
+
+    It creates flat array with AGGREGATES values for every weekday:
+    result = array('l', [
+        count, total interval, sum of starts, sum of ends,  # Monday
+        count, total interval, sum of starts, sum of ends,  # Tuesday
+        ...
+    ])
+    """
+    result = array(SUM_TYPECODE, [0]) * (7 * AGGREGATES)
+    for i in xrange(begin, end):
+        offset = weekday(days[i]) * AGGREGATES
+        result[offset] += 1
+        result[offset + 1] += ends[i] - starts[i]
+        result[offset + 2] += starts[i]
+        result[offset + 3] += ends[i]
+    return result
+
+
+def seconds_to_time(seconds):
+    """
+    Converts amount of seconds since midnight to datetime.time object.
+    """
+    return time(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class Snapshot(object):
+    """
+    Immutable data compared by identity, so it can be used as cache key.
+
+    Every snapshot gets unique version number and time it was created.
+    """
+
+    def __init__(self):
+        self.version = next(VERSIONS)
+        self.modified = now()
+
+    def __eq__(self, other):
+        return self is other
+
+    def __ne__(self, other):
+        return self is not other
+
+    def __hash__(self):
+        return id(self)
+
+
+class PresenceStore(Snapshot, Mapping):
+    """
+    Read-only presence entries kept in parallel arrays.
+
+    Columns are sorted by user and day, so entries of every user occupy
+    one continuous slice described by the offsets index:
+    store.offsets = {
+        'user_id': (begin, end),
+    }
+
+    Weekday sums of every user are computed once, see aggregate_weekdays():
+    store.aggregates = {
+        'user_id': array('l', [...]),
+    }
+
+    Running sums of intervals, see interval_sums(), are computed on first
+    use, so total presence between any two positions is one subtraction.
+
+    For existing callers it behaves like the mapping returned by get_data()
+    in the past, store[user_id][datetime.date] gives dict with 'start' and
+    'end' keys holding datetime.time objects.
+    """
+
+    def __init__(self, user_ids, days, starts, ends, aggregates=None,
+                 offsets=None):
+        """
+        Takes columns already sorted by user and day and optionally
+        aggregates and offsets of all users.
+
+        Columns may be any sequences of integers supporting slicing,
+        like arrays or ctypes arrays mapped from snapshot file.
+        """
+        super(PresenceStore, self).__init__()
+        self.user_ids = user_ids
+        self.days = days
+        self.starts = starts
+        self.ends = ends
+
+        if offsets is None:
+            offsets = {}
+            begin = 0
+            for i in xrange(1, len(user_ids) + 1):
+                if i == len(user_ids) or user_ids[i] != user_ids[begin]:
+                    offsets[user_ids[begin]] = (begin, i)
+                    begin = i
+        self.offsets = offsets
+        self.users = sorted(self.offsets)
+
+        if aggregates is None:
+            aggregates = {
+                user_id: aggregate_weekdays(days, starts, ends, begin, end)
+                for user_id, (begin, end) in self.offsets.iteritems()
+            }
+        self.aggregates = aggregates
+        self._interval_sums = None
+
+    def interval_sums(self):
+        """
+        Returns array of running sums of intervals, where item i is total
+        presence time of entries before position i.
+        """
+        sums = self._interval_sums
+        if sums is None:
+            sums = array(SUM_TYPECODE, [0]) * (len(self.days) + 1)
+            starts, ends = self.starts, self.ends
+            total = 0
+            for i in xrange(len(self.days)):
+                total += ends[i] - starts[i]
+                sums[i + 1] = total
+            # columns never change, so concurrent callers compute the same
+            self._interval_sums = sums
+        return sums
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Creates store from iterable of (user_id, day, start, end) tuples,
+        where day is date ordinal and start, end are seconds since midnight.
+
+        Later rows override earlier ones for the same user and day.
+        Rows which already come sorted are copied into columns directly.
+        """
+        user_ids = array(TYPECODE)
+        days = array(TYPECODE)
+        starts = array(TYPECODE)
+        ends = array(TYPECODE)
+        last_user = last_day = None
+        rows = iter(rows)
+        for row in rows:
+            user_id, day, start, end = row
+            if last_user is not None and (
+                    user_id < last_user or
+                    user_id == last_user and day <= last_day):
+                return cls._from_unsorted_rows(
+                    zip(user_ids, days, starts, ends) + [row],
+                    rows,
+                )
+            user_ids.append(user_id)
+            days.append(day)
+            starts.append(start)
+            ends.append(end)
+            last_user, last_day = user_id, day
+        return cls(user_ids, days, starts, ends)
+
+    @classmethod
+    def _from_unsorted_rows(cls, *iterables):
+        """
+        Creates store from rows in any order.
+        """
+        entries = {}
+        for rows in iterables:
+            for user_id, day, start, end in rows:
+                entries[(user_id, day)] = (start, end)
+
+        user_ids = array(TYPECODE)
+        days = array(TYPECODE)
+        starts = array(TYPECODE)
+        ends = array(TYPECODE)
+        for key in sorted(entries):
+            user_ids.append(key[0])
+            days.append(key[1])
+            starts.append(entries[key][0])
+            ends.append(entries[key][1])
+        return cls(user_ids, days, starts, ends)
+
+    def merge(self, rows):
+        """
+        Returns new store with given rows added, rows override entries
+        of this store for the same user and day.
+        """
+        return self.append(self.from_rows(rows))
+
+    def append(self, other):
+        """
+        Returns new store with entries of given store added, see
+        AppendedStore, they override entries of this store for the same
+        user and day.
+        """
+        if not other:
+            return self
+        if not self:
+            return other
+        return AppendedStore(self, self.from_rows([])).append(other)
+
+    def segments(self):
+        """
+        Returns list of (store, offsets) pairs, entries of every user are
+        the given slices of their columns in order.
+        """
+        return [(self, self.offsets)]
+
+    @classmethod
+    def combine(cls, stores):
+        """
+        Returns new store with entries of all given stores, later stores
+        override entries of earlier ones for the same user and day.
+
+        Entries of a user which don't overlap between stores are copied
+        slice by slice and their weekday sums are added up.
+        """
+        user_ids = array(TYPECODE)
+        days = array(TYPECODE)
+        starts = array(TYPECODE)
+        ends = array(TYPECODE)
+        aggregates = {}
+        offsets = {}
+        users = set()
+        for store in stores:
+            users.update(store.offsets)
+        for user_id in sorted(users):
+            offsets[user_id] = (len(user_ids), None)
+            parts = [
+                (store, store.offsets[user_id])
+                for store in stores if user_id in store.offsets
+            ]
+            if any(
+                    left.days[left_end - 1] >= right.days[right_begin]
+                    for (left, (_, left_end)), (right, (right_begin, _))
+                    in zip(parts, parts[1:])):
+                # entries overlap, so they are merged
+                entries = {}
+                for store, (begin, end) in parts:
+                    entries.update(zip(
+                        store.days[begin:end],
+                        zip(store.starts[begin:end], store.ends[begin:end]),
+                    ))
+                begin = len(days)
+                for day in sorted(entries):
+                    user_ids.append(user_id)
+                    days.append(day)
+                    starts.append(entries[day][0])
+                    ends.append(entries[day][1])
+                aggregates[user_id] = aggregate_weekdays(
+                    days, starts, ends, begin, len(days)
+                )
+                offsets[user_id] = (begin, len(days))
+                continue
+
+            for store, (begin, end) in parts:
+                user_ids.extend(store.user_ids[begin:end])
+                days.extend(store.days[begin:end])
+                starts.extend(store.starts[begin:end])
+                ends.extend(store.ends[begin:end])
+            sums = [store.aggregates[user_id] for store, _ in parts]
+            aggregates[user_id] = sums[0] if len(sums) == 1 else array(
+                SUM_TYPECODE, [sum(values) for values in zip(*sums)]
+            )
+            offsets[user_id] = (offsets[user_id][0], len(days))
+        return cls(user_ids, days, starts, ends, aggregates, offsets)
+
+    def __getitem__(self, user_id):
+        begin, end = self.offsets[user_id]
+        return UserPresence(self, begin, end)
+
+    def __contains__(self, user_id):
+        return user_id in self.offsets
+
+    def __iter__(self):
+        return iter(self.users)
+
+    def __len__(self):
+        return len(self.users)
+
+    @property
+    def nbytes(self):
+        """
+        Amount of memory used by columns.
+        """
+        return array(TYPECODE).itemsize * sum(
+            len(column)
+            for column in (self.user_ids, self.days, self.starts, self.ends)
+        )
+
+
+class UserPresence(Mapping):
+    """
+    Read-only view on presence entries of a single user.
+    """
+
+    def __init__(self, store, begin, end):
+        self.store = store
+        self.begin = begin
+        self.end = end
+
+    def _index(self, day):
+        """
+        Returns position of given date in store columns or None.
+        """
+        ordinal = day.toordinal()
+        i = bisect_left(self.store.days, ordinal, self.begin, self.end)
+        if i < self.end and self.store.days[i] == ordinal:
+            return i
+        return None
+
+    def between(self, first=None, last=None):
+        """
+        Returns view on entries from first to last date ordinal inclusive,
+        None means no limit.
+        """
+        begin, end = self.begin, self.end
+        if first is not None:
+            begin = bisect_left(self.store.days, first, begin, end)
+        if last is not None:
+            end = bisect_right(self.store.days, last, begin, end)
+        return UserPresence(self.store, begin, end)
+
+    def entries(self, skip=0, count=None):
+        """
+        Yields (day, start, end) tuples sorted by date, skipping given
+        amount of entries and stopping after count of them.
+        """
+        begin = self.begin + skip
+        end = self.end if count is None else min(self.end, begin + count)
+        store = self.store
+        for i in xrange(begin, end):
+            yield store.days[i], store.starts[i], store.ends[i]
+
+    def weekdays(self):
+        """
+        Returns (count, total interval, sum of starts, sum of ends) tuple
+        for every weekday.
+        """
+        begin, end = self.begin, self.end
+        user_id = self.store.user_ids[begin] if begin < end else None
+        if self.store.offsets.get(user_id) == (begin, end):
+            sums = self.store.aggregates[user_id]
+        else:
+            sums = aggregate_weekdays(
+                self.store.days, self.store.starts, self.store.ends,
+                begin, end,
+            )
+        return [
+            tuple(sums[offset:offset + AGGREGATES])
+            for offset in xrange(0, len(sums), AGGREGATES)
+        ]
+
+    def __getitem__(self, day):
+        i = self._index(day)
+        if i is None:
+            raise KeyError(day)
+        return {
+            'start': seconds_to_time(self.store.starts[i]),
+            'end': seconds_to_time(self.store.ends[i]),
+        }
+
+    def __contains__(self, day):
+        return self._index(day) is not None
+
+    def __iter__(self):
+        for i in xrange(self.begin, self.end):
+            yield date.fromordinal(self.store.days[i])
+
+    def __len__(self):
+        return self.end - self.begin
+
+    def __eq__(self, other):
+        if isinstance(other, UserPresence):
+            return (self.store, self.begin, self.end) == \
+                (other.store, other.begin, other.end)
+        return super(UserPresence, self).__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.store, self.begin, self.end))
+
+
+class AppendedStore(Snapshot, Mapping):
+    """
+    Read-only presence entries of base store and entries appended to it
+    later, kept in small overlay store.
+
+    Columns of the base store, which may be mapped from snapshot, are
+    neither copied nor changed. Entries of every user with appended ones
+    are a slice of base columns, followed by a slice of the overlay which
+    holds all entries of the user from the first appended date on:
+    store.base_offsets = {
+        'user_id': (begin, end),
+    }
+
+    Other users are served by the base store as they are. Once overlay
+    grows over 1/COMPACT_RATIO of base store, both are combined into one.
+    """
+
+    def __init__(self, base, overlay):
+        super(AppendedStore, self).__init__()
+        self.base = base
+        self.overlay = overlay
+        self.base_offsets = {}
+        self.aggregates = {}
+        for user_id, (begin, end) in overlay.offsets.iteritems():
+            sums = overlay.aggregates[user_id]
+            if user_id in base.offsets:
+                first, last = base.offsets[user_id]
+                cut = bisect_left(base.days, overlay.days[begin], first, last)
+                self.base_offsets[user_id] = (first, cut)
+                if cut == last:
+                    base_sums = base.aggregates[user_id]
+                else:
+                    base_sums = aggregate_weekdays(
+                        base.days, base.starts, base.ends, first, cut
+                    )
+                sums = array(SUM_TYPECODE, [
+                    left + right for left, right in zip(base_sums, sums)
+                ])
+            self.aggregates[user_id] = sums
+        if all(user_id in base.offsets for user_id in overlay.offsets):
+            self.users = base.users
+        else:
+            self.users = sorted(set(base.offsets).union(overlay.offsets))
+        self._offsets = None
+
+    def merge(self, rows):
+        """
+        Returns new store with given rows added, rows override entries
+        of this store for the same user and day.
+        """
+        return self.append(PresenceStore.from_rows(rows))
+
+    def append(self, other):
+        """
+        Returns new store with entries of given store added, they override
+        entries of this store for the same user and day.
+
+        Only the overlay is combined with them, together with entries of
+        base store from the first added date of their user on.
+        """
+        if not other:
+            return self
+        base = self.base
+        tails = []
+        for user_id in sorted(other.offsets):
+            if user_id not in base.offsets:
+                continue
+            first, last = self.base_offsets.get(
+                user_id, base.offsets[user_id]
+            )
+            day = other.days[other.offsets[user_id][0]]
+            for i in xrange(bisect_left(base.days, day, first, last), last):
+                tails.append(
+                    (user_id, base.days[i], base.starts[i], base.ends[i])
+                )
+        stores = [PresenceStore.from_rows(tails), self.overlay, other]
+        overlay = PresenceStore.combine([
+            store for store in stores if store
+        ])
+        if len(overlay.days) * COMPACT_RATIO > len(base.days):
+            return PresenceStore.combine([base, overlay])
+        return AppendedStore(base, overlay)
+
+    def segments(self):
+        """
+        Returns list of (store, offsets) pairs, entries of every user are
+        the given slices of their columns in order.
+        """
+        offsets = self._offsets
+        if offsets is None:
+            offsets = dict(self.base.offsets)
+            offsets.update(self.base_offsets)
+            self._offsets = offsets
+        return [(self.base, offsets), (self.overlay, self.overlay.offsets)]
+
+    def __getitem__(self, user_id):
+        if user_id not in self.overlay.offsets:
+            return self.base[user_id]
+        begin, end = self.base_offsets.get(user_id, (0, 0))
+        return AppendedUserPresence(
+            self, user_id, UserPresence(self.base, begin, end),
+            self.overlay[user_id],
+        )
+
+    def __contains__(self, user_id):
+        return user_id in self.overlay.offsets or user_id in self.base
+
+    def __iter__(self):
+        return iter(self.users)
+
+    def __len__(self):
+        return len(self.users)
+
+    @property
+    def nbytes(self):
+        """
+        Amount of memory used by columns.
+        """
+        return self.base.nbytes + self.overlay.nbytes
+
+
+class AppendedUserPresence(Mapping):
+    """
+    Read-only view on presence entries of a single user with appended
+    entries, views on base and overlay store joined together.
+    """
+
+    def __init__(self, store, user_id, base, overlay):
+        self.store = store
+        self.user_id = user_id
+        self.base = base
+        self.overlay = overlay
+
+    def between(self, first=None, last=None):
+        """
+        Returns view on entries from first to last date ordinal inclusive,
+        None means no limit.
+        """
+        return AppendedUserPresence(
+            self.store, self.user_id, self.base.between(first, last),
+            self.overlay.between(first, last),
+        )
+
+    def entries(self, skip=0, count=None):
+        """
+        Yields (day, start, end) tuples sorted by date, skipping given
+        amount of entries and stopping after count of them.
+        """
+        size = len(self.base)
+        if skip < size:
+            taken = size - skip if count is None else min(size - skip, count)
+            for entry in self.base.entries(skip, taken):
+                yield entry
+            if count is not None:
+                count -= taken
+            skip = 0
+        else:
+            skip -= size
+        if count is None or count > 0:
+            for entry in self.overlay.entries(skip, count):
+                yield entry
+
+    def weekdays(self):
+        """
+        Returns (count, total interval, sum of starts, sum of ends) tuple
+        for every weekday.
+        """
+        store, user_id = self.store, self.user_id
+        if (self.base.begin, self.base.end) == \
+           store.base_offsets.get(user_id, (0, 0)) and \
+           (self.overlay.begin, self.overlay.end) == \
+           store.overlay.offsets[user_id]:
+            sums = store.aggregates[user_id]
+            return [
+                tuple(sums[offset:offset + AGGREGATES])
+                for offset in xrange(0, len(sums), AGGREGATES)
+            ]
+        return [
+            tuple(left + right for left, right in zip(base, overlay))
+            for base, overlay in zip(
+                self.base.weekdays(), self.overlay.weekdays()
+            )
+        ]
+
+    def __getitem__(self, day):
+        if day in self.overlay:
+            return self.overlay[day]
+        return self.base[day]
+
+    def __contains__(self, day):
+        return day in self.overlay or day in self.base
+
+    def __iter__(self):
+        for day in self.base:
+            yield day
+        for day in self.overlay:
+            yield day
+
+    def __len__(self):
+        return len(self.base) + len(self.overlay)
+
+    def __eq__(self, other):
+        if isinstance(other, AppendedUserPresence):
+            return (self.base, self.overlay) == (other.base, other.overlay)
+        return super(AppendedUserPresence, self).__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.base, self.overlay))
+
+
+class UserStore(Snapshot, Mapping):
+    """
+    Read-only users data kept as tuples.
+
+    Avatar URL prefix is stored once, so the view gives dicts like:
+    store['user_id'] = {
+        'name': 'John Doe',
+        'avatar': 'https://intranet.stxnext.pl:443/api/images/users/10',
+    }
+    """
+
+    def __init__(self, link, users):
+        """
+        Takes avatar URL prefix and dict of (name, avatar path) tuples
+        by user_id.
+        """
+        super(UserStore, self).__init__()
+        self.link = link
+        self.users = users
+
+    def __getitem__(self, user_id):
+        name, avatar = self.users[user_id]
+        return {
+            'name': name,
+            'avatar': '{}{}'.format(self.link, avatar),
+        }
+
+    def __contains__(self, user_id):
+        return user_id in self.users
+
+    def __iter__(self):
+        return iter(self.users)
+
+    def __len__(self):
+        return len(self.users)
+
+
+class TeamStore(Snapshot, Mapping):
+    """
+    Read-only team definitions kept as tuples.
+
+    The view gives dicts like:
+    store['team_id'] = {
+        'name': 'Backend',
+        'members': [10, 11],
+    }
+    """
+
+    def __init__(self, teams):
+        """
+        Takes dict of (name, member ids tuple) tuples by team_id.
+        """
+        super(TeamStore, self).__init__()
+        self.teams = teams
+
+    def __getitem__(self, team_id):
+        name, members = self.teams[team_id]
+        return {
+            'name': name,
+            'members': list(members),
+        }
+
+    def __contains__(self, team_id):
+        return team_id in self.teams
+
+    def __iter__(self):
+        return iter(self.teams)
+
+    def __len__(self):
+        return len(self.teams)
@@ -4,12 +4,40 @@ Presence analyzer unit tests.
 """
 from __future__ import unicode_literals
 
+import os
 import os.path
+import BaseHTTPServer
+import ctypes
+import httplib
+import itertools
 import json
+import logging
+import shutil
+import signal
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import urllib2
 import datetime
 import unittest
+from collections import Mapping
+from hashlib import sha1
 
-from presence_analyzer import main, utils
+from presence_analyzer import (
+    database,
+    eventloop,
+    fetcher,
+    main,
+    metrics,
+    parsers,
+    prefork,
+    snapshot,
+    store,
+    utils,
+    watcher,
+)
 
 TEST_DATA_CSV = os.path.join(
     os.path.dirname(__file__), '..', '..', 'runtime', 'data', 'test_data.csv'
@@ -19,6 +47,10 @@ TEST_DATA_XML = os.path.join(
     os.path.dirname(__file__), '..', '..', 'runtime', 'data', 'test_users.xml'
 )
 
+TEST_DATA_TEAMS = os.path.join(
+    os.path.dirname(__file__), '..', '..', 'runtime', 'data', 'test_teams.xml'
+)
+
 
 # pylint: disable=maybe-no-member, too-many-public-methods
 class PresenceAnalyzerViewsTestCase(unittest.TestCase):
@@ -32,6 +64,7 @@ class PresenceAnalyzerViewsTestCase(unittest.TestCase):
         """
         main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
         main.app.config.update({'DATA_XML': TEST_DATA_XML})
+        main.app.config.update({'DATA_TEAMS': TEST_DATA_TEAMS})
         self.client = main.app.test_client()
 
     def tearDown(self):
@@ -233,6 +266,397 @@ class PresenceAnalyzerViewsTestCase(unittest.TestCase):
         ]
         self.assertEqual(data, result)
 
+        resp = self.client.get('/api/v1/overtime_in_quarter/1')
+        self.assertEqual(resp.status_code, 404)
+
+    def test_weekdays(self):
+        """
+        Test weekday statistics of many users.
+        """
+        resp = self.client.get(
+            '/api/v1/weekdays?users=10,0&metrics=mean_time_weekday'
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content_type, 'application/json')
+
+        data = json.loads(resp.data)
+        self.assertEqual(sorted(data), ['0', '10'])
+        self.assertIsNone(data['0'])
+        self.assertEqual(data['10'].keys(), ['mean_time_weekday'])
+        self.assertEqual(
+            data['10']['mean_time_weekday'],
+            json.loads(self.client.get('/api/v1/mean_time_weekday/10').data),
+        )
+
+        resp = self.client.get('/api/v1/weekdays')
+        data = json.loads(resp.data)
+        self.assertEqual(
+            sorted(data, key=int),
+            [str(user_id) for user_id in utils.get_data().users],
+        )
+        for name in utils.WEEKDAY_STATISTICS:
+            self.assertEqual(
+                data['11'][name],
+                json.loads(
+                    self.client.get('/api/v1/{}/11'.format(name)).data
+                ),
+            )
+
+        resp = self.client.get('/api/v1/weekdays?users=0')
+        self.assertEqual(json.loads(resp.data), {'0': None})
+
+        resp = self.client.get('/api/v1/weekdays?users=ten')
+        self.assertEqual(resp.status_code, 400)
+
+        resp = self.client.get('/api/v1/weekdays?metrics=median')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_date_range(self):
+        """
+        Test limiting per-user statistics to range of dates.
+        """
+        query = '?from=2013-09-10&to=2013-09-11'
+        resp = self.client.get('/api/v1/mean_time_weekday/11' + query)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            json.loads(resp.data),
+            [
+                ['Mon', 0],
+                ['Tue', 16564.0],
+                ['Wed', 25321.0],
+                ['Thu', 0],
+                ['Fri', 0],
+                ['Sat', 0],
+                ['Sun', 0],
+            ]
+        )
+        self.assertNotEqual(
+            resp.headers['ETag'],
+            self.client.get('/api/v1/mean_time_weekday/11').headers['ETag'],
+        )
+
+        resp = self.client.get('/api/v1/presence_weekday/11?to=2013-09-05')
+        self.assertEqual(json.loads(resp.data)[4], ['Thu', 22999])
+
+        resp = self.client.get('/api/v1/presence_start_end/11' + query)
+        self.assertEqual(json.loads(resp.data)[2], ['Wed', 33206.0, 58527.0])
+
+        resp = self.client.get('/api/v1/weekdays?users=11&from=2013-09-13')
+        self.assertEqual(
+            json.loads(resp.data)['11']['presence_weekday'][5],
+            ['Fri', 6426],
+        )
+
+        resp = self.client.get('/api/v1/presence_weekday/11?from=2013')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_export(self):
+        """
+        Test streaming presence entries.
+        """
+        resp = self.client.get('/api/v1/presence/export?users=11,10')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content_type, 'application/x-ndjson')
+        self.assertEqual(resp.headers['Accept-Ranges'], 'entries')
+        lines = [json.loads(line) for line in resp.data.splitlines()]
+        self.assertEqual(len(lines), 9)
+        self.assertEqual(lines[0], {
+            'user_id': 10,
+            'date': '2013-09-10',
+            'start': '09:39:05',
+            'end': '17:59:52',
+        })
+        self.assertEqual(lines[3]['user_id'], 11)
+
+        resp = self.client.get(
+            '/api/v1/presence/export?users=11&from=2013-09-10&to=2013-09-11'
+            '&format=csv'
+        )
+        self.assertEqual(resp.content_type, 'text/csv; charset=utf-8')
+        self.assertEqual(
+            resp.data.splitlines(),
+            [
+                'user_id,date,start,end',
+                '11,2013-09-10,09:19:50,13:55:54',
+                '11,2013-09-11,09:13:26,16:15:27',
+            ]
+        )
+
+        resp = self.client.get('/api/v1/presence/export?quarter=0')
+        self.assertEqual(len(resp.data.splitlines()), 96)
+        resp = self.client.get('/api/v1/presence/export?quarter=1')
+        self.assertEqual(resp.status_code, 404)
+
+        for query in ('format=xml', 'from=10.09.2013', 'cursor=10'):
+            resp = self.client.get('/api/v1/presence/export?' + query)
+            self.assertEqual(resp.status_code, 400)
+
+    def test_export_resume(self):
+        """
+        Test resuming export with cursor and range.
+        """
+        url = '/api/v1/presence/export?users=10,11&format=csv'
+        resp = self.client.get(url + '&cursor=10:2013-09-12')
+        self.assertEqual(
+            resp.data.splitlines()[0], '11,2013-09-05,09:28:08,15:51:27'
+        )
+        self.assertEqual(len(resp.data.splitlines()), 6)
+
+        resp = self.client.get(url, headers={'Range': 'entries=2-3'})
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp.headers['Content-Range'], 'entries 2-3/9')
+        self.assertEqual(
+            resp.data.splitlines(),
+            [
+                '10,2013-09-12,10:48:46,17:23:51',
+                '11,2013-09-05,09:28:08,15:51:27',
+            ]
+        )
+
+        resp = self.client.get(url, headers={'Range': 'entries=8-'})
+        self.assertEqual(resp.headers['Content-Range'], 'entries 8-8/9')
+        self.assertEqual(len(resp.data.splitlines()), 1)
+
+        resp = self.client.get(url, headers={'Range': 'entries=9-'})
+        self.assertEqual(resp.status_code, 416)
+        self.assertEqual(resp.headers['Content-Range'], 'entries */9')
+
+    def test_reload(self):
+        """
+        Test reloading data files.
+        """
+        data = utils.get_data()
+        resp = self.client.post('/api/v1/reload')
+        self.assertEqual(resp.status_code, 200)
+        versions = json.loads(resp.data)
+        self.assertEqual(versions['users'], utils.get_data_xml().version)
+        self.assertEqual(versions['data'], utils.get_data().version)
+        self.assertIs(data, utils.get_data())
+
+        resp = self.client.post(
+            '/api/v1/reload', environ_base={'REMOTE_ADDR': '10.0.0.1'}
+        )
+        self.assertEqual(resp.status_code, 403)
+        self.assertEqual(self.client.get('/api/v1/reload').status_code, 405)
+
+    def test_reload_prefork(self):
+        """
+        Test asking master of pre-forked workers to reload all of them.
+        """
+        signals = []
+        handler = signal.signal(
+            signal.SIGHUP, lambda signum, frame: signals.append(signum)
+        )
+        main.app.config['PREFORK_MASTER'] = os.getpid()
+        try:
+            resp = self.client.post('/api/v1/reload')
+        finally:
+            del main.app.config['PREFORK_MASTER']
+            signal.signal(signal.SIGHUP, handler)
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(json.loads(resp.data), {'reloading': True})
+        self.assertEqual(signals, [signal.SIGHUP])
+
+    def test_teams(self):
+        """
+        Test teams listing.
+        """
+        resp = self.client.get('/api/v1/teams')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.data), [
+            {'team_id': 1, 'name': 'Backend', 'members': [10, 11]},
+            {'team_id': 3, 'name': 'Empty', 'members': []},
+            {'team_id': 2, 'name': 'Frontend', 'members': [11, 14, 99]},
+        ])
+
+    def test_team_weekdays(self):
+        """
+        Test weekday statistics summed up from team members.
+        """
+        resp = self.client.get('/api/v1/teams/presence_weekday')
+        self.assertEqual(resp.status_code, 200)
+        teams = json.loads(resp.data)
+        self.assertEqual(sorted(teams), ['1', '2', '3'])
+
+        members = [
+            json.loads(self.client.get(
+                '/api/v1/presence_weekday/{}'.format(user_id)
+            ).data)
+            for user_id in (10, 11)
+        ]
+        self.assertEqual(teams['1'][0], ['Weekday', 'Presence (s)'])
+        self.assertEqual(
+            [total for _, total in teams['1'][1:]],
+            [left[1] + right[1] for left, right in zip(*members)[1:]]
+        )
+        self.assertEqual(
+            [total for _, total in teams['3'][1:]], [0] * 7
+        )
+
+        resp = self.client.get('/api/v1/teams/presence_start_end')
+        start_end = json.loads(resp.data)['1']
+        self.assertEqual(start_end[1][0], 'Tue')
+        self.assertEqual(start_end[1][1:], [(34745 + 33590) / 2.0,
+                                            (64792 + 50154) / 2.0])
+
+        resp = self.client.get('/api/v1/teams/unknown')
+        self.assertEqual(resp.status_code, 404)
+
+    def test_team_overtime(self):
+        """
+        Test overtime hours summed up from team members.
+        """
+        resp = self.client.get('/api/v1/teams/overtime_in_quarter/0')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            json.loads(resp.data), {'1': -1003, '2': -364, '3': 0}
+        )
+        resp = self.client.get('/api/v1/teams/overtime_in_quarter/1')
+        self.assertEqual(resp.status_code, 404)
+
+    def test_health(self):
+        """
+        Test liveness and readiness endpoints around warm-up.
+        """
+        utils.READY.clear()
+        try:
+            self.assertEqual(self.client.get('/healthz').status_code, 200)
+            self.assertEqual(self.client.get('/readyz').status_code, 503)
+            metrics = self.client.get('/api/v1/metrics').data.splitlines()
+            self.assertIn('presence_ready 0', metrics)
+
+            self.assertGreater(utils.warm_up(), 0)
+            resp = self.client.get('/readyz')
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.data, 'ok\n')
+            metrics = self.client.get('/api/v1/metrics').data.splitlines()
+            self.assertIn('presence_ready 1', metrics)
+            self.assertIn(
+                'presence_warmup_seconds',
+                [line.split(' ')[0] for line in metrics]
+            )
+            hits = utils.overtime_hours_in_quarters.cache_info()['hits']
+            utils.overtime_hours_in_quarters(utils.get_data())
+            self.assertEqual(
+                utils.overtime_hours_in_quarters.cache_info()['hits'],
+                hits + 1
+            )
+
+            utils.READY.clear()
+            main.app.config.update({
+                'DATA_CSV': 'missing.csv',
+                'WARMUP_RETRY': 0.01,
+            })
+            self.assertIsNone(utils.warm_up())
+            self.assertEqual(self.client.get('/readyz').status_code, 503)
+
+            # failed warm-up is retried until data can be loaded
+            main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
+            self.assertTrue(utils.READY.wait(5))
+            self.assertEqual(self.client.get('/readyz').status_code, 200)
+        finally:
+            main.app.config.pop('WARMUP_RETRY', None)
+            main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
+            utils.get_data.cache_clear()
+            utils.READY.clear()
+
+    def test_conditional_get(self):
+        """
+        Test answering requests for unchanged data with 304.
+        """
+        resp = self.client.get('/api/v1/presence_weekday/10')
+        self.assertEqual(resp.status_code, 200)
+        etag = resp.headers['ETag']
+        last_modified = resp.headers['Last-Modified']
+        self.assertTrue(etag.startswith('"'))
+
+        resp = self.client.get(
+            '/api/v1/presence_weekday/10',
+            headers={'If-None-Match': etag},
+        )
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, '')
+
+        resp = self.client.get(
+            '/api/v1/presence_weekday/10',
+            headers={'If-Modified-Since': last_modified},
+        )
+        self.assertEqual(resp.status_code, 304)
+
+        resp = self.client.get(
+            '/api/v1/presence_weekday/11',
+            headers={'If-None-Match': etag},
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+        resp = self.client.get(
+            '/api/v1/presence_weekday/0',
+            headers={'If-None-Match': etag},
+        )
+        self.assertEqual(resp.status_code, 404)
+
+    def test_json_response(self):
+        """
+        Test caching encoded body for every version of data.
+        """
+        calls = []
+        snapshots = [store.UserStore('', {})]
+
+        @utils.json_response(lambda: snapshots[0])
+        def view(arg):
+            """
+            Returns given argument. Just for testing purposes.
+            """
+            calls.append(arg)
+            return [arg]
+
+        with main.app.test_request_context():
+            self.assertEqual(view(1).data, '[1]')
+            self.assertEqual(view(1).data, '[1]')
+            self.assertEqual(view(2).data, '[2]')
+            self.assertEqual(calls, [1, 2])
+
+            snapshots[0] = store.UserStore('', {})
+            self.assertEqual(view(1).data, '[1]')
+            self.assertEqual(calls, [1, 2, 1])
+
+    def test_metrics(self):
+        """
+        Test exposing metrics in Prometheus text format.
+        """
+        self.client.get('/api/v1/presence_weekday/10')
+        resp = self.client.get('/api/v1/metrics')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'text/plain')
+
+        lines = resp.data.splitlines()
+        self.assertIn(
+            '# TYPE presence_request_latency_seconds histogram', lines
+        )
+        self.assertIn(
+            'presence_request_latency_seconds_bucket'
+            '{endpoint="presence_weekday_view",le="+Inf"}',
+            [line.split(' ')[0] for line in lines]
+        )
+        self.assertIn(
+            'presence_requests_total'
+            '{endpoint="presence_weekday_view",status="200"}',
+            [line.split(' ')[0] for line in lines]
+        )
+        self.assertIn(
+            'presence_cache_hits_total'
+            '{function="presence_analyzer.utils.get_data"}',
+            [line.split(' ')[0] for line in lines]
+        )
+        self.assertIn(
+            'presence_cache_misses_total'
+            '{function="presence_analyzer.views.presence_weekday_view"}',
+            [line.split(' ')[0] for line in lines]
+        )
+        self.assertNotIn('presence_analyzer.utils.encode', utils.CACHES)
+        self.assertIn('# TYPE presence_csv_rows_total counter', lines)
+
 
 class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
     """
@@ -245,6 +669,7 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         """
         main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
         main.app.config.update({'DATA_XML': TEST_DATA_XML})
+        main.app.config.update({'DATA_TEAMS': TEST_DATA_TEAMS})
 
     def tearDown(self):
         """
@@ -257,7 +682,7 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         Test parsing of CSV file.
         """
         data = utils.get_data()
-        self.assertIsInstance(data, dict)
+        self.assertIsInstance(data, Mapping)
         self.assertItemsEqual(data.keys(), [10, 11, 14, 15, 25])
         sample_date = datetime.date(2013, 9, 10)
         self.assertIn(sample_date, data[10])
@@ -272,7 +697,7 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         Test parsing of XML file.
         """
         data = utils.get_data_xml()
-        self.assertIsInstance(data, dict)
+        self.assertIsInstance(data, Mapping)
         self.assertItemsEqual(data.keys(), [10, 12, 15])
         self.assertEqual(data[10]['name'], 'John Doe')
 
@@ -312,10 +737,18 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
             utils.group_by_weekday(data[10])
         )
         self.assertEqual(
-            [[24123], [16564], [25321], [22969, 22999], [6426], [], []],
+            [[24123], [16564], [25321], [22999, 22969], [6426], [], []],
             utils.group_by_weekday(data[11])
         )
 
+        # 2013-09-05 and 2013-09-12 were Thursdays
+        first = datetime.date(2013, 9, 6).toordinal()
+        last = datetime.date(2013, 9, 12).toordinal()
+        self.assertEqual(
+            [[24123], [16564], [25321], [22969], [], [], []],
+            utils.group_by_weekday(data[11].between(first, last))
+        )
+
     def test_group_by_weekday_start_end(self):
         """
         Test grouping presences by weekday with start and end time.
@@ -336,19 +769,35 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
             {'start': [33134], 'end': [57257]},
             {'start': [33590], 'end': [50154]},
             {'start': [33206], 'end': [58527]},
-            {'start': [37116, 34088], 'end': [60085, 57087]},
+            {'start': [34088, 37116], 'end': [57087, 60085]},
             {'start': [47816], 'end': [54242]},
             {},
             {},
         ]
         self.assertEqual(result, utils.group_by_weekday_start_end(data[11]))
 
+        day = datetime.date(2013, 9, 12).toordinal()
+        result = [
+            {},
+            {},
+            {},
+            {'start': [37116], 'end': [60085]},
+            {},
+            {},
+            {},
+        ]
+        self.assertEqual(
+            result,
+            utils.group_by_weekday_start_end(data[11].between(day, day))
+        )
+
     def test_seconds_since_midnight(self):
         """
         Test calculation of amount of seconds since midnight.
         """
         midnight = datetime.time(0, 0, 0)
         self.assertEqual(0, utils.seconds_since_midnight(midnight))
+        self.assertEqual(44405, utils.seconds_since_midnight(44405))
 
         simple = datetime.time(10, 0, 0)
         self.assertEqual(36000, utils.seconds_since_midnight(simple))
@@ -384,6 +833,44 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         self.assertEqual(1.0, utils.mean([0, 2]))
         self.assertEqual(0, utils.mean([]))
 
+    def test_mean_of_sum(self):
+        """
+        Test calculation of arithmetic mean from sum and amount of items.
+        """
+        self.assertEqual(2.0, utils.mean_of_sum(6, 3))
+        self.assertEqual(2.5, utils.mean_of_sum(5, 2))
+        self.assertEqual(0, utils.mean_of_sum(0, 0))
+
+    def test_collation_key(self):
+        """
+        Test sorting names in polish alphabetical order.
+        """
+        names = [
+            'Zenon', 'łukasz', 'Lucyna', 'Ćwik', 'Cyryl', 'Ewa', 'Élise',
+            'Ęka', 'Maciej', 'Anna Nowak', 'Anna-Maria', 'Annabel', 'Żaneta',
+            'Źdźbło', 'Rafał', 'Quentin', 'Piotr', None,
+        ]
+        self.assertEqual(
+            sorted(names, key=utils.collation_key),
+            [
+                None, 'Annabel', 'Anna-Maria', 'Anna Nowak', 'Cyryl', 'Ćwik',
+                'Élise', 'Ewa', 'Ęka', 'Lucyna', 'łukasz', 'Maciej', 'Piotr',
+                'Quentin', 'Rafał', 'Zenon', 'Źdźbło', 'Żaneta',
+            ]
+        )
+
+    def test_sorted_users(self):
+        """
+        Test building sorted users listing once for loaded users.
+        """
+        users = utils.get_data_xml()
+        result = utils.sorted_users(users)
+        self.assertEqual(
+            [user['name'] for user in result],
+            ['John Doe', 'Overtime Master', 'Rambo J.']
+        )
+        self.assertIs(utils.sorted_users(users), result)
+
     def test_cache(self):
         """
         Test caching data for given time.
@@ -394,7 +881,6 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
             """
             return []
 
-        utils.cache.data.clear()
         data_1 = func()
         data_2 = func()
         self.assertIsNot(data_1, data_2)
@@ -408,7 +894,178 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         wrapped_data_1 = wrapped_func()
         wrapped_data_2 = wrapped_func()
         self.assertIsNot(wrapped_data_1, wrapped_data_2)
-        utils.cache.data.clear()
+
+    def test_cache_arguments(self):
+        """
+        Test caching data separately for every set of arguments.
+        """
+        calls = []
+
+        @utils.cache(5, maxsize=2)
+        def func(*args, **kwargs):
+            """
+            Returns given arguments. Just for testing purposes.
+            """
+            calls.append(args)
+            return [args, kwargs]
+
+        self.assertIs(func(1), func(1))
+        self.assertIsNot(func(1), func(2))
+        self.assertIs(func(1, a=1, b=2), func(1, b=2, a=1))
+        self.assertEqual(calls, [(1,), (2,), (1,)])
+        self.assertEqual(
+            func.cache_info(),
+            {
+                'hits': 3,
+                'misses': 3,
+                'stale': 0,
+                'refreshes': 0,
+                'failures': 0,
+                'size': 2,
+                'maxsize': 2,
+            }
+        )
+
+        # least recently used results are dropped
+        func(1)
+        func(2)
+        self.assertEqual(calls, [(1,), (2,), (1,), (1,), (2,)])
+
+        # unhashable arguments are not cached
+        self.assertIsNot(func([1]), func([1]))
+
+        # invalidated results are computed again, statistics are kept
+        func.cache_invalidate()
+        self.assertEqual(func.cache_info()['size'], 0)
+        self.assertEqual(func.cache_info()['hits'], 3)
+        func(1)
+        self.assertEqual(func.cache_info()['misses'], 6)
+
+        # expired results are computed again
+        func.cache_expire()
+        self.assertEqual(func.cache_info()['size'], 1)
+        func(1)
+        self.assertEqual(func.cache_info()['misses'], 7)
+        self.assertEqual(calls[-1], (1,))
+
+        # frozen results don't expire until cleared
+        func.cache_freeze()
+        func.cache_expire()
+        self.assertIs(func(1), func(1))
+        self.assertEqual(func.cache_info()['misses'], 7)
+
+        func.cache_clear()
+        self.assertEqual(func.cache_info()['hits'], 0)
+        self.assertEqual(func.cache_info()['size'], 0)
+
+    def test_cache_single_flight(self):
+        """
+        Test computing data once for concurrent calls with same arguments.
+        """
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        @utils.cache(5)
+        def func(arg):
+            """
+            Blocks first call until released. Just for testing purposes.
+            """
+            calls.append(arg)
+            if arg == 'slow':
+                started.set()
+                release.wait(5)
+            return [arg]
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(func('slow')))
+            for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        started.wait(5)
+
+        # other arguments are not blocked by slow computation
+        self.assertEqual(func('fast'), ['fast'])
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(calls.count('slow'), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+
+    def test_cache_stale(self):
+        """
+        Test returning expired data while it is refreshed in background.
+        """
+        calls = []
+        refreshed = threading.Event()
+
+        @utils.cache(0, stale=True)
+        def func():
+            """
+            Fails on second call. Just for testing purposes.
+            """
+            calls.append(len(calls))
+            if len(calls) > 1:
+                refreshed.set()
+            if len(calls) == 2:
+                raise ValueError()
+            return calls[:]
+
+        self.assertIsNone(func.cache_age())
+        first = func()
+        self.assertEqual(first, [0])
+        self.assertGreaterEqual(func.cache_age(), 0)
+
+        self.assertIs(func(), first)
+        refreshed.wait(5)
+        while func.cache_info()['failures'] == 0:
+            refreshed.wait(0.01)
+        self.assertIs(func(), first)
+
+        while func.cache_info()['refreshes'] == 0:
+            refreshed.wait(0.01)
+        self.assertEqual(func(), [0, 1, 2])
+        info = func.cache_info()
+        self.assertEqual(info['misses'], 1)
+        self.assertEqual(info['failures'], 1)
+        self.assertEqual(info['refreshes'], 1)
+
+    def test_cache_presence_views(self):
+        """
+        Test caching results for views on presence data.
+        """
+        data = utils.get_data()
+        self.assertEqual(data[10], data[10])
+        self.assertNotEqual(data[10], data[11])
+        self.assertIs(
+            utils.group_by_weekday(data[10]),
+            utils.group_by_weekday(data[10])
+        )
+        utils.group_by_weekday_start_end(data[10])
+        utils.team_statistics(data, utils.get_teams())
+        self.assertEqual(utils.group_quarters.cache_info()['size'], 1)
+
+        # results on the old store are dropped once new one is loaded
+        directory = tempfile.mkdtemp()
+        try:
+            csv_name = os.path.join(directory, 'data.csv')
+            shutil.copy(TEST_DATA_CSV, csv_name)
+            main.app.config.update({'DATA_CSV': csv_name})
+            utils.get_data.cache_invalidate()
+            self.assertIsNot(utils.get_data(), data)
+            for func in (utils.group_by_weekday,
+                         utils.group_by_weekday_start_end,
+                         utils.group_quarters,
+                         utils.overtime_hours_in_quarters,
+                         utils.team_statistics):
+                self.assertEqual(func.cache_info()['size'], 0)
+        finally:
+            main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
+            utils.get_data.cache_invalidate()
+            shutil.rmtree(directory)
 
     def test_group_quarters(self):
         """
@@ -423,6 +1080,39 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         }
         self.assertEqual(result, utils.group_quarters(data))
 
+        # days of every user spanning several quarters
+        days = [
+            datetime.date(*day).toordinal()
+            for day in ((2012, 12, 31), (2013, 3, 31), (2013, 8, 1))
+        ]
+        data = store.PresenceStore.from_rows(
+            [(10, day, 0, 1) for day in days] + [(11, days[1], 0, 1)]
+        )
+        self.assertEqual(
+            [
+                (quarter['year'], quarter['numeral'])
+                for _, quarter in sorted(utils.group_quarters(data).items())
+            ],
+            [(2012, 4), (2013, 1), (2013, 3)]
+        )
+
+    def test_quarter_of_month(self):
+        """
+        Test finding quarter of month and of date ordinal.
+        """
+        self.assertEqual(
+            [utils.quarter_of_month(month) for month in range(1, 13)],
+            [1, 1, 1, 2, 2, 2, 2, 3, 3, 3, 3, 4]
+        )
+        self.assertEqual(
+            utils.quarter_of_day(datetime.date(2013, 8, 1).toordinal()),
+            (2013, 3)
+        )
+        self.assertEqual(
+            utils.quarter_of_day(datetime.date(2013, 7, 31).toordinal()),
+            (2013, 2)
+        )
+
     def test_overtime_hours_in_quarter(self):
         """
         Test calculation of overtime hours for every user in given quarter.
@@ -438,6 +1128,91 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         }
         self.assertEqual(hours, utils.overtime_hours_in_quarter(data, quarter))
 
+    def test_team_statistics(self):
+        """
+        Test summing up statistics of teams in one pass.
+        """
+        data = utils.get_data()
+        teams = parsers.parse_teams_xml(TEST_DATA_TEAMS)
+        result = utils.team_statistics(data, teams)
+        self.assertIs(result, utils.team_statistics(data, teams))
+        self.assertEqual(
+            result[2]['weekdays'],
+            [
+                tuple(left + right for left, right in zip(*sums))
+                for sums in zip(data[11].weekdays(), data[14].weekdays())
+            ]
+        )
+        self.assertEqual(result[3]['weekdays'], [(0, 0, 0, 0)] * 7)
+        self.assertEqual(result[1]['overtime'], {0: -1003})
+
+    def test_get_teams(self):
+        """
+        Test loading teams next to users XML file unless configured.
+        """
+        teams = main.app.config.pop('DATA_TEAMS')
+        directory = tempfile.mkdtemp()
+        try:
+            main.app.config.update({
+                'DATA_XML': os.path.join(directory, 'users.xml'),
+            })
+            utils.get_teams.cache_clear()
+            self.assertEqual(len(utils.get_teams()), 0)
+
+            shutil.copy(TEST_DATA_TEAMS, os.path.join(directory, 'teams.xml'))
+            utils.get_teams.cache_clear()
+            self.assertEqual(utils.get_teams()[1]['name'], 'Backend')
+        finally:
+            main.app.config.update({
+                'DATA_XML': TEST_DATA_XML,
+                'DATA_TEAMS': teams,
+            })
+            utils.get_teams.cache_clear()
+            shutil.rmtree(directory)
+
+    def test_overtime_hours_in_quarters(self):
+        """
+        Test calculation of overtime hours for every user in every quarter.
+        """
+        data = utils.get_data()
+        result = utils.overtime_hours_in_quarters(data)
+        self.assertEqual(result.keys(), [0])
+        self.assertEqual(
+            result[0],
+            utils.overtime_hours_in_quarter(data, {'year': 2013, 'numeral': 3})
+        )
+        self.assertIs(result, utils.overtime_hours_in_quarters(data))
+
+    def test_quarter_days(self):
+        """
+        Test calculation of date ordinals bounding quarter.
+        """
+        for year, quarter in ((2013, 1), (2013, 2), (2013, 3), (2016, 4)):
+            begin, end = utils.quarter_days(year, quarter)
+            self.assertTrue(utils.date_in_quarter(
+                datetime.date.fromordinal(begin), year, quarter
+            ))
+            self.assertTrue(utils.date_in_quarter(
+                datetime.date.fromordinal(end - 1), year, quarter
+            ))
+            self.assertFalse(utils.date_in_quarter(
+                datetime.date.fromordinal(begin - 1), year, quarter
+            ))
+            self.assertFalse(utils.date_in_quarter(
+                datetime.date.fromordinal(end), year, quarter
+            ))
+
+    def test_working_days(self):
+        """
+        Test counting working days between date ordinals.
+        """
+        monday = datetime.date(2017, 4, 17).toordinal()
+        self.assertEqual(0, utils.working_days(monday, monday))
+        self.assertEqual(1, utils.working_days(monday, monday + 1))
+        self.assertEqual(5, utils.working_days(monday, monday + 7))
+        self.assertEqual(0, utils.working_days(monday + 5, monday + 7))
+        self.assertEqual(6, utils.working_days(monday + 4, monday + 12))
+
     def test_working_days_in_quarter(self):
         """
         Test calculation of working days for given quarter and year.
@@ -465,6 +1240,1638 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         self.assertFalse(utils.date_in_quarter(test_date, 2013, 1))
 
 
+class PresenceAnalyzerMetricsTestCase(unittest.TestCase):
+    """
+    Metrics tests.
+    """
+
+    def test_counter(self):
+        """
+        Test rendering counter with labels.
+        """
+        counter = metrics.Counter(
+            'test_total', 'Test.', labels=('name',), register=False
+        )
+        counter.inc(labels=('a"b',))
+        counter.inc(2, ('a"b',))
+        counter.inc(labels=('c',))
+        self.assertEqual(
+            counter.render(),
+            [
+                '# HELP test_total Test.',
+                '# TYPE test_total counter',
+                'test_total{name="a\\"b"} 3',
+                'test_total{name="c"} 1',
+            ]
+        )
+
+    def test_histogram(self):
+        """
+        Test counting observed values in buckets.
+        """
+        histogram = metrics.Histogram(
+            'test_seconds', 'Test.', buckets=(0.1, 1), register=False
+        )
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(0.5)
+        histogram.observe(2.0)
+        self.assertEqual(
+            histogram.render()[2:],
+            [
+                'test_seconds_bucket{le="0.1"} 2',
+                'test_seconds_bucket{le="1.0"} 3',
+                'test_seconds_bucket{le="+Inf"} 4',
+                'test_seconds_sum 2.65',
+                'test_seconds_count 4',
+            ]
+        )
+        with histogram.time():
+            pass
+        self.assertEqual(histogram.render()[-1], 'test_seconds_count 5')
+
+    def test_collector(self):
+        """
+        Test rendering values collected on demand.
+        """
+        collector = metrics.Collector(
+            'test_size', 'Test.', 'gauge', ('name',),
+            lambda: [(('b',), 2), (('a',), 1)], register=False,
+        )
+        self.assertEqual(
+            collector.render()[1:],
+            [
+                '# TYPE test_size gauge',
+                'test_size{name="a"} 1',
+                'test_size{name="b"} 2',
+            ]
+        )
+
+    def test_rows(self):
+        """
+        Test counting parsed and rejected rows.
+        """
+        metrics.ROWS.clear()
+        list(parsers.parse_csv(['10,2013-09-10,09:39:05,17:59:52', 'x,,,']))
+        self.assertEqual(
+            metrics.ROWS.values,
+            {('parsed',): 1, ('rejected',): 1}
+        )
+
+
+class PresenceLoaderTestCase(unittest.TestCase):
+    """
+    Incremental CSV loader tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up an environment.
+        """
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'data.csv')
+        with open(self.file_name, 'w') as csv_file:
+            csv_file.write('10,2013-09-10,09:39:05,17:59:52\n')
+        self.loader = utils.PresenceLoader()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        shutil.rmtree(self.directory)
+
+    def append(self, text):
+        """
+        Appends text to CSV file.
+        """
+        with open(self.file_name, 'a') as csv_file:
+            csv_file.write(text)
+
+    def test_load(self):
+        """
+        Test parsing only appended lines.
+        """
+        data = self.loader.load(self.file_name)
+        self.assertEqual(len(data[10]), 1)
+        self.assertIs(data, self.loader.load(self.file_name))
+        self.assertEqual(self.loader.lines, 1)
+
+        self.append('10,2013-09-11,09:19:52,16:07:37\n11,2013-09-05,09:28')
+        data = self.loader.load(self.file_name)
+        self.assertEqual(len(data[10]), 2)
+        self.assertNotIn(11, data)
+        self.assertEqual(self.loader.lines, 2)
+        offset = self.loader.offset
+
+        self.append(':08,15:51:27\n')
+        data = self.loader.load(self.file_name)
+        self.assertEqual(len(data[11]), 1)
+        self.assertEqual(self.loader.lines, 3)
+        self.assertEqual(self.loader.offset, offset + 32)
+
+    def test_load_parallel(self):
+        """
+        Test parsing chunks of file by worker processes.
+        """
+        with open(TEST_DATA_CSV) as test_file:
+            lines = test_file.readlines()
+        lines.insert(40, '14,2013-09-31,01:00:00,23:00:00\n')
+        lines.insert(80, '10,2013-09-10,09:39:05,17:59:52\n')
+        with open(self.file_name, 'w') as csv_file:
+            csv_file.write('user_id,date,start,end\n')
+            csv_file.writelines(lines)
+            csv_file.write('15,2013-09-30,01:00:00,23:0')
+
+        messages = []
+        handler = logging.Handler(logging.DEBUG)
+        handler.emit = messages.append
+        logger = logging.getLogger('presence_analyzer')
+        level = logger.level
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        chunk_size = utils.CHUNK_SIZE
+        utils.CHUNK_SIZE = 100
+        try:
+            expected = utils.PresenceLoader()
+            expected_data = expected.load(self.file_name)
+            data = self.loader.load(self.file_name, workers=4)
+        finally:
+            utils.CHUNK_SIZE = chunk_size
+            logger.removeHandler(handler)
+            logger.setLevel(level)
+
+        self.assertEqual(
+            [
+                record.args[0] for record in messages
+                if record.msg.startswith('Problem with line')
+            ],
+            [0, 41, 99, 0, 41, 99]
+        )
+        for column in ('user_ids', 'days', 'starts', 'ends'):
+            self.assertEqual(
+                list(getattr(data, column)),
+                list(getattr(expected_data, column))
+            )
+        self.assertEqual(data.aggregates, expected_data.aggregates)
+        self.assertEqual(
+            (self.loader.offset, self.loader.lines),
+            (expected.offset, expected.lines)
+        )
+
+        self.append('0\n15,2013-09-31,01:00:00,23:00:00\n')
+        self.assertEqual(len(self.loader.load(self.file_name, workers=4)), 5)
+        self.assertEqual(self.loader.lines, expected.lines + 2)
+
+    def test_load_unterminated_line(self):
+        """
+        Test reading last line without line break again.
+        """
+        self.append('11,2013-09-05,09:28:08,15:51:27')
+        data = self.loader.load(self.file_name)
+        self.assertEqual(len(data[11]), 1)
+        self.assertEqual(self.loader.lines, 1)
+
+        self.append('\n11,2013-09-06,09:28:08,15:51:27\n')
+        data = self.loader.load(self.file_name)
+        self.assertEqual(len(data[11]), 2)
+        self.assertEqual(self.loader.lines, 3)
+
+    def test_load_replaced(self):
+        """
+        Test reading truncated or replaced file from the beginning.
+        """
+        self.loader.load(self.file_name)
+        with open(self.file_name, 'w') as csv_file:
+            csv_file.write('1,2013-09-05,09:28:08,15:51:27\n')
+        data = self.loader.load(self.file_name)
+        self.assertEqual(list(data), [1])
+
+        other_name = os.path.join(self.directory, 'other.csv')
+        with open(other_name, 'w') as csv_file:
+            csv_file.write(
+                '12,2013-09-05,09:28:08,15:51:27\n'
+                '12,2013-09-06,09:28:08,15:51:27\n'
+            )
+        os.rename(other_name, self.file_name)
+        data = self.loader.load(self.file_name)
+        self.assertEqual(list(data), [12])
+        self.assertEqual(self.loader.lines, 2)
+
+
+class PresenceSnapshotTestCase(unittest.TestCase):
+    """
+    Binary snapshot tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up an environment.
+        """
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'data.csv')
+        self.snapshot_name = os.path.join(self.directory, 'data.snapshot')
+        shutil.copy(TEST_DATA_CSV, self.file_name)
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        shutil.rmtree(self.directory)
+
+    def compile(self):
+        """
+        Writes snapshot of CSV file.
+        """
+        loader = utils.PresenceLoader()
+        data = loader.load(self.file_name)
+        snapshot.write_snapshot(
+            self.snapshot_name, data, loader.inode, loader.offset,
+            loader.lines, loader.mtime,
+            snapshot.csv_digest(self.file_name, loader.offset),
+        )
+        return data, loader
+
+    def test_read_snapshot(self):
+        """
+        Test reading store from written snapshot.
+        """
+        data, loader = self.compile()
+        mapped, inode, offset, lines, mtime, digest = \
+            snapshot.read_snapshot(self.snapshot_name)
+        self.assertEqual(
+            (inode, offset, lines, mtime),
+            (loader.inode, loader.offset, loader.lines, loader.mtime)
+        )
+        with open(self.file_name, 'rb') as csv_file:
+            self.assertEqual(
+                digest,
+                sha1(csv_file.read()[-snapshot.DIGEST_BLOCK:]).digest()
+            )
+        for column in ('user_ids', 'days', 'starts', 'ends'):
+            self.assertEqual(
+                list(getattr(mapped, column)),
+                list(getattr(data, column))
+            )
+        self.assertEqual(mapped.offsets, data.offsets)
+        self.assertEqual(list(mapped), list(data))
+        for user_id in data:
+            self.assertEqual(
+                mapped[user_id].weekdays(),
+                data[user_id].weekdays()
+            )
+            self.assertEqual(dict(mapped[user_id]), dict(data[user_id]))
+        self.assertEqual(
+            utils.overtime_hours_in_quarters(mapped),
+            utils.overtime_hours_in_quarters(data)
+        )
+
+    def test_read_invalid_snapshot(self):
+        """
+        Test ignoring missing, truncated and unknown snapshots.
+        """
+        self.assertIsNone(snapshot.read_snapshot(self.snapshot_name))
+
+        self.compile()
+        with open(self.snapshot_name, 'r+b') as snapshot_file:
+            snapshot_file.truncate(200)
+        self.assertIsNone(snapshot.read_snapshot(self.snapshot_name))
+
+        with open(self.snapshot_name, 'wb') as snapshot_file:
+            snapshot_file.write(snapshot.HEADER.pack(
+                snapshot.MAGIC, snapshot.VERSION + 1, 0, 0, 0, 0, 0, 0, b''
+            ))
+        self.assertIsNone(snapshot.read_snapshot(self.snapshot_name))
+
+    def test_load_snapshot(self):
+        """
+        Test loading snapshot and lines appended after it was compiled.
+        """
+        self.compile()
+        with open(self.file_name, 'a') as csv_file:
+            csv_file.write('99,2013-09-10,09:39:05,17:59:52\n')
+
+        loader = utils.PresenceLoader()
+        data = loader.load(self.file_name, self.snapshot_name)
+        self.assertEqual(list(data), [10, 11, 14, 15, 25, 99])
+        self.assertEqual(loader.lines, 97)
+
+        # appended entries don't copy the mapped columns
+        self.assertIsInstance(data, store.AppendedStore)
+        self.assertIs(data.base.days._type_, ctypes.c_int32)
+        with open(self.file_name, 'a') as csv_file:
+            csv_file.write('10,2013-09-10,09:00:00,17:00:00\n')
+        appended = loader.load(self.file_name, self.snapshot_name)
+        self.assertIs(appended.base, data.base)
+        self.assertEqual(appended[10][datetime.date(2013, 9, 10)], {
+            'start': datetime.time(9, 0, 0), 'end': datetime.time(17, 0, 0),
+        })
+
+        # snapshot of other file is not used
+        os.rename(self.file_name, self.snapshot_name + '.csv')
+        with open(self.file_name, 'w') as csv_file:
+            csv_file.write('98,2013-09-10,09:39:05,17:59:52\n')
+        loader = utils.PresenceLoader()
+        data = loader.load(self.file_name, self.snapshot_name)
+        self.assertEqual(list(data), [98])
+
+    def test_load_rewritten(self):
+        """
+        Test ignoring snapshot of CSV file rewritten in place.
+        """
+        self.compile()
+        with open(self.file_name, 'r+b') as csv_file:
+            text = csv_file.read()
+            csv_file.seek(0)
+            csv_file.write(text.replace('10,', '12,', 1))
+        os.utime(self.file_name, (0, 0))
+
+        loader = utils.PresenceLoader()
+        data = loader.load(self.file_name, self.snapshot_name)
+        self.assertEqual(list(data), [10, 11, 12, 14, 15, 25])
+
+        # only the last block before the compiled position is compared
+        block = snapshot.DIGEST_BLOCK
+        snapshot.DIGEST_BLOCK = 64
+        try:
+            self.compile()
+            with open(self.file_name, 'r+b') as csv_file:
+                text = csv_file.read()
+                # user of the last line is changed
+                csv_file.seek(text.rindex(b'\n', 0, len(text) - 1) + 1)
+                csv_file.write(b'13')
+            os.utime(self.file_name, (1, 1))
+            data = utils.PresenceLoader().load(
+                self.file_name, self.snapshot_name
+            )
+            self.assertIn(13, data)
+            self.assertIsInstance(data, store.PresenceStore)
+        finally:
+            snapshot.DIGEST_BLOCK = block
+
+
+class PresenceStoreTestCase(unittest.TestCase):
+    """
+    Columnar presence store tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up an environment.
+        """
+        day = datetime.date(2013, 9, 10).toordinal()
+        self.store = store.PresenceStore.from_rows([
+            (11, day + 1, 100, 200),
+            (10, day, 34745, 64792),
+            (11, day, 300, 400),
+            (11, day + 1, 500, 600),
+        ])
+
+    def test_from_rows(self):
+        """
+        Test sorting columns and overriding duplicated entries.
+        """
+        day = datetime.date(2013, 9, 10).toordinal()
+        self.assertEqual(list(self.store.user_ids), [10, 11, 11])
+        self.assertEqual(list(self.store.days), [day, day, day + 1])
+        self.assertEqual(list(self.store.starts), [34745, 300, 500])
+        self.assertEqual(list(self.store.ends), [64792, 400, 600])
+        self.assertEqual(self.store.offsets, {10: (0, 1), 11: (1, 3)})
+        self.assertEqual(self.store.nbytes, 48)
+
+    def test_interval_sums(self):
+        """
+        Test running sums of intervals.
+        """
+        sums = self.store.interval_sums()
+        self.assertEqual(list(sums), [0, 30047, 30147, 30247])
+        self.assertIs(sums, self.store.interval_sums())
+
+    def test_mapping_view(self):
+        """
+        Test read-only mapping interface of store.
+        """
+        self.assertEqual(list(self.store), [10, 11])
+        self.assertEqual(len(self.store), 2)
+        self.assertIn(11, self.store)
+        self.assertNotIn(12, self.store)
+        with self.assertRaises(KeyError):
+            self.store[12]  # pylint: disable=pointless-statement
+
+        user = self.store[11]
+        self.assertEqual(len(user), 2)
+        self.assertEqual(
+            list(user),
+            [datetime.date(2013, 9, 10), datetime.date(2013, 9, 11)]
+        )
+        self.assertIn(datetime.date(2013, 9, 11), user)
+        self.assertNotIn(datetime.date(2013, 9, 12), user)
+        self.assertEqual(
+            user[datetime.date(2013, 9, 11)],
+            {'start': datetime.time(0, 8, 20), 'end': datetime.time(0, 10)}
+        )
+        with self.assertRaises(KeyError):
+            # pylint: disable=pointless-statement
+            user[datetime.date(2013, 9, 9)]
+
+    def test_merge(self):
+        """
+        Test adding rows to store.
+        """
+        day = datetime.date(2013, 9, 10).toordinal()
+        merged = self.store.merge([
+            (12, day, 1, 2),
+            (11, day + 2, 3, 4),
+            (11, day, 5, 6),
+        ])
+        self.assertEqual(list(merged.user_ids), [10, 11, 11, 11, 12])
+        self.assertEqual(
+            list(merged.days),
+            [day, day, day + 1, day + 2, day]
+        )
+        self.assertEqual(list(merged.starts), [34745, 5, 500, 3, 1])
+        self.assertEqual(list(merged.ends), [64792, 6, 600, 4, 2])
+        self.assertEqual(list(self.store.user_ids), [10, 11, 11])
+
+        merged = self.store.merge([(11, day + 2, 3, 4)])
+        self.assertEqual(list(merged.days), [day, day, day + 1, day + 2])
+        self.assertIs(self.store, self.store.merge([]))
+
+    def assert_same_entries(self, data, expected):
+        """
+        Checks that data gives the same entries and sums as expected store.
+        """
+        self.assertEqual(list(data), list(expected))
+        day = datetime.date(2013, 9, 10).toordinal()
+        for user_id in expected:
+            user, other = data[user_id], expected[user_id]
+            self.assertEqual(dict(user), dict(other))
+            self.assertEqual(len(user), len(other))
+            self.assertEqual(user.weekdays(), other.weekdays())
+            for skip, count in ((0, None), (2, 3), (len(other) - 1, 5)):
+                self.assertEqual(
+                    list(user.entries(skip, count)),
+                    list(other.entries(skip, count)),
+                )
+            for first, last in ((day + 20, None), (None, day + 26)):
+                self.assertEqual(
+                    list(user.between(first, last).entries()),
+                    list(other.between(first, last).entries()),
+                )
+                self.assertEqual(
+                    user.between(first, last).weekdays(),
+                    other.between(first, last).weekdays(),
+                )
+            self.assertEqual(
+                utils.group_by_weekday_start_end(user),
+                utils.group_by_weekday_start_end(other),
+            )
+        self.assertEqual(
+            utils.group_quarters(data), utils.group_quarters(expected)
+        )
+        quarter = {'year': 2013, 'numeral': 3}
+        self.assertEqual(
+            utils.overtime_hours_in_quarter(data, quarter),
+            utils.overtime_hours_in_quarter(expected, quarter),
+        )
+
+    def test_append(self):
+        """
+        Test adding rows without copying entries of the store.
+        """
+        day = datetime.date(2013, 9, 10).toordinal()
+        rows = [
+            (user_id, day + i, 30000 + user_id, 60000 + i)
+            for user_id in (10, 11, 13) for i in range(30)
+        ]
+        base = store.PresenceStore.from_rows(rows)
+        appended = [
+            (11, day + 25, 1, 2), (12, day, 5, 6), (13, day + 40, 7, 8),
+        ]
+        merged = base.merge(appended)
+        self.assertIsInstance(merged, store.AppendedStore)
+        self.assertIs(merged.base, base)
+        self.assertEqual(len(merged.overlay.days), 7)
+        self.assertEqual(merged[10], base[10])
+        self.assertEqual(merged[11], merged[11])
+        self.assertIn(12, merged)
+        self.assertNotIn(14, merged)
+        self.assertEqual(
+            merged[11][datetime.date(2013, 10, 5)],
+            {'start': datetime.time(0, 0, 1), 'end': datetime.time(0, 0, 2)}
+        )
+        self.assert_same_entries(
+            merged, store.PresenceStore.from_rows(rows + appended)
+        )
+
+        # later rows are added to the overlay only
+        rows += appended
+        appended = [(10, day + 40, 1, 2), (11, day + 20, 3, 4)]
+        merged = merged.merge(appended)
+        self.assertIs(merged.base, base)
+        self.assert_same_entries(
+            merged, store.PresenceStore.from_rows(rows + appended)
+        )
+        self.assertIs(merged, merged.merge([]))
+
+        # large overlay is combined with the base
+        rows += appended
+        appended = [(14, day + i, 1, 2) for i in range(30)]
+        merged = merged.merge(appended)
+        self.assertIsInstance(merged, store.PresenceStore)
+        self.assert_same_entries(
+            merged, store.PresenceStore.from_rows(rows + appended)
+        )
+        self.assertEqual(merged.offsets[14], (93, 123))
+
+    def test_between(self):
+        """
+        Test narrowing user entries to range of dates.
+        """
+        day = datetime.date(2013, 9, 10).toordinal()
+        user = self.store[11]
+        self.assertEqual(len(user.between(day + 1)), 1)
+        self.assertEqual(len(user.between(None, day)), 1)
+        self.assertEqual(len(user.between(day, day + 1)), 2)
+        self.assertEqual(len(user.between(day + 2)), 0)
+        self.assertEqual(user.between(), user)
+        self.assertEqual(
+            user.between(day + 1).weekdays()[2], (1, 100, 500, 600)
+        )
+
+    def test_weekdays(self):
+        """
+        Test weekday sums of user entries.
+        """
+        # 2013-09-10 was Tuesday
+        self.assertEqual(
+            self.store[11].weekdays(),
+            [
+                (0, 0, 0, 0),
+                (1, 100, 300, 400),
+                (1, 100, 500, 600),
+                (0, 0, 0, 0),
+                (0, 0, 0, 0),
+                (0, 0, 0, 0),
+                (0, 0, 0, 0),
+            ]
+        )
+        partial = store.UserPresence(self.store, 2, 3)
+        self.assertEqual(partial.weekdays()[1], (0, 0, 0, 0))
+        self.assertEqual(partial.weekdays()[2], (1, 100, 500, 600))
+
+    def test_merge_weekdays(self):
+        """
+        Test updating weekday sums when rows are added.
+        """
+        day = datetime.date(2013, 9, 10).toordinal()
+        merged = self.store.merge([
+            (11, day + 7, 1000, 2000),
+            (12, day, 1, 2),
+        ])
+        self.assertIs(merged.aggregates[10], self.store.aggregates[10])
+        self.assertEqual(merged[11].weekdays()[1], (2, 1100, 1300, 2400))
+        self.assertEqual(merged[12].weekdays()[1], (1, 1, 1, 2))
+
+        merged = self.store.merge([(11, day, 1000, 2000)])
+        self.assertEqual(merged[11].weekdays()[1], (1, 1000, 1000, 2000))
+        for user_id in merged:
+            self.assertEqual(
+                merged.aggregates[user_id],
+                store.aggregate_weekdays(
+                    merged.days, merged.starts, merged.ends,
+                    *merged.offsets[user_id]
+                )
+            )
+
+    def test_weekday(self):
+        """
+        Test calculation of weekday from date ordinal.
+        """
+        for day in range(1, 15):
+            test_date = datetime.date(2017, 4, day)
+            self.assertEqual(
+                test_date.weekday(),
+                store.weekday(test_date.toordinal())
+            )
+
+    def test_seconds_to_time(self):
+        """
+        Test conversion of seconds since midnight to time object.
+        """
+        self.assertEqual(datetime.time(0, 0, 0), store.seconds_to_time(0))
+        self.assertEqual(
+            datetime.time(12, 20, 5),
+            store.seconds_to_time(44405)
+        )
+        self.assertEqual(
+            datetime.time(23, 59, 59),
+            store.seconds_to_time(86399)
+        )
+
+
+class PresenceAnalyzerParsersTestCase(unittest.TestCase):
+    """
+    Data files parsers tests.
+    """
+
+    def test_parse_day(self):
+        """
+        Test conversion of date string to date ordinal.
+        """
+        ordinal = datetime.date(2013, 9, 5).toordinal()
+        self.assertEqual(ordinal, parsers.parse_day('2013-09-05'))
+        self.assertEqual(ordinal, parsers.parse_day('2013-9-5'))
+        with self.assertRaises(ValueError):
+            parsers.parse_day('2013-02-30')
+        with self.assertRaises(ValueError):
+            parsers.parse_day('2013/09/05')
+
+    def test_parse_time(self):
+        """
+        Test conversion of time string to seconds since midnight.
+        """
+        self.assertEqual(0, parsers.parse_time('00:00:00'))
+        self.assertEqual(44405, parsers.parse_time('12:20:05'))
+        self.assertEqual(44405, parsers.parse_time('12:20:5'))
+        self.assertEqual(86399, parsers.parse_time('23:59:59'))
+        with self.assertRaises(ValueError):
+            parsers.parse_time('24:00:00')
+        with self.assertRaises(ValueError):
+            parsers.parse_time('-1:00:00')
+        with self.assertRaises(ValueError):
+            parsers.parse_time('12:20')
+
+    def test_parse_csv(self):
+        """
+        Test parsing CSV lines with header, footer and malformed lines.
+        """
+        lines = [
+            'user_id,date,start,end\n',
+            '10,2013-09-10,09:39:05,17:59:52\r\n',
+            '10,2013-09-11,09:19:52\n',
+            'x,2013-09-11,09:19:52,16:07:37\n',
+            '10,2013-09-31,09:19:52,16:07:37\n',
+            '11,2013-09-05,09:28:08,15:51:27\n',
+            '\n',
+            '2 rows\n',
+        ]
+        day = datetime.date(2013, 9, 10).toordinal()
+        self.assertEqual(
+            [(10, day, 34745, 64792), (11, day - 5, 34088, 57087)],
+            list(parsers.parse_csv(lines))
+        )
+
+        errors = []
+        self.assertEqual(len(list(parsers.parse_csv(lines, 5, errors))), 2)
+        self.assertEqual([i for i, _ in errors], [5, 8, 9])
+
+    def test_split_csv(self):
+        """
+        Test dividing file into chunks of whole lines.
+        """
+        with tempfile.TemporaryFile() as csv_file:
+            csv_file.write('1,a\n22,bb\n333,ccc\n4,d')
+            bounds = parsers.split_csv(csv_file, 0, 21, 3)
+            self.assertEqual(bounds, [(0, 10), (10, 18), (18, 21)])
+            self.assertEqual(
+                parsers.split_csv(csv_file, 4, 21, 10),
+                [(4, 10), (10, 18), (18, 21)]
+            )
+            self.assertEqual(parsers.split_csv(csv_file, 0, 4, 1), [(0, 4)])
+
+    def test_parse_users_xml(self):
+        """
+        Test parsing XML file with users.
+        """
+        users = parsers.parse_users_xml(TEST_DATA_XML)
+        self.assertIsInstance(users, store.UserStore)
+        self.assertEqual(users.link, 'https://intranet.stxnext.pl:1234')
+        self.assertEqual(
+            users.users,
+            {
+                10: ('John Doe', '/api/images/users/10'),
+                12: ('Rambo J.', '/api/images/users/12'),
+                15: ('Overtime Master', '/api/images/users/15'),
+            }
+        )
+        self.assertEqual(
+            users[12],
+            {
+                'name': 'Rambo J.',
+                'avatar': 'https://intranet.stxnext.pl:1234'
+                          '/api/images/users/12',
+            }
+        )
+        self.assertNotIn(11, users)
+        self.assertEqual(len(users), 3)
+
+    def test_parse_teams_xml(self):
+        """
+        Test parsing XML file with teams.
+        """
+        teams = parsers.parse_teams_xml(TEST_DATA_TEAMS)
+        self.assertIsInstance(teams, store.TeamStore)
+        self.assertEqual(
+            teams.teams,
+            {
+                1: ('Backend', (10, 11)),
+                2: ('Frontend', (11, 14, 99)),
+                3: ('Empty', ()),
+            }
+        )
+        self.assertEqual(
+            teams[2], {'name': 'Frontend', 'members': [11, 14, 99]}
+        )
+        self.assertNotIn(4, teams)
+        self.assertEqual(len(teams), 3)
+
+
+class PreforkServerTestCase(unittest.TestCase):
+    """
+    Pre-fork server tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up an environment.
+        """
+        main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
+        main.app.config.update({'DATA_XML': TEST_DATA_XML})
+        self.directory = tempfile.mkdtemp()
+        self.log_name = os.path.join(self.directory, 'preload.log')
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        shutil.rmtree(self.directory)
+
+    def preload(self):
+        """
+        Loads data and notes it in the log.
+        """
+        utils.get_data()
+        with open(self.log_name, 'a') as log_file:
+            log_file.write('{}\n'.format(os.getpid()))
+
+    def wait_for(self, condition):
+        """
+        Waits until condition is true.
+        """
+        for _ in xrange(100):
+            if condition():
+                return
+            time.sleep(0.05)
+        self.fail('Timed out')
+
+    def preloads(self):
+        """
+        Returns amount of preload calls.
+        """
+        if not os.path.exists(self.log_name):
+            return 0
+        with open(self.log_name) as log_file:
+            return len(log_file.readlines())
+
+    def test_serve(self):
+        """
+        Test serving from workers and reloading them.
+        """
+        server = prefork.PreforkServer(
+            main.app, '127.0.0.1', 0, 2, preload=self.preload, timeout=0.05
+        )
+        pid = os.fork()
+        if pid == 0:
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)  # pylint: disable=protected-access
+        server.socket.close()
+
+        try:
+            self.wait_for(lambda: self.preloads() == 1)
+            url = 'http://127.0.0.1:{}/api/v1/mean_time_weekday/10'.format(
+                server.address[1]
+            )
+            for _ in xrange(4):
+                self.assertEqual(urllib2.urlopen(url).getcode(), 200)
+
+            os.kill(pid, signal.SIGHUP)
+            self.wait_for(lambda: self.preloads() == 2)
+            self.assertEqual(urllib2.urlopen(url).getcode(), 200)
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+        with open(self.log_name) as log_file:
+            self.assertEqual(
+                log_file.read().split(), [str(pid), str(pid)]
+            )
+
+    def test_changed(self):
+        """
+        Test reloading workers when the master notices changed data.
+        """
+        changes = [False, True]
+        server = prefork.PreforkServer(
+            main.app, '127.0.0.1', 0, 1, preload=self.preload,
+            changed=lambda: changes.pop() if changes else False,
+            interval=0, timeout=0.05,
+        )
+        pid = os.fork()
+        if pid == 0:
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)  # pylint: disable=protected-access
+        server.socket.close()
+
+        try:
+            self.wait_for(lambda: self.preloads() == 2)
+            time.sleep(0.2)
+            self.assertEqual(self.preloads(), 2)
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+
+    def test_initialize(self):
+        """
+        Test initializing every worker when nothing is preloaded.
+        """
+        server = prefork.PreforkServer(
+            main.app, '127.0.0.1', 0, 2, initialize=self.preload,
+            timeout=0.05,
+        )
+        pid = os.fork()
+        if pid == 0:
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)  # pylint: disable=protected-access
+        server.socket.close()
+
+        try:
+            self.wait_for(lambda: self.preloads() == 2)
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+        with open(self.log_name) as log_file:
+            pids = log_file.read().split()
+        self.assertEqual(len(set(pids)), 2)
+        self.assertNotIn(str(pid), pids)
+
+
+class EventLoopServerTestCase(unittest.TestCase):
+    """
+    Event-driven server tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up an environment.
+        """
+        main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
+        main.app.config.update({'DATA_XML': TEST_DATA_XML})
+        self.server = None
+        self.thread = None
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        if self.server is not None:
+            self.server.stop()
+            self.thread.join()
+
+    def serve(self, app, **kwargs):
+        """
+        Starts server of given app in background thread.
+        """
+        self.server = eventloop.EventLoopServer(
+            app, '127.0.0.1', 0, **kwargs
+        )
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.05,)
+        )
+        self.thread.start()
+        return httplib.HTTPConnection(*self.server.address)
+
+    def test_serve(self):
+        """
+        Test serving the same responses as test client on one connection.
+        """
+        connection = self.serve(main.app)
+        client = main.app.test_client()
+        for url in (
+                '/api/v1/users',
+                '/api/v1/mean_time_weekday/10',
+                '/api/v1/mean_time_weekday/0',
+                '/api/v1/presence/export?users=11',
+                '/api/v1/weekdays?users=10,11',
+        ):
+            connection.request('GET', url)
+            resp = connection.getresponse()
+            expected = client.get(url)
+            self.assertEqual(resp.status, expected.status_code)
+            self.assertEqual(resp.read(), expected.data)
+            self.assertEqual(
+                resp.getheader('Content-Type'), expected.content_type
+            )
+
+        connection.request('GET', '/api/v1/users', headers={
+            'If-None-Match': client.get('/api/v1/users').headers['ETag'],
+        })
+        resp = connection.getresponse()
+        self.assertEqual(resp.status, 304)
+        self.assertEqual(resp.read(), '')
+        connection.close()
+
+    def test_coalesce(self):
+        """
+        Test computing response once for the same concurrent requests.
+        """
+        calls = []
+        release = threading.Event()
+
+        def app(environ, start_response):
+            """
+            Answers after release.
+            """
+            calls.append(environ['PATH_INFO'])
+            release.wait()
+            start_response(b'200 OK', [(b'Content-Length', b'2')])
+            return [b'ok']
+
+        connections = [self.serve(app)] + [
+            httplib.HTTPConnection(*self.server.address) for _ in range(2)
+        ]
+        for connection in connections:
+            connection.request('GET', '/slow')
+        other = httplib.HTTPConnection(*self.server.address)
+        other.request('GET', '/other')
+        key = ('GET', '/slow', '', None, None, None)
+
+        def waiting():
+            """
+            Returns amount of connections waiting for /slow.
+            """
+            group = self.server.coalescing.get(key)
+            return len(group.channels) if group else 0
+
+        for _ in xrange(100):
+            if waiting() == 3:
+                break
+            time.sleep(0.01)
+        self.assertEqual(waiting(), 3)
+        release.set()
+        for connection in connections:
+            self.assertEqual(connection.getresponse().read(), 'ok')
+        self.assertEqual(other.getresponse().read(), 'ok')
+        self.assertEqual(sorted(calls), ['/other', '/slow'])
+
+    def test_refresh(self):
+        """
+        Test calling refresh functions in background.
+        """
+        refreshed = threading.Event()
+        self.serve(main.app, refresh=[refreshed.set])
+        self.assertTrue(refreshed.wait(5))
+
+    def connect(self, receive_buffer=None):
+        """
+        Returns raw socket connected to the server.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if receive_buffer is not None:
+            sock.setsockopt(
+                socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer
+            )
+        sock.settimeout(5)
+        sock.connect(self.server.address)
+        return sock
+
+    def test_backpressure(self):
+        """
+        Test pulling response only as fast as the client reads it.
+        """
+        chunk = b'x' * 64 * 1024
+        produced = [0]
+        closed = threading.Event()
+
+        class Response(object):
+            """
+            Large response counting produced bytes.
+            """
+            def __iter__(self):
+                for _ in xrange(512):
+                    produced[0] += len(chunk)
+                    yield chunk
+
+            def close(self):
+                """
+                Notes the response was closed.
+                """
+                closed.set()
+
+        def app(environ, start_response):
+            """
+            Answers with 32 MB response.
+            """
+            # pylint: disable=unused-argument
+            start_response(b'200 OK', [
+                (b'Content-Length', str(512 * len(chunk))),
+            ])
+            return Response()
+
+        self.serve(app)
+        connection = httplib.HTTPConnection(*self.server.address)
+        connection.sock = self.connect(receive_buffer=4096)
+        connection.request('GET', '/')
+        time.sleep(0.5)
+        self.assertLess(produced[0], 8 * 1024 * 1024)
+        self.assertFalse(closed.is_set())
+
+        body = connection.getresponse().read()
+        self.assertEqual(len(body), 512 * len(chunk))
+        self.assertEqual(produced[0], 512 * len(chunk))
+        self.assertTrue(closed.wait(5))
+
+        # response of disconnected client is closed without reading it all
+        produced[0] = 0
+        closed.clear()
+        connection.request('GET', '/')
+        connection.getresponse().read(1024)
+        connection.close()
+        self.assertTrue(closed.wait(5))
+        self.assertLess(produced[0], 512 * len(chunk))
+
+    def test_body_limit(self):
+        """
+        Test refusing too large request bodies.
+        """
+        calls = []
+
+        def app(environ, start_response):
+            """
+            Notes the call.
+            """
+            calls.append(environ['PATH_INFO'])
+            start_response(b'200 OK', [(b'Content-Length', b'0')])
+            return []
+
+        self.serve(app)
+        sock = self.connect()
+        sock.sendall(
+            b'POST /upload HTTP/1.1\r\nHost: test\r\n'
+            b'Content-Length: {}\r\n\r\n'.format(
+                eventloop.MAX_BODY_SIZE + 1
+            )
+        )
+        response = b''
+        while True:
+            data = sock.recv(4096)
+            if not data:
+                break
+            response += data
+        sock.close()
+        self.assertTrue(response.startswith(b'HTTP/1.1 413 '))
+        self.assertEqual(calls, [])
+
+    def test_idle_timeout(self):
+        """
+        Test closing connections idle between requests.
+        """
+        connection = self.serve(main.app, idle_timeout=0.1)
+        connection.request('GET', '/healthz')
+        self.assertEqual(connection.getresponse().read(), 'ok\n')
+        connection.sock.settimeout(5)
+        self.assertEqual(connection.sock.recv(4096), b'')
+        connection.close()
+
+
+class UsersXMLHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Stand-in of intranet serving users XML file.
+    """
+    body = b''
+    etag = b'"1"'
+    requests = []
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Serves the body unless client has its ETag.
+        """
+        self.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header(b'ETag', self.etag)
+        self.send_header(b'Last-Modified', b'Sun, 01 Sep 2013 10:00:00 GMT')
+        self.send_header(b'Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        """
+        Keeps test output clean.
+        """
+        pass
+
+
+class FetcherTestCase(unittest.TestCase):
+    """
+    Users XML fetcher tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up an environment.
+        """
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'users.xml')
+        with open(TEST_DATA_XML, 'rb') as xml_file:
+            UsersXMLHandler.body = xml_file.read()
+        UsersXMLHandler.requests = []
+        self.server = BaseHTTPServer.HTTPServer(
+            ('127.0.0.1', 0), UsersXMLHandler
+        )
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{}/users.xml'.format(
+            self.server.server_address[1]
+        )
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_fetch_users_xml(self):
+        """
+        Test downloading file only when it changed.
+        """
+        self.assertTrue(fetcher.fetch_users_xml(self.url, self.file_name))
+        self.assertEqual(len(parsers.parse_users_xml(self.file_name)), 3)
+        self.assertEqual(os.stat(self.file_name).st_mtime, 1378029600)
+        self.assertEqual(
+            sorted(os.listdir(self.directory)), ['users.xml', 'users.xml.etag']
+        )
+
+        self.assertFalse(fetcher.fetch_users_xml(self.url, self.file_name))
+        self.assertEqual(UsersXMLHandler.requests[1]['if-none-match'], '"1"')
+        self.assertEqual(
+            UsersXMLHandler.requests[1]['if-modified-since'],
+            'Sun, 01 Sep 2013 10:00:00 GMT'
+        )
+
+    def test_fetch_malformed(self):
+        """
+        Test keeping the file when download is malformed.
+        """
+        self.assertTrue(fetcher.fetch_users_xml(self.url, self.file_name))
+        UsersXMLHandler.body = UsersXMLHandler.body[:100]
+        UsersXMLHandler.etag = b'"2"'
+        try:
+            with self.assertRaises(SyntaxError):
+                fetcher.fetch_users_xml(self.url, self.file_name)
+        finally:
+            UsersXMLHandler.etag = b'"1"'
+        self.assertEqual(len(parsers.parse_users_xml(self.file_name)), 3)
+        self.assertEqual(
+            sorted(os.listdir(self.directory)), ['users.xml', 'users.xml.etag']
+        )
+
+    def test_notify_reload(self):
+        """
+        Test asking application to reload.
+        """
+        self.assertFalse(fetcher.notify_reload(self.url))
+        self.assertEqual(UsersXMLHandler.requests, [])
+
+
+class SQLiteStoreTestCase(unittest.TestCase):
+    """
+    SQLite backend tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up an environment.
+        """
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'data.csv')
+        self.database_name = os.path.join(self.directory, 'data.sqlite')
+        shutil.copy(TEST_DATA_CSV, self.file_name)
+        self.loader = database.SQLiteLoader()
+        self.expected = utils.PresenceLoader().load(TEST_DATA_CSV)
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        main.app.config.pop('DATA_BACKEND', None)
+        main.app.config.pop('DATA_SQLITE', None)
+        utils.get_data.cache_clear()
+        shutil.rmtree(self.directory)
+
+    def test_store(self):
+        """
+        Test reading entries like from PresenceStore.
+        """
+        data = self.loader.load(self.file_name, self.database_name)
+        self.assertIsInstance(data, database.SQLiteStore)
+        self.assertEqual(list(data), sorted(self.expected))
+        self.assertNotIn(12, data)
+        with self.assertRaises(KeyError):
+            data[12]  # pylint: disable=pointless-statement
+        for user_id in data:
+            self.assertEqual(dict(data[user_id]), dict(self.expected[user_id]))
+            self.assertEqual(
+                data[user_id].weekdays(), self.expected[user_id].weekdays()
+            )
+        self.assertEqual(len(data[11]), 6)
+        self.assertEqual(len(data[11].between(735110, 735116)), 1)
+        self.assertEqual(
+            len(data[11].between(735116).between(None, 735116)), 1
+        )
+        self.assertEqual(
+            list(data[11].entries(1, 2)),
+            list(self.expected[11].entries(1, 2)),
+        )
+        self.assertEqual(data[11], data[11])
+
+    def test_entries_in_batches(self):
+        """
+        Test reading entries in batches from different threads.
+        """
+        data = self.loader.load(self.file_name, self.database_name)
+        expected = list(self.expected[11].entries())
+        batch = database.ENTRIES_BATCH
+        database.ENTRIES_BATCH = 2
+        try:
+            for skip, count in ((0, None), (1, 4), (1, 3), (5, 10)):
+                entries = data[11].entries(skip, count)
+                result = []
+
+                def advance(entries=entries, result=result):
+                    """
+                    Takes next entry in other thread.
+                    """
+                    result.extend(itertools.islice(entries, 1))
+
+                for _ in range(len(expected) + 1):
+                    thread = threading.Thread(target=advance)
+                    thread.start()
+                    thread.join()
+                end = None if count is None else skip + count
+                self.assertEqual(result, expected[skip:end])
+        finally:
+            database.ENTRIES_BATCH = batch
+
+    def test_aggregates(self):
+        """
+        Test grouping and overtime computed by queries.
+        """
+        data = self.loader.load(self.file_name, self.database_name)
+        self.assertEqual(
+            utils.group_quarters(data), utils.group_quarters(self.expected)
+        )
+        quarter = {'year': 2013, 'numeral': 3}
+        self.assertEqual(
+            utils.overtime_hours_in_quarter(data, quarter),
+            utils.overtime_hours_in_quarter(self.expected, quarter),
+        )
+        self.assertEqual(
+            utils.group_by_weekday(data[10]),
+            utils.group_by_weekday(self.expected[10]),
+        )
+        view = data[11].between(735116)
+        expected = self.expected[11].between(735116)
+        self.assertEqual(
+            utils.group_by_weekday_start_end(view),
+            utils.group_by_weekday_start_end(expected),
+        )
+
+    def test_import(self):
+        """
+        Test importing only appended lines.
+        """
+        data = self.loader.load(self.file_name, self.database_name)
+        self.assertIs(
+            data, self.loader.load(self.file_name, self.database_name)
+        )
+        with open(self.file_name, 'a') as csv_file:
+            csv_file.write('12,2013-09-10,09:00:00,17:00:00\n12,2013-09-1')
+        data = self.loader.load(self.file_name, self.database_name)
+        self.assertEqual(len(data[12]), 1)
+        with open(self.file_name, 'a') as csv_file:
+            csv_file.write('1,10:00:00,18:00:00\n')
+        data = self.loader.load(self.file_name, self.database_name)
+        self.assertEqual(len(data[12]), 2)
+        self.assertEqual(len(data[10]), len(self.expected[10]))
+
+        os.remove(self.file_name)
+        with open(self.file_name, 'w') as csv_file:
+            csv_file.write('13,2013-09-10,09:00:00,17:00:00\n')
+        data = database.SQLiteLoader().load(self.file_name, self.database_name)
+        self.assertEqual(list(data), [13])
+
+    def test_import_by_other_process(self):
+        """
+        Test noticing lines imported by other loader of the same database.
+        """
+        data = self.loader.load(self.file_name, self.database_name)
+        other = database.SQLiteLoader()
+        self.assertEqual(
+            list(other.load(self.file_name, self.database_name)), list(data)
+        )
+        with open(self.file_name, 'a') as csv_file:
+            csv_file.write('12,2013-09-10,09:00:00,17:00:00\n')
+        self.assertIn(12, other.load(self.file_name, self.database_name))
+
+        # lines are imported once, but new store shows them
+        connection = database.connect(self.database_name)
+        self.assertEqual(
+            database.import_csv(connection, self.file_name),
+            (os.stat(self.file_name).st_ino, os.path.getsize(self.file_name))
+        )
+        new_data = self.loader.load(self.file_name, self.database_name)
+        self.assertIsNot(new_data, data)
+        self.assertIn(12, new_data)
+
+    def test_concurrent_import(self):
+        """
+        Test importing by processes waiting for each other's lock.
+        """
+        connection = database.connect(self.database_name)
+        self.assertEqual(
+            connection.execute('PRAGMA busy_timeout').fetchone(),
+            (database.BUSY_TIMEOUT * 1000,)
+        )
+        # processes are forked before the lock is taken, as SQLite doesn't
+        # support forking with locks held, and start importing while lock
+        # is held as if by long import of other process
+        pids = []
+        ready, start = os.pipe()
+        for _ in range(2):
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    os.read(ready, 1)
+                    data = database.SQLiteLoader().load(
+                        self.file_name, self.database_name
+                    )
+                    if list(data) == sorted(self.expected):
+                        status = 0
+                finally:
+                    os._exit(status)  # pylint: disable=protected-access
+            pids.append(pid)
+        os.close(ready)
+        blocker = sqlite3.connect(self.database_name, isolation_level=None)
+        try:
+            blocker.execute('BEGIN IMMEDIATE')
+            os.write(start, b'xx')
+            time.sleep(0.5)
+            blocker.execute('COMMIT')
+        finally:
+            os.close(start)
+            blocker.close()
+        for pid in pids:
+            _, status = os.waitpid(pid, 0)
+            self.assertEqual(status, 0)
+        data = self.loader.load(self.file_name, self.database_name)
+        self.assertEqual(len(data[11]), 6)
+
+    def test_import_rollback(self):
+        """
+        Test keeping old entries when import from the beginning fails.
+        """
+        self.loader.load(self.file_name, self.database_name)
+        os.remove(self.file_name)
+        with open(self.file_name, 'w') as csv_file:
+            csv_file.write('13,2013-09-10,09:00:00,17:00:00\n')
+        connection = database.connect(self.database_name)
+        connection.execute('DROP TABLE meta')
+        connection.execute(
+            "CREATE TABLE meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL "
+            "CHECK (key != 'lines'))"
+        )
+        connection.execute("INSERT INTO meta VALUES ('inode', 0)")
+        connection.commit()
+        with self.assertRaises(sqlite3.IntegrityError):
+            database.import_csv(connection, self.file_name)
+        self.assertEqual(
+            connection.execute(
+                'SELECT COUNT(DISTINCT user_id) FROM presence'
+            ).fetchone(),
+            (len(self.expected),)
+        )
+
+    def test_views(self):
+        """
+        Test serving views from database.
+        """
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML,
+            'DATA_SQLITE': self.database_name,
+        })
+        client = main.app.test_client()
+        urls = (
+            '/api/v1/mean_time_weekday/10',
+            '/api/v1/presence_start_end/11?from=2013-09-05',
+            '/api/v1/overtime_in_quarter/0',
+            '/api/v1/presence/export?format=csv',
+        )
+        utils.get_data.cache_clear()
+        expected = [client.get(url).data for url in urls]
+        main.app.config['DATA_BACKEND'] = 'sqlite'
+        utils.get_data.cache_clear()
+        self.assertIsInstance(utils.get_data(), database.SQLiteStore)
+        self.assertEqual([client.get(url).data for url in urls], expected)
+
+        resp = client.get(
+            '/api/v1/presence/export?format=csv',
+            headers={'Range': 'entries=2-3'},
+        )
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp.data.splitlines(), expected[3].splitlines()[3:5])
+
+
+class FileWatcherTestCase(unittest.TestCase):
+    """
+    Changed files detection tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up an environment.
+        """
+        self.directory = tempfile.mkdtemp()
+        self.csv_name = os.path.join(self.directory, 'data.csv')
+        self.xml_name = os.path.join(self.directory, 'users.xml')
+        shutil.copy(TEST_DATA_CSV, self.csv_name)
+        shutil.copy(TEST_DATA_XML, self.xml_name)
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML,
+        })
+        main.app.config.pop('DATA_INVALIDATION', None)
+        utils.FROZEN.clear()
+        utils.get_data.cache_clear()
+        utils.get_data_xml.cache_clear()
+        utils.get_teams.cache_clear()
+        shutil.rmtree(self.directory)
+
+    def replace(self, file_name, text):
+        """
+        Replaces content of file by renaming new one over it.
+        """
+        with open(file_name + '.new', 'w') as new_file:
+            new_file.write(text)
+        os.rename(file_name + '.new', file_name)
+
+    def wait_changed(self, file_watcher, file_name):
+        """
+        Returns True once watcher notices change of file within a second.
+        """
+        for _ in xrange(100):
+            if file_watcher.changed(file_name):
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_stat(self):
+        """
+        Test comparing inode, size and modification time.
+        """
+        file_watcher = watcher.FileWatcher(use_inotify=False)
+        self.assertTrue(file_watcher.changed(self.csv_name))
+        self.assertFalse(file_watcher.changed(self.csv_name))
+        with open(self.csv_name, 'a') as csv_file:
+            csv_file.write('10,2013-09-13,09:00:00,17:00:00\n')
+        self.assertTrue(file_watcher.changed(self.csv_name))
+        self.assertFalse(file_watcher.changed(self.csv_name))
+        os.remove(self.csv_name)
+        self.assertTrue(file_watcher.changed(self.csv_name))
+        self.assertIsNone(watcher.file_signature(self.csv_name))
+
+    def test_inotify(self):
+        """
+        Test noticing changes reported by inotify.
+        """
+        try:
+            watcher.Inotify()
+        except OSError:
+            self.skipTest('inotify is not available')
+        file_watcher = watcher.FileWatcher()
+        self.assertTrue(file_watcher.changed(self.xml_name))
+        self.assertFalse(file_watcher.changed(self.xml_name))
+        self.assertIsNotNone(file_watcher.inotify)
+
+        self.replace(self.xml_name, 'replaced')
+        self.assertTrue(self.wait_changed(file_watcher, self.xml_name))
+        self.assertFalse(file_watcher.changed(self.xml_name))
+
+        # other files in the directory don't cause stat of watched one
+        self.assertTrue(file_watcher.changed(self.csv_name))
+        self.replace(os.path.join(self.directory, 'other'), 'other')
+        self.assertFalse(self.wait_changed(file_watcher, self.xml_name))
+        self.assertNotIn(
+            watcher.encode_path(os.path.join(self.directory, 'other')),
+            file_watcher.inotify.events
+        )
+
+    def test_watched(self):
+        """
+        Test reloading data files as soon as they changed.
+        """
+        main.app.config.update({
+            'DATA_CSV': self.csv_name,
+            'DATA_XML': self.xml_name,
+            'DATA_INVALIDATION': 'watch',
+        })
+        utils.get_data.cache_clear()
+        utils.get_data_xml.cache_clear()
+        data, users = utils.get_data(), utils.get_data_xml()
+        self.assertIs(data, utils.get_data())
+        self.assertIs(users, utils.get_data_xml())
+
+        with open(self.xml_name) as xml_file:
+            text = xml_file.read()
+        self.replace(self.xml_name, text.replace('John Doe', 'Jane Doe'))
+        for _ in xrange(100):
+            if utils.get_data_xml() is not users:
+                break
+            time.sleep(0.01)
+        self.assertEqual(utils.get_data_xml()[10]['name'], 'Jane Doe')
+        self.assertIs(data, utils.get_data())
+
+        # new data is loaded in background, old one is returned meanwhile
+        misses = utils.get_data.cache_info()['misses']
+        with open(self.csv_name, 'a') as csv_file:
+            csv_file.write('12,2013-09-13,09:00:00,17:00:00\n')
+        for _ in xrange(100):
+            if 12 in utils.get_data():
+                break
+            time.sleep(0.01)
+        self.assertIn(12, utils.get_data())
+        self.assertEqual(utils.get_data.cache_info()['misses'], misses)
+        self.assertGreaterEqual(utils.get_data.cache_info()['refreshes'], 1)
+
+    def test_frozen(self):
+        """
+        Test keeping frozen data and noticing changes by the master.
+        """
+        main.app.config.update({
+            'DATA_CSV': self.csv_name,
+            'DATA_XML': self.xml_name,
+            'DATA_INVALIDATION': 'watch',
+        })
+        file_watcher = watcher.FileWatcher()
+        self.assertTrue(utils.data_changed(file_watcher))
+        self.assertFalse(utils.data_changed(file_watcher))
+
+        utils.get_data.cache_clear()
+        data = utils.get_data()
+        utils.freeze_data()
+        with open(self.csv_name, 'a') as csv_file:
+            csv_file.write('12,2013-09-13,09:00:00,17:00:00\n')
+        self.assertTrue(self.wait_changed(file_watcher, self.csv_name))
+        utils.get_data.cache_expire()
+        for _ in xrange(10):
+            self.assertIs(utils.get_data(), data)
+            time.sleep(0.01)
+        self.assertEqual(utils.get_data.cache_info()['refreshes'], 0)
+
+        # data is loaded again only when reloaded explicitly
+        self.assertIn(12, utils.reload_data()[0])
+
+    def test_users_loader(self):
+        """
+        Test parsing users XML only when it changed.
+        """
+        loader = utils.XMLLoader(parsers.parse_users_xml, 'xml')
+        users = loader.load(self.xml_name)
+        self.assertIs(users, loader.load(self.xml_name))
+        self.replace(self.xml_name, open(TEST_DATA_XML).read())
+        self.assertIsNot(users, loader.load(self.xml_name))
+
+
 def suite():
     """
     Default test suite.
@@ -472,6 +2879,16 @@ def suite():
     base_suite = unittest.TestSuite()
     base_suite.addTest(unittest.makeSuite(PresenceAnalyzerViewsTestCase))
     base_suite.addTest(unittest.makeSuite(PresenceAnalyzerUtilsTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceStoreTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceLoaderTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceSnapshotTestCase))
+    base_suite.addTest(unittest.makeSuite(SQLiteStoreTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerParsersTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerMetricsTestCase))
+    base_suite.addTest(unittest.makeSuite(PreforkServerTestCase))
+    base_suite.addTest(unittest.makeSuite(EventLoopServerTestCase))
+    base_suite.addTest(unittest.makeSuite(FetcherTestCase))
+    base_suite.addTest(unittest.makeSuite(FileWatcherTestCase))
     return base_suite
 
 
@@ -3,21 +3,61 @@
 Helper functions used in views.
 """
 
-import csv
+import calendar
+import multiprocessing
+import os
 import threading
+import unicodedata
+from bisect import bisect_left
+from collections import OrderedDict
 from json import dumps
 from functools import wraps
+from hashlib import sha1
 from datetime import date, datetime, timedelta
+from timeit import default_timer
 
-from xml.etree import ElementTree
-
-from flask import Response
+from flask import Response, request
 
+from presence_analyzer.database import (
+    SQLiteLoader,
+    SQLiteStore,
+    SQLiteUserPresence,
+)
 from presence_analyzer.main import app
+from presence_analyzer.metrics import LOAD_LATENCY, ROWS, Collector
+from presence_analyzer.parsers import (
+    parse_csv,
+    parse_csv_chunk,
+    parse_teams_xml,
+    parse_users_xml,
+    split_csv,
+)
+from presence_analyzer.snapshot import csv_digest, read_snapshot
+from presence_analyzer.store import (
+    AGGREGATES,
+    AppendedStore,
+    AppendedUserPresence,
+    PresenceStore,
+    TeamStore,
+    UserPresence,
+    weekday,
+)
+from presence_analyzer.watcher import FileWatcher, file_signature
 
 import logging
 log = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
+# order of letters in polish collation, other letters are compared by
+# their base letter and then by code point
+ALPHABET = u'0123456789aąbcćdeęfghijklłmnńoópqrsśtuvwxyzźż'
+WEIGHTS = {letter: weight for weight, letter in enumerate(ALPHABET)}
+
+# set once data is loaded and indexed, see warm_up()
+READY = threading.Event()
+
+# duration of the last warm-up in seconds
+WARMUP = {'seconds': None}
+
 
 def jsonify(func):
     """
@@ -35,42 +75,482 @@ def jsonify(func):
     return inner
 
 
-def cache(time):
+def json_response(*sources):
+    """
+    Creates a conditional response with the JSON representation of wrapped
+    function result, which depends only on data returned by sources.
+
+    Encoded body is cached for every version of the data, arguments
+    and query parameters.
+    Strong ETag is derived from the body and Last-Modified from the data,
+    so If-None-Match and If-Modified-Since requests get 304 responses.
+    """
+    def decorator(func):
+        @cache(600, maxsize=1024, name='{}.{}'.format(
+            func.__module__, func.__name__
+        ))
+        def encode(versions, query, *args, **kwargs):
+            """
+            Returns JSON representation of func result and its hash.
+            Versions and query are not used, they are just a part
+            of cache key.
+            """
+            # pylint: disable=unused-argument
+            body = dumps(func(*args, **kwargs))
+            return body, sha1(body).hexdigest()
+
+        @wraps(func)
+        def inner(*args, **kwargs):
+            """
+            This docstring will be overridden by @wraps decorator.
+            """
+            snapshots = [source() for source in sources]
+            body, etag = encode(
+                tuple(snapshot.version for snapshot in snapshots),
+                tuple(sorted(request.args.iteritems(multi=True))),
+                *args, **kwargs
+            )
+            response = Response(body, mimetype='application/json')
+            response.set_etag(etag)
+            if snapshots:
+                response.last_modified = datetime.utcfromtimestamp(int(max(
+                    snapshot.modified for snapshot in snapshots
+                )))
+            return response.make_conditional(request)
+        return inner
+    return decorator
+
+
+# wrapped functions by qualified name, for metrics
+CACHES = {}
+
+
+def cache(time, maxsize=128, stale=False, name=None):
     """
     Stores function output data for given time in seconds.
+
+    Results are kept separately for every combination of arguments, which
+    have to be hashable, otherwise the function is simply called. When
+    there are more than maxsize results, the least recently used one is
+    dropped. Concurrent calls with the same arguments wait for a single
+    computation, calls with different arguments don't block each other.
+
+    With stale=True expired result is still returned, while one background
+    thread computes the new one and replaces it when done.
+
+    Wrapped function gets cache_clear(), cache_invalidate(), cache_expire(),
+    cache_freeze(), cache_info() and cache_age() attributes. It is
+    registered for metrics under given name, qualified name of the function
+    by default.
     """
-    cache.data = {}
-    lock = threading.Lock()
+    ttl = timedelta(seconds=time)
 
     def decorator(func):
+        data = OrderedDict()
+        locks = {}
+        refreshing = set()
+        stats = dict.fromkeys(
+            ('hits', 'misses', 'stale', 'refreshes', 'failures'), 0
+        )
+        options = {'frozen': False}
+        lock = threading.Lock()
+
+        def lookup(key):
+            """
+            Returns cache entry for given key or None.
+            Has to be called with lock held.
+            """
+            entry = data.pop(key, None)
+            if entry is not None:
+                data[key] = entry  # mark as recently used
+            return entry
+
+        def is_fresh(entry):
+            """
+            Checks if cache entry has not expired.
+            """
+            if options['frozen']:
+                return True
+            return not entry.get('expired') and \
+                datetime.now() - entry['time'] < ttl
+
+        def save(key, result):
+            """
+            Stores result for given key. Has to be called with lock held.
+            """
+            data.pop(key, None)
+            data[key] = {
+                'data': result,
+                'time': datetime.now(),
+            }
+            while len(data) > maxsize:
+                data.popitem(last=False)
+
+        def refresh(key, args, kwargs):
+            """
+            Computes new result in background.
+            """
+            try:
+                result = func(*args, **kwargs)
+            except Exception:  # pylint: disable=broad-except
+                log.exception('Refreshing %s failed', func.__name__)
+                with lock:
+                    stats['failures'] += 1
+            else:
+                with lock:
+                    save(key, result)
+                    stats['refreshes'] += 1
+            finally:
+                with lock:
+                    refreshing.discard(key)
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             """
             This docstring will be overridden by @wraps decorator.
             """
-            now = datetime.now()
-            name = func.__name__
+            key = (args, tuple(sorted(kwargs.items())))
+            try:
+                hash(key)
+            except TypeError:
+                return func(*args, **kwargs)
+
             with lock:
-                if name in cache.data and \
-                   now - cache.data[name]['time'] < timedelta(seconds=time):
-                    result = cache.data[name]['data']
-                else:
+                entry = lookup(key)
+                if entry is not None and is_fresh(entry):
+                    stats['hits'] += 1
+                    return entry['data']
+                if entry is not None and stale:
+                    stats['stale'] += 1
+                    if key not in refreshing:
+                        refreshing.add(key)
+                        thread = threading.Thread(
+                            target=refresh,
+                            args=(key, args, kwargs),
+                        )
+                        thread.daemon = True
+                        thread.start()
+                    return entry['data']
+                key_lock = locks.setdefault(key, threading.Lock())
+
+            with key_lock:
+                with lock:
+                    # other thread could compute it in the meantime
+                    entry = lookup(key)
+                    if entry is not None and is_fresh(entry):
+                        stats['hits'] += 1
+                        return entry['data']
+                    stats['misses'] += 1
+
+                try:
                     result = func(*args, **kwargs)
-                    cache.data[name] = {
-                        'data': result,
-                        'time': now,
-                    }
+                    with lock:
+                        save(key, result)
+                finally:
+                    with lock:
+                        locks.pop(key, None)
             return result
+
+        def cache_clear():
+            """
+            Removes all stored results, resets statistics and lets results
+            expire again.
+            """
+            with lock:
+                data.clear()
+                stats.update(dict.fromkeys(stats, 0))
+                options['frozen'] = False
+
+        def cache_invalidate():
+            """
+            Removes all stored results, statistics are kept, as they are
+            exported as counters which must not go backwards.
+            """
+            with lock:
+                data.clear()
+
+        def cache_expire():
+            """
+            Marks all stored results as expired, so they are computed again
+            on next call, in background with stale=True while the expired
+            ones are still returned.
+            """
+            with lock:
+                for key, entry in data.items():
+                    data[key] = dict(entry, expired=True)
+
+        def cache_freeze():
+            """
+            Keeps stored results from expiring, they are computed again
+            only when invalidated.
+            """
+            with lock:
+                options['frozen'] = True
+
+        def cache_info():
+            """
+            Returns amount of hits, misses, stale hits, background refreshes
+            and failed ones and stored results.
+            """
+            with lock:
+                return dict(stats, size=len(data), maxsize=maxsize)
+
+        def cache_age(*args, **kwargs):
+            """
+            Returns age in seconds of result stored for given arguments
+            or None.
+            """
+            key = (args, tuple(sorted(kwargs.items())))
+            with lock:
+                entry = data.get(key)
+            if entry is None:
+                return None
+            return (datetime.now() - entry['time']).total_seconds()
+
+        wrapper.cache_clear = cache_clear
+        wrapper.cache_invalidate = cache_invalidate
+        wrapper.cache_expire = cache_expire
+        wrapper.cache_freeze = cache_freeze
+        wrapper.cache_info = cache_info
+        wrapper.cache_age = cache_age
+        CACHES[name or '{}.{}'.format(func.__module__, func.__name__)] = \
+            wrapper
         return wrapper
     return decorator
 
 
-@cache(600)
+def config_file(config_key):
+    """
+    Returns name of data file given by config key. Teams file, unless
+    configured, is looked for next to users XML file.
+    """
+    if config_key == 'DATA_TEAMS' and not app.config.get('DATA_TEAMS'):
+        return os.path.join(
+            os.path.dirname(app.config['DATA_XML']), 'teams.xml'
+        )
+    return app.config[config_key]
+
+
+def watched(config_key):
+    """
+    Expires cache of wrapped function without arguments, when the file named
+    by given config key changed, so it's loaded again on access instead of
+    after its cache expires. Functions cached with stale=True keep returning
+    the old result until the new one is loaded in background.
+
+    It's enabled by DATA_INVALIDATION set to 'watch'. Frozen data, like in
+    pre-forked workers, is not checked.
+    """
+    def decorator(func):
+        """
+        Checks the file before calling func.
+        """
+        @wraps(func)
+        def wrapper():
+            """
+            This docstring will be overridden by @wraps decorator.
+            """
+            if app.config.get('DATA_INVALIDATION') == 'watch' and \
+               not FROZEN.is_set():
+                file_name = config_file(config_key)
+                if file_watcher.changed(file_name):
+                    log.debug('%s changed', file_name)
+                    func.cache_expire()
+            return func()
+        return wrapper
+    return decorator
+
+
+# smallest part of CSV file parsed by one worker process
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class PresenceLoader(object):
+    """
+    Loads presence data from CSV file which is appended to over time.
+
+    It remembers the position, inode and modification time of the file
+    read last time, so on refresh only newly appended lines are parsed.
+    Truncated or replaced file is read again from the beginning, or from
+    the position its binary snapshot was compiled up to.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.file_name = None
+        self.inode = None
+        self.size = None
+        self.mtime = None
+        self.offset = 0
+        self.lines = 0
+        self.data = PresenceStore.from_rows([])
+
+    def _read_lines(self, csvfile):
+        """
+        Yields lines from current position and moves it past complete ones.
+
+        Last line without line break may be still being written, so it is
+        read again next time.
+        """
+        for line in csvfile:
+            yield line
+            if line.endswith('\n'):
+                self.offset += len(line)
+                self.lines += 1
+
+    def _read_snapshot(self, file_name, snapshot_name, stat):
+        """
+        Starts from snapshot of CSV file with given stat, if it's valid.
+
+        Unless the file is unchanged since the snapshot was compiled, the
+        last block of its bytes covered by the snapshot is compared by
+        digest, so the file rewritten in place is not mistaken for appended
+        to. Entries of lines appended since then are kept apart from the
+        snapshot, see AppendedStore, so its mapped pages stay shared.
+        """
+        snapshot = read_snapshot(snapshot_name)
+        if snapshot is None:
+            return
+        data, inode, offset, lines, mtime, digest = snapshot
+        if inode != stat.st_ino or offset > stat.st_size or \
+           (stat.st_mtime, stat.st_size) != (mtime, offset) and \
+           csv_digest(file_name, offset) != digest:
+            log.info('Snapshot %s is outdated', snapshot_name)
+            return
+        self.data = data
+        self.offset = offset
+        self.lines = lines
+
+    def _parse_parallel(self, file_name, end, chunks):
+        """
+        Parses lines up to given position in chunks by worker processes
+        and merges their results in order.
+        """
+        with open(file_name, 'rb') as csvfile:
+            bounds = split_csv(csvfile, self.offset, end, chunks)
+        pool = multiprocessing.Pool(len(bounds))
+        try:
+            results = pool.map(
+                parse_csv_chunk, [(file_name,) + bound for bound in bounds]
+            )
+        finally:
+            pool.terminate()
+            pool.join()
+
+        stores = []
+        for columns, offsets, aggregates, errors, parsed, size, lines in \
+                results:
+            for i, message in errors:
+                log.debug('Problem with line %d: %s', self.lines + i, message)
+            ROWS.inc(parsed, ('parsed',))
+            ROWS.inc(len(errors), ('rejected',))
+            if offsets:
+                stores.append(PresenceStore(
+                    *columns, aggregates=aggregates, offsets=offsets
+                ))
+            self.offset += size
+            self.lines += lines
+        if len(stores) == 1:
+            self.data = self.data.append(stores[0])
+        elif stores:
+            self.data = self.data.append(PresenceStore.combine(stores))
+
+    def load(self, file_name, snapshot_name=None, workers=0):
+        """
+        Returns presence data from given CSV file, using its binary
+        snapshot when given.
+
+        With more than one worker, large amount of new lines is parsed
+        by a pool of that many processes.
+        """
+        with self.lock:
+            stat = os.stat(file_name)
+            if (file_name, stat.st_ino) != (self.file_name, self.inode) or \
+               stat.st_size < self.offset:
+                log.debug('Reading %s from the beginning', file_name)
+                self.file_name = file_name
+                self.inode = stat.st_ino
+                self.offset = self.lines = 0
+                self.data = PresenceStore.from_rows([])
+                if snapshot_name is not None:
+                    with LOAD_LATENCY.time(('snapshot',)):
+                        self._read_snapshot(file_name, snapshot_name, stat)
+            elif (stat.st_size, stat.st_mtime) == (self.size, self.mtime):
+                return self.data
+
+            chunks = min(workers, (stat.st_size - self.offset) // CHUNK_SIZE)
+            with LOAD_LATENCY.time(('csv',)):
+                if chunks > 1:
+                    self._parse_parallel(file_name, stat.st_size, chunks)
+                else:
+                    with open(file_name, 'rb') as csvfile:
+                        csvfile.seek(self.offset)
+                        rows = parse_csv(
+                            self._read_lines(csvfile), self.lines
+                        )
+                        self.data = self.data.merge(rows)
+            self.size = stat.st_size
+            self.mtime = stat.st_mtime
+            return self.data
+
+
+class XMLLoader(object):
+    """
+    Loads XML file with given parser, which is called again only when
+    inode, size or modification time of the file changed.
+    """
+
+    def __init__(self, parse, source):
+        """
+        Takes parser function and source label of load time metric.
+        """
+        self.parse = parse
+        self.source = source
+        self.lock = threading.Lock()
+        self.file_name = None
+        self.signature = None
+        self.data = None
+
+    def load(self, file_name):
+        """
+        Returns result of parsing given XML file.
+        """
+        with self.lock:
+            signature = file_signature(file_name)
+            if self.data is not None and signature is not None and \
+               (file_name, signature) == (self.file_name, self.signature):
+                return self.data
+            with LOAD_LATENCY.time((self.source,)):
+                self.data = self.parse(file_name)
+            self.file_name = file_name
+            self.signature = signature
+            return self.data
+
+
+presence_loader = PresenceLoader()  # pylint: disable=invalid-name
+sqlite_loader = SQLiteLoader()  # pylint: disable=invalid-name
+users_loader = XMLLoader(  # pylint: disable=invalid-name
+    parse_users_xml, 'xml'
+)
+teams_loader = XMLLoader(  # pylint: disable=invalid-name
+    parse_teams_xml, 'teams'
+)
+file_watcher = FileWatcher()  # pylint: disable=invalid-name
+
+# set when data is kept as it is, see freeze_data()
+FROZEN = threading.Event()
+
+# version of presence data returned last time, see get_data()
+LOADED = {'version': None}
+
+
+@watched('DATA_CSV')
+@cache(10, stale=True)
 def get_data():
     """
     Extracts presence data from CSV file and groups it by user_id.
 
-    It creates structure like this:
+    It creates read-only PresenceStore which can be used like this:
     data = {
         'user_id': {
             datetime.date(2013, 10, 1): {
@@ -83,56 +563,229 @@ def get_data():
             },
         }
     }
-    """
-    data = {}
-    with open(app.config['DATA_CSV'], 'r') as csvfile:
-        presence_reader = csv.reader(csvfile, delimiter=',')
-        for i, row in enumerate(presence_reader):
-            if len(row) != 4:
-                # ignore header and footer lines
-                continue
 
-            try:
-                user_id = int(row[0])
-                date = datetime.strptime(row[1], '%Y-%m-%d').date()
-                start = datetime.strptime(row[2], '%H:%M:%S').time()
-                end = datetime.strptime(row[3], '%H:%M:%S').time()
-                data.setdefault(user_id, {})[date] = {
-                    'start': start,
-                    'end': end,
-                }
-            except (ValueError, TypeError):
-                log.debug('Problem with line %d: ', i, exc_info=True)
+    With DATA_BACKEND set to 'sqlite' entries are imported into DATA_SQLITE
+    database and read by queries from SQLiteStore instead.
 
+    Results cached for the previous store or views on it are dropped,
+    as they would keep whole store in memory.
+    """
+    if app.config.get('DATA_BACKEND') == 'sqlite':
+        data = sqlite_loader.load(
+            app.config['DATA_CSV'], app.config['DATA_SQLITE']
+        )
+    else:
+        data = presence_loader.load(
+            app.config['DATA_CSV'],
+            app.config.get('DATA_SNAPSHOT'),
+            app.config.get('DATA_CSV_WORKERS', 0),
+        )
+    if data.version != LOADED['version']:
+        LOADED['version'] = data.version
+        for func in (group_by_weekday, group_by_weekday_start_end,
+                     group_quarters, overtime_hours_in_quarters,
+                     team_statistics):
+            func.cache_invalidate()
     return data
 
 
-@cache(600)
+@watched('DATA_XML')
+@cache(600, stale=True)
 def get_data_xml():
     """
     Extracts users data from XML file and groups it by user_id.
     """
-    data = ElementTree.parse(app.config['DATA_XML'])
-    server = data.find('server')
-    link = '{}://{}:{}'.format(
-        server.find('protocol').text,
-        server.find('host').text,
-        server.find('port').text,
+    return users_loader.load(app.config['DATA_XML'])
+
+
+@watched('DATA_TEAMS')
+@cache(600, stale=True)
+def get_teams():
+    """
+    Extracts teams and their members from XML file, DATA_TEAMS or
+    teams.xml next to users XML file. Without the file there are no teams.
+    """
+    file_name = config_file('DATA_TEAMS')
+    if not os.path.exists(file_name):
+        return TeamStore({})
+    return teams_loader.load(file_name)
+
+
+def reload_data():
+    """
+    Loads presence data, users and teams again without waiting for their
+    cache to expire and returns presence data and users.
+    """
+    for func in (get_data, get_data_xml, get_teams):
+        func.cache_invalidate()
+    return get_data(), get_data_xml()
+
+
+def freeze_data():
+    """
+    Keeps loaded data files as they are, without reloading them when they
+    change or their cache expires, until reload_data() is called.
+
+    Pre-forked workers keep the data they were forked with, so its pages
+    stay shared and all workers serve the same version. The master checks
+    data files with data_changed() and replaces workers instead.
+    """
+    FROZEN.set()
+    for func in (get_data, get_data_xml, get_teams):
+        func.cache_freeze()
+
+
+def data_changed(watcher):
+    """
+    Checks if any of data files changed since the last check by given
+    FileWatcher. The first check tells they changed.
+    """
+    changed = False
+    for config_key in ('DATA_CSV', 'DATA_XML', 'DATA_TEAMS'):
+        if watcher.changed(config_file(config_key)):
+            changed = True
+    return changed
+
+
+def warm_up():
+    """
+    Loads data files and computes indexes derived from them, so the first
+    requests don't pay for it, and marks the application as ready.
+    Until it succeeds once, failed warm-up is retried in background
+    after WARMUP_RETRY seconds.
+
+    Returns time it took in seconds, or None when loading failed.
+    """
+    started = default_timer()
+    try:
+        data, users = reload_data()
+        if isinstance(data, (PresenceStore, AppendedStore)):
+            for store, _ in data.segments():
+                store.interval_sums()
+        overtime_hours_in_quarters(data)
+        team_statistics(data, get_teams())
+    except Exception:  # pylint: disable=broad-except
+        log.exception('Warm-up failed')
+        if not READY.is_set():
+            retry = threading.Timer(
+                app.config.get('WARMUP_RETRY', 10), warm_up
+            )
+            retry.daemon = True
+            retry.start()
+        return None
+    elapsed = WARMUP['seconds'] = default_timer() - started
+    READY.set()
+    log.info(
+        'Warmed up in %.3fs, %d users with presence, %d users',
+        elapsed, len(data), len(users),
     )
-    users = {}
-    for user in data.find('users'):
-        users[int(user.get('id'))] = {
-            'name': user.find('name').text,
-            'avatar': '{}{}'.format(link, user.find('avatar').text),
+    return elapsed
+
+
+def collation_key(text):
+    """
+    Returns key sorting texts like polish locale collation, which ignores
+    case, spaces and punctuation unless texts are equal without them.
+
+    It doesn't depend on process-wide locale.setlocale(), so it's safe to
+    use from many threads.
+    """
+    text = unicode(text or '')
+    weights = []
+    for letter in text.lower():
+        weight = WEIGHTS.get(letter)
+        if weight is None:
+            base = unicodedata.normalize('NFD', letter)[0]
+            weight = WEIGHTS.get(base, len(WEIGHTS) + ord(letter))
+            if not base.isalnum():
+                weight = None
+        weights.append(weight)
+    return (
+        [weight for weight in weights if weight is not None],
+        [ord(letter) for letter in text.lower()],
+        text,
+    )
+
+
+@cache(600, maxsize=4)
+def sorted_users(users):
+    """
+    Returns users listing sorted by name.
+    """
+    return sorted([
+        {
+            'user_id': i,
+            'name': user.get('name'),
+            'avatar': user.get('avatar'),
         }
-    return users
+        for i, user in users.items()
+    ], key=lambda x: collation_key(x.get('name')))
 
 
+def mean_time_weekday(weekdays):
+    """
+    Returns mean presence time for every weekday from weekday sums.
+    """
+    return [
+        (calendar.day_abbr[weekday], mean_of_sum(total, count))
+        for weekday, (count, total, _, _) in enumerate(weekdays)
+    ]
+
+
+def presence_weekday(weekdays):
+    """
+    Returns total presence time for every weekday from weekday sums.
+    """
+    result = [
+        (calendar.day_abbr[weekday], total)
+        for weekday, (_, total, _, _) in enumerate(weekdays)
+    ]
+    result.insert(0, ('Weekday', 'Presence (s)'))
+    return result
+
+
+def presence_start_end(weekdays):
+    """
+    Returns mean start time and mean end time for every weekday
+    from weekday sums.
+    """
+    return [
+        (
+            calendar.day_abbr[weekday],
+            mean_of_sum(starts, count),
+            mean_of_sum(ends, count),
+        )
+        for weekday, (count, _, starts, ends) in enumerate(weekdays)
+    ]
+
+
+WEEKDAY_STATISTICS = OrderedDict([
+    ('mean_time_weekday', mean_time_weekday),
+    ('presence_weekday', presence_weekday),
+    ('presence_start_end', presence_start_end),
+])
+
+
+@cache(600, maxsize=1024)
 def group_by_weekday(items):
     """
     Groups presence entries by weekday.
+
+    Views on store, also narrowed to range of dates, are read straight
+    from its columns.
     """
     result = [[] for _ in range(7)]  # one list for every day in week
+    if isinstance(items, UserPresence):
+        days, starts, ends = items.store.days, items.store.starts, \
+            items.store.ends
+        for i in xrange(items.begin, items.end):
+            result[weekday(days[i])].append(ends[i] - starts[i])
+        return result
+    if isinstance(items, (SQLiteUserPresence, AppendedUserPresence)):
+        for day, start, end in items.entries():
+            result[weekday(day)].append(end - start)
+        return result
+
     for date in items:
         start = items[date]['start']
         end = items[date]['end']
@@ -143,13 +796,17 @@ def group_by_weekday(items):
 def seconds_since_midnight(time):
     """
     Calculates amount of seconds since midnight.
+    Integers are already seconds since midnight and are returned as they are.
     """
+    if isinstance(time, (int, long)):
+        return time
     return time.hour * 3600 + time.minute * 60 + time.second
 
 
 def interval(start, end):
     """
-    Calculates interval in seconds between two datetime.time objects.
+    Calculates interval in seconds between two datetime.time objects
+    or amounts of seconds since midnight.
     """
     return seconds_since_midnight(end) - seconds_since_midnight(start)
 
@@ -161,6 +818,15 @@ def mean(items):
     return float(sum(items)) / len(items) if len(items) > 0 else 0
 
 
+def mean_of_sum(total, count):
+    """
+    Calculates arithmetic mean from sum and amount of items.
+    Returns zero when there are no items.
+    """
+    return float(total) / count if count > 0 else 0
+
+
+@cache(600, maxsize=1024)
 def group_by_weekday_start_end(items):
     """
     Groups start time and end time by weekday.
@@ -176,8 +842,26 @@ def group_by_weekday_start_end(items):
             'end': [61740, 71032, 70742],
         }
     ]
+
+    Views on store, also narrowed to range of dates, are read straight
+    from its columns.
     """
     result = [{} for _ in range(7)]  # one dict for every day in week
+    if isinstance(items, UserPresence):
+        days, starts, ends = items.store.days, items.store.starts, \
+            items.store.ends
+        for i in xrange(items.begin, items.end):
+            group = result[weekday(days[i])]
+            group.setdefault('start', []).append(starts[i])
+            group.setdefault('end', []).append(ends[i])
+        return result
+    if isinstance(items, (SQLiteUserPresence, AppendedUserPresence)):
+        for day, start, end in items.entries():
+            group = result[weekday(day)]
+            group.setdefault('start', []).append(start)
+            group.setdefault('end', []).append(end)
+        return result
+
     for date in items:
         start = items[date]['start']
         end = items[date]['end']
@@ -190,15 +874,81 @@ def group_by_weekday_start_end(items):
     return result
 
 
+def quarter_of_month(month):
+    """
+    Returns numeral of quarter which given month belongs to.
+    """
+    return month // 4 + 1
+
+
+def quarter_of_day(day):
+    """
+    Returns (year, numeral) of quarter which given date ordinal belongs to.
+    """
+    day = date.fromordinal(day)
+    return day.year, quarter_of_month(day.month)
+
+
+def quarter_days(year, quarter):
+    """
+    Returns ordinals of first day of given quarter and of first day after it.
+    """
+    begin = date(year, max(1, (quarter - 1) * 4), 1)
+    if quarter == 4:
+        end = date(year + 1, 1, 1)
+    else:
+        end = date(year, quarter * 4, 1)
+    return begin.toordinal(), end.toordinal()
+
+
+def has_days_between(days, ranges, begin, end):
+    """
+    Checks if any of given ranges of sorted days column has date ordinal
+    from begin to end excluded.
+    """
+    for range_begin, range_end in ranges:
+        i = bisect_left(days, begin, range_begin, range_end)
+        if i < range_end and days[i] < end:
+            return True
+    return False
+
+
+@cache(600)
 def group_quarters(items):
     """
     Returns quarters sorted by year and numeral.
+
+    Days of every user in store are sorted, so every quarter between
+    the first and the last day is checked by bisection, until some user
+    with entries in it is found.
     """
     quarters = set()
-    for user in items:
-        for date in items[user]:
-            quarter = date.month // 4 + 1
-            quarters.add((date.year, quarter))
+    if isinstance(items, SQLiteStore):
+        for day in items.days():
+            quarters.add(quarter_of_day(day))
+    elif items:
+        segments = [
+            (store.days, [
+                (begin, end) for begin, end in offsets.itervalues()
+                if begin < end
+            ])
+            for store, offsets in items.segments()
+        ]
+        first = min(
+            days[begin] for days, ranges in segments for begin, _ in ranges
+        )
+        last = max(
+            days[end - 1] for days, ranges in segments for _, end in ranges
+        )
+        year, numeral = quarter_of_day(first)
+        begin, end = quarter_days(year, numeral)
+        while begin <= last:
+            if any(has_days_between(days, ranges, begin, end)
+                   for days, ranges in segments):
+                quarters.add((year, numeral))
+            year, numeral = divmod(year * 4 + numeral, 4)
+            numeral += 1
+            begin, end = quarter_days(year, numeral)
 
     result = {}
     for i, quarter in enumerate(sorted(quarters)):
@@ -212,43 +962,190 @@ def group_quarters(items):
 def overtime_hours_in_quarter(items, quarter):
     """
     Returns overtime hours for every user in given quarter.
+
+    Entries of every user are sorted by date, so the ones from given
+    quarter are found by bisection and summed up as difference of running
+    sums of intervals. SQLiteStore sums them up with a single grouped query.
     """
     quarter_num = quarter['numeral']
     year = quarter['year']
     seconds_in_hour = 3600
     working_hours = 8 * working_days_in_quarter(year, quarter_num)
+    begin, end = quarter_days(year, quarter_num)
 
-    overtime = {user: 0 for user in items.keys()}
-    for user, date in items.items():
-        for date_key, entry in date.items():
-            if date_in_quarter(date_key, year, quarter_num):
-                overtime[user] += interval(entry['start'], entry['end'])
-        overtime[user] /= seconds_in_hour
-        overtime[user] -= working_hours
+    overtime = {}
+    if isinstance(items, SQLiteStore):
+        for user, seconds in items.total_seconds(begin, end).iteritems():
+            overtime[user] = seconds // seconds_in_hour - working_hours
+        return overtime
+    totals = {}
+    for store, offsets in items.segments():
+        days, sums = store.days, store.interval_sums()
+        for user, (first, last) in offsets.iteritems():
+            first = bisect_left(days, begin, first, last)
+            last = bisect_left(days, end, first, last)
+            totals[user] = totals.get(user, 0) + sums[last] - sums[first]
+    for user, seconds in totals.iteritems():
+        overtime[user] = seconds // seconds_in_hour - working_hours
     return overtime
 
 
+@cache(600, maxsize=4)
+def overtime_hours_in_quarters(items):
+    """
+    Returns overtime hours for every user in every quarter.
+
+    It creates structure like this, indexed like group_quarters():
+    result = {
+        0: {
+            'user_id': 176,
+        },
+    }
+    """
+    return {
+        i: overtime_hours_in_quarter(items, quarter)
+        for i, quarter in group_quarters(items).items()
+    }
+
+
+@cache(600, maxsize=4)
+def team_statistics(items, teams):
+    """
+    Returns weekday sums and overtime hours in every quarter of every team,
+    summed up from its members in one pass over users with presence.
+
+    It creates structure like this, with quarters indexed like
+    group_quarters():
+    result = {
+        'team_id': {
+            'weekdays': [(count, total, starts, ends), ...],
+            'overtime': {0: 12, 1: -3},
+        },
+    }
+    """
+    memberships = {}
+    for team_id in teams:
+        for user_id in teams.teams[team_id][1]:
+            memberships.setdefault(user_id, []).append(team_id)
+
+    overtime = overtime_hours_in_quarters(items)
+    result = {
+        team_id: {
+            'weekdays': [[0] * AGGREGATES for _ in range(7)],
+            'overtime': dict.fromkeys(overtime, 0),
+        }
+        for team_id in teams
+    }
+    for user_id in items:
+        if user_id not in memberships:
+            continue
+        weekdays = items[user_id].weekdays()
+        for team_id in memberships[user_id]:
+            team = result[team_id]
+            for sums, values in zip(team['weekdays'], weekdays):
+                for i, value in enumerate(values):
+                    sums[i] += value
+            for quarter, hours in overtime.iteritems():
+                team['overtime'][quarter] += hours[user_id]
+
+    for team in result.itervalues():
+        team['weekdays'] = [tuple(sums) for sums in team['weekdays']]
+    return result
+
+
+def working_days(begin, end):
+    """
+    Returns amount of Monday to Friday days between given date ordinals,
+    including begin and excluding end.
+    """
+    weeks, rest = divmod(end - begin, 7)
+    first = weekday(begin)
+    return weeks * 5 + len([i for i in range(rest) if (first + i) % 7 < 5])
+
+
 def working_days_in_quarter(year, quarter):
     """
     Returns working days for given quarter and year.
     """
-    working_days = 0
     start_month = (quarter - 1) * 3 + 1
     start_date = date(year, start_month, 1)
     if quarter == 4:
         end_date = date(year + 1, 1, 1)
     else:
         end_date = date(year, start_month + 3, 1)
-
-    day_count = (end_date - start_date).days
-    for day in (start_date + timedelta(days=i) for i in range(day_count)):
-        if day.weekday() < 5:
-            working_days += 1
-    return working_days
+    return working_days(start_date.toordinal(), end_date.toordinal())
 
 
 def date_in_quarter(date, year, quarter):
     """
     Checks if given date belongs to given quarter of given year.
     """
-    return date.month // 4 + 1 == quarter and date.year == year
+    return quarter_of_month(date.month) == quarter and date.year == year
+
+
+def cache_stats(key):
+    """
+    Returns function collecting given cache_info() key of cached functions.
+    """
+    def collect():
+        """
+        Returns list of (labels, value) tuples.
+        """
+        return [
+            ((name,), func.cache_info()[key])
+            for name, func in CACHES.items()
+        ]
+    return collect
+
+
+def cache_age():
+    """
+    Returns age of results of cached functions without arguments.
+    """
+    ages = [(name, func.cache_age()) for name, func in CACHES.items()]
+    return [((name,), age) for name, age in ages if age is not None]
+
+
+def warmup_stats():
+    """
+    Returns duration of the last warm-up, if there was any.
+    """
+    if WARMUP['seconds'] is None:
+        return []
+    return [((), WARMUP['seconds'])]
+
+
+def readiness():
+    """
+    Returns 1 when warm-up has finished, 0 otherwise.
+    """
+    return [((), int(READY.is_set()))]
+
+
+for stat_key, description in (
+        ('hits', 'Results returned from cache.'),
+        ('misses', 'Results computed on request.'),
+        ('stale', 'Expired results returned during refresh.'),
+        ('refreshes', 'Results refreshed in background.'),
+        ('failures', 'Failed background refreshes.'),
+):
+    Collector(
+        'presence_cache_{}_total'.format(stat_key), description, 'counter',
+        ('function',), cache_stats(stat_key),
+    )
+Collector(
+    'presence_cache_size', 'Stored results.', 'gauge',
+    ('function',), cache_stats('size'),
+)
+Collector(
+    'presence_cache_age_seconds', 'Age of result without arguments.',
+    'gauge', ('function',), cache_age,
+)
+Collector(
+    'presence_warmup_seconds', 'Duration of the last warm-up.', 'gauge',
+    (), warmup_stats,
+)
+Collector(
+    'presence_ready', 'Whether warm-up has finished.', 'gauge',
+    (), readiness,
+)
@@ -3,27 +3,88 @@
 Defines views.
 """
 
-import calendar
-import locale
+import os
+import re
+import signal
+from datetime import date
+from json import dumps
 
-from flask import abort, redirect, url_for
+from flask import Response, abort, redirect, request, url_for
 from flask_mako import exceptions, render_template
 
 from presence_analyzer.main import app
+from presence_analyzer.metrics import render
+from presence_analyzer.parsers import parse_day
 from presence_analyzer.utils import (
+    READY,
+    WEEKDAY_STATISTICS,
+    collation_key,
     get_data,
     get_data_xml,
-    group_by_weekday,
-    group_by_weekday_start_end,
+    get_teams,
     group_quarters,
-    jsonify,
-    mean,
-    overtime_hours_in_quarter,
+    json_response,
+    mean_time_weekday,
+    overtime_hours_in_quarters,
+    presence_start_end,
+    presence_weekday,
+    quarter_days,
+    reload_data,
+    sorted_users,
+    team_statistics,
 )
 
 import logging
 log = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
+# amount of entries sent in one chunk of export
+EXPORT_BATCH = 1000
+
+EXPORT_FORMATS = {
+    'ndjson': (
+        'application/x-ndjson',
+        None,
+        '{{"user_id": {}, "date": "{}", "start": "{}", "end": "{}"}}\n',
+    ),
+    'csv': (
+        'text/csv',
+        'user_id,date,start,end\n',
+        '{},{},{},{}\n',
+    ),
+}
+
+RANGE = re.compile(r'entries=(\d+)-(\d*)$')
+
+
+def requested_users(data):
+    """
+    Returns user ids given as comma separated users parameter or all users
+    of data when it's missing or 'all'.
+    """
+    users = request.args.get('users', 'all')
+    if users == 'all':
+        return data.users
+    try:
+        return [int(user_id) for user_id in users.split(',')]
+    except ValueError:
+        log.debug('Wrong users %s!', users)
+        abort(400)
+
+
+def requested_days():
+    """
+    Returns ordinals of dates given as from and to parameters, missing
+    ones are None.
+    """
+    try:
+        return tuple(
+            parse_day(request.args[name]) if name in request.args else None
+            for name in ('from', 'to')
+        )
+    except ValueError:
+        log.debug('Wrong dates %s!', request.args)
+        abort(400)
+
 
 @app.route('/')
 def mainpage():
@@ -45,91 +106,232 @@ def render_by_name(name):
 
 
 @app.route('/api/v1/users', methods=['GET'])
-@jsonify
+@json_response(get_data_xml)
 def users_view():
     """
     Users listing for dropdown.
     """
-    locale.setlocale(locale.LC_COLLATE, "pl_PL.UTF-8")
-    data = get_data_xml()
-    return sorted([
-        {
-            'user_id': i,
-            'name': user.get('name'),
-            'avatar': user.get('avatar'),
-        }
-        for i, user in data.items()
-    ], key=lambda x: x.get('name'), cmp=locale.strcoll)
+    return sorted_users(get_data_xml())
 
 
 @app.route('/api/v1/mean_time_weekday/<int:user_id>', methods=['GET'])
-@jsonify
+@json_response(get_data)
 def mean_time_weekday_view(user_id):
     """
     Returns mean presence time of given user grouped by weekday.
+
+    Optional from and to parameters limit entries to range of dates.
     """
     data = get_data()
     if user_id not in data:
         log.debug('User %s not found!', user_id)
         abort(404)
 
-    weekdays = group_by_weekday(data[user_id])
-    result = [
-        (calendar.day_abbr[weekday], mean(intervals))
-        for weekday, intervals in enumerate(weekdays)
-    ]
-
-    return result
+    first, last = requested_days()
+    return mean_time_weekday(data[user_id].between(first, last).weekdays())
 
 
 @app.route('/api/v1/presence_weekday/<int:user_id>', methods=['GET'])
-@jsonify
+@json_response(get_data)
 def presence_weekday_view(user_id):
     """
     Returns total presence time of given user grouped by weekday.
+
+    Optional from and to parameters limit entries to range of dates.
     """
     data = get_data()
     if user_id not in data:
         log.debug('User %s not found!', user_id)
         abort(404)
 
-    weekdays = group_by_weekday(data[user_id])
-    result = [
-        (calendar.day_abbr[weekday], sum(intervals))
-        for weekday, intervals in enumerate(weekdays)
-    ]
-
-    result.insert(0, ('Weekday', 'Presence (s)'))
-    return result
+    first, last = requested_days()
+    return presence_weekday(data[user_id].between(first, last).weekdays())
 
 
 @app.route('/api/v1/presence_start_end/<int:user_id>', methods=['GET'])
-@jsonify
+@json_response(get_data)
 def presence_start_end_view(user_id):
     """
     Returns mean start time and mean end time for given user
     grouped by weekday.
+
+    Optional from and to parameters limit entries to range of dates.
     """
     data = get_data()
     if user_id not in data:
         log.debug('User %s not found!', user_id)
         abort(404)
 
-    weekdays = group_by_weekday_start_end(data[user_id])
-    result = [
-        (
-            calendar.day_abbr[weekday],
-            mean(time.get('start', [])),
-            mean(time.get('end', [])),
+    first, last = requested_days()
+    return presence_start_end(data[user_id].between(first, last).weekdays())
+
+
+@app.route('/api/v1/weekdays', methods=['GET'])
+def weekdays_view():
+    """
+    Returns weekday statistics of many users at once.
+
+    Takes comma separated user ids or 'all' in users parameter and names
+    of statistics in metrics parameter, by default all of them. Response
+    is streamed user by user:
+    {
+        'user_id': {
+            'mean_time_weekday': [...],
+            'presence_weekday': [...],
+            'presence_start_end': [...],
+        },
+    }
+    Users not found get null. Optional from and to parameters limit
+    entries to range of dates.
+    """
+    data = get_data()
+    user_ids = requested_users(data)
+    first, last = requested_days()
+
+    names = request.args.get('metrics')
+    names = names.split(',') if names else WEEKDAY_STATISTICS.keys()
+    if not set(names) <= set(WEEKDAY_STATISTICS):
+        log.debug('Wrong metrics %s!', names)
+        abort(400)
+
+    def generate():
+        """
+        Yields JSON representation of statistics of every user.
+        """
+        separator = '{'
+        for user_id in user_ids:
+            result = None
+            if user_id in data:
+                weekdays = data[user_id].between(first, last).weekdays()
+                result = {
+                    name: WEEKDAY_STATISTICS[name](weekdays)
+                    for name in names
+                }
+            yield '{}{}: {}'.format(
+                separator, dumps(str(user_id)), dumps(result)
+            )
+            separator = ',\n'
+        yield '{}' if separator == '{' else '}'
+
+    return Response(generate(), mimetype='application/json')
+
+
+@app.route('/api/v1/presence/export', methods=['GET'])
+def export_view():
+    """
+    Streams presence entries sorted by user and date.
+
+    Entries can be filtered with users, from, to and quarter parameters,
+    format parameter is ndjson (default) or csv. Interrupted export
+    is resumed either with cursor parameter holding user_id:YYYY-MM-DD
+    of the last received entry or with 'Range: entries=first-last' header,
+    which counts entries from 0.
+    """
+    data = get_data()
+    first, last = requested_days()
+
+    quarter_id = request.args.get('quarter')
+    if quarter_id is not None:
+        quarters = group_quarters(data)
+        if not quarter_id.isdigit() or int(quarter_id) not in quarters:
+            log.debug('Quarter %s not found!', quarter_id)
+            abort(404)
+        quarter = quarters[int(quarter_id)]
+        begin, end = quarter_days(quarter['year'], quarter['numeral'])
+        first = begin if first is None else max(first, begin)
+        last = end - 1 if last is None else min(last, end - 1)
+
+    output = request.args.get('format', 'ndjson')
+    if output not in EXPORT_FORMATS:
+        log.debug('Wrong format %s!', output)
+        abort(400)
+    mimetype, header, template = EXPORT_FORMATS[output]
+
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        try:
+            user_id, day = cursor.split(':')
+            cursor = int(user_id), parse_day(day)
+        except ValueError:
+            log.debug('Wrong cursor %s!', cursor)
+            abort(400)
+
+    # views on the same snapshot, so reload doesn't affect running export
+    views = []
+    for user_id in sorted(set(requested_users(data))):
+        if user_id not in data or cursor and user_id < cursor[0]:
+            continue
+        begin = first
+        if cursor and user_id == cursor[0]:
+            begin = cursor[1] + 1 if first is None else max(
+                first, cursor[1] + 1
+            )
+        view = data[user_id].between(begin, last)
+        size = len(view)
+        if size:
+            views.append((user_id, view, size))
+    total = sum(size for _, _, size in views)
+
+    headers = {'Accept-Ranges': 'entries'}
+    status = 200
+    start, stop = 0, total
+    match = RANGE.match(request.headers.get('Range', '').strip())
+    if match:
+        start = int(match.group(1))
+        if match.group(2):
+            stop = min(int(match.group(2)) + 1, total)
+        if start >= stop:
+            headers['Content-Range'] = 'entries */{}'.format(total)
+            return Response(status=416, headers=headers)
+        headers['Content-Range'] = 'entries {}-{}/{}'.format(
+            start, stop - 1, total
         )
-        for weekday, time in enumerate(weekdays)
-    ]
+        status = 206
+    if start or cursor:
+        header = None
 
-    return result
+    def generate():
+        """
+        Yields formatted entries in chunks.
+        """
+        days = {}
+        times = {}
+        skip, remaining = start, stop - start
+        lines = [header] if header else []
+        for user_id, view, size in views:
+            if skip >= size:
+                skip -= size
+                continue
+            count = min(size - skip, remaining)
+            entries = view.entries(skip, count)
+            skip = 0
+            remaining -= count
+            for day, entry_start, entry_end in entries:
+                if day not in days:
+                    days[day] = date.fromordinal(day).isoformat()
+                for seconds in (entry_start, entry_end):
+                    if seconds not in times:
+                        times[seconds] = '{:02d}:{:02d}:{:02d}'.format(
+                            seconds // 3600, seconds // 60 % 60, seconds % 60
+                        )
+                lines.append(template.format(
+                    user_id, days[day], times[entry_start], times[entry_end]
+                ))
+                if len(lines) >= EXPORT_BATCH:
+                    yield ''.join(lines)
+                    del lines[:]
+            if not remaining:
+                break
+        if lines:
+            yield ''.join(lines)
+
+    return Response(
+        generate(), status=status, headers=headers, mimetype=mimetype
+    )
 
 
 @app.route('/api/v1/quarters', methods=['GET'])
-@jsonify
+@json_response(get_data)
 def quarters_view():
     """
     Quarters listing for dropdown.
@@ -149,15 +351,18 @@ def quarters_view():
 
 
 @app.route('/api/v1/overtime_in_quarter/<int:quarter_id>', methods=['GET'])
-@jsonify
+@json_response(get_data, get_data_xml)
 def overtime_in_quarter(quarter_id):
     """
     Returns top 3 users with most overtime hours in given quarter.
     """
-    data = get_data()
+    overtime = overtime_hours_in_quarters(get_data())
+    if quarter_id not in overtime:
+        log.debug('Quarter %s not found!', quarter_id)
+        abort(404)
+
     users = get_data_xml()
-    quarters = group_quarters(data)
-    result = overtime_hours_in_quarter(data, quarters[quarter_id])
+    result = overtime[quarter_id]
     return sorted(
         [
             (
@@ -169,3 +374,110 @@ def overtime_in_quarter(quarter_id):
         key=lambda x: x[1],
         reverse=True
     )[:3]
+
+
+@app.route('/api/v1/teams', methods=['GET'])
+@json_response(get_teams)
+def teams_view():
+    """
+    Teams listing with ids of their members.
+    """
+    teams = get_teams()
+    return sorted([
+        dict(teams[team_id], team_id=team_id) for team_id in teams
+    ], key=lambda x: collation_key(x.get('name')))
+
+
+@app.route('/api/v1/teams/<string:name>', methods=['GET'])
+@json_response(get_data, get_teams)
+def team_weekdays_view(name):
+    """
+    Returns weekday statistic of given name, like mean_time_weekday,
+    presence_weekday or presence_start_end, for every team at once:
+    {
+        'team_id': [...],
+    }
+    """
+    if name not in WEEKDAY_STATISTICS:
+        log.debug('Statistic %s not found!', name)
+        abort(404)
+
+    statistics = team_statistics(get_data(), get_teams())
+    return {
+        team_id: WEEKDAY_STATISTICS[name](team['weekdays'])
+        for team_id, team in statistics.iteritems()
+    }
+
+
+@app.route(
+    '/api/v1/teams/overtime_in_quarter/<int:quarter_id>', methods=['GET']
+)
+@json_response(get_data, get_teams)
+def team_overtime_view(quarter_id):
+    """
+    Returns overtime hours of every team in given quarter, summed up
+    from its members.
+    """
+    data = get_data()
+    if quarter_id not in group_quarters(data):
+        log.debug('Quarter %s not found!', quarter_id)
+        abort(404)
+
+    statistics = team_statistics(data, get_teams())
+    return {
+        team_id: team['overtime'][quarter_id]
+        for team_id, team in statistics.iteritems()
+    }
+
+
+@app.route('/api/v1/reload', methods=['POST'])
+def reload_view():
+    """
+    Loads data files again, allowed only from local host.
+
+    Pre-forked worker only asks the master to reload, as other workers
+    would never get this request.
+    """
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        log.debug('Reload from %s refused!', request.remote_addr)
+        abort(403)
+
+    master = app.config.get('PREFORK_MASTER')
+    if master:
+        os.kill(master, signal.SIGHUP)
+        return Response(
+            dumps({'reloading': True}), status=202,
+            mimetype='application/json',
+        )
+
+    data, users = reload_data()
+    return Response(
+        dumps({'data': data.version, 'users': users.version}),
+        mimetype='application/json',
+    )
+
+
+@app.route('/healthz', methods=['GET'])
+def healthz_view():
+    """
+    Answers as long as the process serves requests.
+    """
+    return Response('ok\n', mimetype='text/plain')
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz_view():
+    """
+    Answers with 503 until data is loaded by warm-up.
+    """
+    if not READY.is_set():
+        return Response('warming up\n', status=503, mimetype='text/plain')
+    return Response('ok\n', mimetype='text/plain')
+
+
+@app.route('/api/v1/metrics', methods=['GET'])
+def metrics_view():
+    """
+    Returns metrics in Prometheus text format.
+    """
+    return Response(render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Detection of changed data files.
+
+Directories of watched files are watched with inotify on Linux, so
+unchanged files cost nothing to check. Where inotify isn't available,
+inode, size and modification time of the file are compared on every
+check instead.
+"""
+
+import ctypes
+import errno
+import os
+import struct
+import sys
+import threading
+
+import logging
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# inotify event flags, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+
+# events changing content or name of a file, the directory is watched,
+# so files replaced by rename are noticed as well
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+    IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# watch descriptor, mask, cookie and length of name following it
+EVENT = struct.Struct('iIII')
+
+
+def encode_path(file_name):
+    """
+    Returns absolute path of given file as bytes, like inotify reports it.
+    """
+    if isinstance(file_name, unicode):
+        file_name = file_name.encode(sys.getfilesystemencoding())
+    return os.path.abspath(file_name)
+
+
+def file_signature(file_name):
+    """
+    Returns (inode, size, modification time) of given file,
+    or None when it doesn't exist.
+    """
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime
+
+
+class Inotify(object):
+    """
+    Counts events of watched files from a daemon thread.
+
+    Their directories are watched, so files replaced by rename keep being
+    noticed, but events of other names in these directories are ignored.
+
+    Raises OSError when inotify isn't available.
+    """
+
+    def __init__(self):
+        try:
+            self.libc = ctypes.CDLL(None, use_errno=True)
+            self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        except AttributeError:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        self.lock = threading.Lock()
+        self.directories = {}
+        self.watches = {}
+        self.events = {}
+        self.overflows = 0
+        thread = threading.Thread(target=self.run, name='inotify')
+        thread.daemon = True
+        thread.start()
+
+    def watch(self, file_name):
+        """
+        Starts watching given file through its directory.
+        """
+        file_name = encode_path(file_name)
+        directory = os.path.dirname(file_name)
+        with self.lock:
+            self.events.setdefault(file_name, 0)
+            if directory in self.directories:
+                return
+            descriptor = self.libc.inotify_add_watch(
+                self.fd, directory, WATCH_MASK
+            )
+            if descriptor < 0:
+                code = ctypes.get_errno()
+                raise OSError(code, os.strerror(code), directory)
+            self.directories[directory] = descriptor
+            self.watches[descriptor] = directory
+
+    def generation(self, file_name):
+        """
+        Returns number which changes with every event of given file.
+        """
+        file_name = encode_path(file_name)
+        with self.lock:
+            return self.overflows, self.events.get(file_name, 0)
+
+    def run(self):
+        """
+        Reads events until the process ends.
+        """
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as error:
+                if error.errno == errno.EINTR:
+                    continue
+                log.exception('Reading inotify events failed')
+                return
+            offset = 0
+            with self.lock:
+                while offset < len(data):
+                    descriptor, mask, _, length = EVENT.unpack_from(
+                        data, offset
+                    )
+                    offset += EVENT.size
+                    name = data[offset:offset + length].rstrip('\0')
+                    offset += length
+                    if mask & IN_Q_OVERFLOW:
+                        self.overflows += 1
+                    directory = self.watches.get(descriptor)
+                    if directory is None or not name:
+                        continue
+                    path = os.path.join(directory, name)
+                    if path in self.events:
+                        self.events[path] += 1
+
+
+class FileWatcher(object):
+    """
+    Tells whether files changed since they were checked last time.
+
+    A file is stat only after inotify reported an event of it, or on every
+    check when inotify isn't available. Forked processes start
+    their own inotify instance, as events can't be shared with the parent.
+    """
+
+    def __init__(self, use_inotify=True):
+        self.use_inotify = use_inotify
+        self.lock = threading.Lock()
+        self.inotify = None
+        self.pid = None
+        self.files = {}
+
+    def _inotify(self):
+        """
+        Returns inotify instance of this process or None.
+        """
+        if not self.use_inotify:
+            return None
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.files = {}
+            try:
+                self.inotify = Inotify()
+            except OSError:
+                log.warning('Falling back to stat, inotify failed',
+                            exc_info=True)
+                self.inotify = None
+        return self.inotify
+
+    def changed(self, file_name):
+        """
+        Returns True when given file changed since the previous check
+        or wasn't checked before.
+        """
+        file_name = encode_path(file_name)
+        with self.lock:
+            inotify = self._inotify()
+            generation = None
+            if inotify is not None:
+                try:
+                    inotify.watch(file_name)
+                    generation = inotify.generation(file_name)
+                except OSError:
+                    log.debug('Watching %s failed', file_name, exc_info=True)
+            known = self.files.get(file_name)
+            if known is not None and generation is not None and \
+               known[0] == generation:
+                return False
+            signature = file_signature(file_name)
+            self.files[file_name] = (generation, signature)
+            return known is None or known[1] != signature